@@ -1,41 +1,549 @@
 import os
 import time
-import uuid
+import threading
 from pathlib import Path
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, Response, g, render_template, request, jsonify
+from werkzeug.wsgi import ClosingIterator
+from utils.admission import AdmissionControl, Overloaded
+from utils.blob_store import BlobStore
+from utils.cleaner import FileCleaner
+from utils.expiry_index import ExpiryIndex
+from utils.file_server import FileServer
+from utils.media_cache import MediaCache
+from utils.metadata_cache import MetadataCache
+from utils.metrics import Metrics, NULL_METRICS
+from utils.jobs import JobQueue
+from utils.pacer import TokenBucket
+from utils.profile_archives import ProfileArchives
+from utils.profile_sync import ProfileSync
+from utils.profiler import RequestProfiler
+from utils.rate_limiter import SharedRateLimiter
+from utils.singleflight import SingleFlight
+from utils.upstream_health import UpstreamHealth, UpstreamUnavailable
+from utils.validators import InputValidator
+from utils.zipper import ZipCreator
 
 def create_app():
     app = Flask(__name__)
     app.config['SECRET_KEY'] = os.urandom(24).hex()
     
     base_dir = Path(__file__).parent
-    downloads_dir = base_dir / 'downloads'
+    downloads_dir = Path(os.environ.get('DOWNLOADS_DIR', base_dir / 'downloads'))
     (downloads_dir / 'single').mkdir(parents=True, exist_ok=True)
     (downloads_dir / 'profiles').mkdir(parents=True, exist_ok=True)
     (downloads_dir / 'zips').mkdir(parents=True, exist_ok=True)
     
+    app.config['MEDIA_CACHE_MAX_MB'] = int(os.environ.get('MEDIA_CACHE_MAX_MB', 2048))
+    app.config['MEDIA_CACHE_TTL_MINUTES'] = int(os.environ.get('MEDIA_CACHE_TTL_MINUTES', 1440))
+    app.config['METADATA_TTL_MINUTES'] = int(os.environ.get('METADATA_TTL_MINUTES', 60))
+    app.config['METADATA_NEGATIVE_TTL_MINUTES'] = int(os.environ.get('METADATA_NEGATIVE_TTL_MINUTES', 10))
+    app.config['METADATA_MAX_ENTRIES'] = int(os.environ.get('METADATA_MAX_ENTRIES', 100000))
+    app.config['RATE_LIMIT'] = int(os.environ.get('RATE_LIMIT', 20))
+    app.config['CLEANUP_TIME'] = int(os.environ.get('CLEANUP_TIME', 30))
+    app.config['DISK_QUOTA_MB'] = int(os.environ.get('DISK_QUOTA_MB', 4096))
+    app.config['JOB_QUEUE_ENABLED'] = os.environ.get('JOB_QUEUE_ENABLED', '1') == '1'
+    app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 2))
+    app.config['JOB_QUEUE_SIZE'] = int(os.environ.get('JOB_QUEUE_SIZE', 50))
+    app.config['JOB_TIMEOUT'] = int(os.environ.get('JOB_TIMEOUT', 600))
+    app.config['UPSTREAM_RATE'] = float(os.environ.get('UPSTREAM_RATE', 1.0))
+    app.config['UPSTREAM_BURST'] = int(os.environ.get('UPSTREAM_BURST', 3))
+    app.config['SESSION_POOL_SIZE'] = int(os.environ.get('SESSION_POOL_SIZE', 4))
+    app.config['SESSION_POOL_PREWARM'] = os.environ.get('SESSION_POOL_PREWARM', '1') == '1'
+    app.config['PROFILE_WORKERS'] = int(os.environ.get('PROFILE_WORKERS', 3))
+    app.config['PROFILE_LIBRARY_TTL_MINUTES'] = int(os.environ.get('PROFILE_LIBRARY_TTL_MINUTES', 1440))
+    app.config['PROFILE_MAX_POSTS'] = int(os.environ.get('PROFILE_MAX_POSTS', 50))
+    app.config['PROFILE_MAX_MB'] = int(os.environ.get('PROFILE_MAX_MB', 0))
+    app.config['PROFILE_MAX_SECONDS'] = int(os.environ.get('PROFILE_MAX_SECONDS', 0))
+    app.config['PROFILE_MANIFEST'] = os.environ.get('PROFILE_MANIFEST', '0') == '1'
+    app.config['PROFILE_ARCHIVE_CACHE'] = os.environ.get('PROFILE_ARCHIVE_CACHE', '1') == '1'
+    app.config['PROFILE_ARCHIVE_TTL_MINUTES'] = int(os.environ.get('PROFILE_ARCHIVE_TTL_MINUTES', 1440))
+    app.config['PROFILE_ARCHIVE_MAX_APPEND'] = int(os.environ.get('PROFILE_ARCHIVE_MAX_APPEND', 10))
+    app.config['BATCH_WORKERS'] = int(os.environ.get('BATCH_WORKERS', 4))
+    app.config['BATCH_MAX_ITEMS'] = int(os.environ.get('BATCH_MAX_ITEMS', 200))
+    app.config['ZIP_MODE'] = os.environ.get('ZIP_MODE', 'stream')
+    app.config['SINGLE_MODE'] = os.environ.get('SINGLE_MODE', 'download')
+    app.config['STREAM_TEE'] = os.environ.get('STREAM_TEE', '1') == '1'
+    app.config['SERVE_OFFLOAD'] = os.environ.get('SERVE_OFFLOAD', '')
+    app.config['SERVE_OFFLOAD_PREFIX'] = os.environ.get('SERVE_OFFLOAD_PREFIX', '/protected')
+    app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', '1') == '1'
+    app.config['METRICS_FLUSH_SECONDS'] = float(os.environ.get('METRICS_FLUSH_SECONDS', 10))
+    app.config['UPSTREAM_BREAKER_ENABLED'] = os.environ.get('UPSTREAM_BREAKER_ENABLED', '1') == '1'
+    app.config['UPSTREAM_FAILURE_RATIO'] = float(os.environ.get('UPSTREAM_FAILURE_RATIO', 0.5))
+    app.config['UPSTREAM_BACKOFF_SECONDS'] = float(os.environ.get('UPSTREAM_BACKOFF_SECONDS', 5))
+    app.config['UPSTREAM_BACKOFF_MAX_SECONDS'] = float(os.environ.get('UPSTREAM_BACKOFF_MAX_SECONDS', 600))
+    app.config['UPSTREAM_MAX_WAIT'] = float(os.environ.get('UPSTREAM_MAX_WAIT', 0))
+    app.config['ADMISSION_MAX_IN_FLIGHT'] = int(os.environ.get('ADMISSION_MAX_IN_FLIGHT', 0))
+    app.config['ADMISSION_MAX_QUEUE_WAIT'] = float(os.environ.get('ADMISSION_MAX_QUEUE_WAIT', 120))
+    app.config['PROFILING_SAMPLE_RATE'] = float(os.environ.get('PROFILING_SAMPLE_RATE', 0))
+    app.config['PROFILING_TOKEN'] = os.environ.get('PROFILING_TOKEN', '')
+    app.config['PROFILING_RING_SIZE'] = int(os.environ.get('PROFILING_RING_SIZE', 50))
+    app.config['PROFILING_INTERVAL_MS'] = float(os.environ.get('PROFILING_INTERVAL_MS', 5))
+    
+    # Disabled metrics are a no-op object, so instrumented code never checks
+    metrics = NULL_METRICS
+    if app.config['METRICS_ENABLED']:
+        metrics = Metrics(downloads_dir / 'metrics.db', flush_seconds=app.config['METRICS_FLUSH_SECONDS'])
+    
+    # Sampled or token-triggered requests dump stacks and stage allocations; when off, no hook is installed
+    profiler = None
+    if app.config['PROFILING_SAMPLE_RATE'] > 0 or app.config['PROFILING_TOKEN']:
+        profiler = RequestProfiler(
+            downloads_dir / 'profiling',
+            downloads_dir / 'profiling.db',
+            sample_rate=app.config['PROFILING_SAMPLE_RATE'],
+            token=app.config['PROFILING_TOKEN'],
+            ring_size=app.config['PROFILING_RING_SIZE'],
+            interval=app.config['PROFILING_INTERVAL_MS'] / 1000
+        )
+        metrics = profiler.instrument(metrics)
+    
+    # Every downloaded video is stored once; single, profile and batch results link to it
+    blob_store = BlobStore(downloads_dir / 'blobs', downloads_dir / 'blob_store.db')
+    media_cache = MediaCache(
+        downloads_dir / 'single',
+        downloads_dir / 'media_cache.db',
+        max_bytes=app.config['MEDIA_CACHE_MAX_MB'] * 1024 * 1024,
+        ttl_seconds=app.config['MEDIA_CACHE_TTL_MINUTES'] * 60,
+        blob_store=blob_store
+    )
+    metadata_cache = MetadataCache(
+        downloads_dir / 'metadata_cache.db',
+        max_entries=app.config['METADATA_MAX_ENTRIES'],
+        ttl_seconds=app.config['METADATA_TTL_MINUTES'] * 60,
+        not_found_ttl=app.config['METADATA_NEGATIVE_TTL_MINUTES'] * 60
+    )
+    # Profiles and ZIPs are registered when created, so cleanup never scans directories
+    expiry_index = ExpiryIndex(downloads_dir, downloads_dir / 'expiry_index.db')
+    cleaner = FileCleaner(
+        downloads_dir,
+        app.config['CLEANUP_TIME'],
+        media_cache=media_cache,
+        expiry_index=expiry_index,
+        quota_bytes=app.config['DISK_QUOTA_MB'] * 1024 * 1024,
+        interval_seconds=60,
+        metrics=metrics,
+        blob_store=blob_store
+    )
+    cleaner.start_cleanup_thread()
+    validator = InputValidator()
+    zipper = ZipCreator(metrics)
+    file_server = FileServer(downloads_dir, offload=app.config['SERVE_OFFLOAD'],
+                             internal_prefix=app.config['SERVE_OFFLOAD_PREFIX'])
+    rate_limiter = SharedRateLimiter(downloads_dir / 'rate_limit.db', max_requests=app.config['RATE_LIMIT'])
+    pacer = TokenBucket(app.config['UPSTREAM_RATE'], app.config['UPSTREAM_BURST'])
+    profile_sync = ProfileSync(downloads_dir / 'library', downloads_dir / 'profile_sync.db',
+                               ttl_seconds=app.config['PROFILE_LIBRARY_TTL_MINUTES'] * 60)
+    # Server-wide ceilings; a request may only ask for less
+    profile_limits = {
+        'max_posts': app.config['PROFILE_MAX_POSTS'],
+        'max_bytes': app.config['PROFILE_MAX_MB'] * 1024 * 1024,
+        'max_seconds': app.config['PROFILE_MAX_SECONDS'],
+        'manifest': app.config['PROFILE_MANIFEST']
+    }
+    # Finished profile ZIPs are reused while the profile has no newer video; stream mode never builds them
+    profile_archives = None
+    if app.config['PROFILE_ARCHIVE_CACHE'] and app.config['ZIP_MODE'] != 'stream':
+        profile_archives = ProfileArchives(downloads_dir / 'zips', downloads_dir / 'profile_archives.db')
+    singleflight = SingleFlight(downloads_dir / 'inflight', wait_timeout=app.config['JOB_TIMEOUT'])
+    # One 429 in any worker makes every worker back off
+    upstream_health = None
+    if app.config['UPSTREAM_BREAKER_ENABLED']:
+        upstream_health = UpstreamHealth(
+            downloads_dir / 'upstream_health.db',
+            failure_ratio=app.config['UPSTREAM_FAILURE_RATIO'],
+            base_backoff=app.config['UPSTREAM_BACKOFF_SECONDS'],
+            max_backoff=app.config['UPSTREAM_BACKOFF_MAX_SECONDS'],
+            max_wait=app.config['UPSTREAM_MAX_WAIT']
+        )
+    
+    # Heavy requests beyond this many in flight over all workers get a fast 503
+    admission = None
+    if app.config['ADMISSION_MAX_IN_FLIGHT'] > 0:
+        admission = AdmissionControl(downloads_dir / 'admission.db', app.config['ADMISSION_MAX_IN_FLIGHT'])
+    
     # Import here to avoid startup errors
     try:
         import instaloader
-        loader = instaloader.Instaloader(
-            download_videos=True,
-            download_video_thumbnails=False,
-            download_geotags=False,
-            download_comments=False,
-            save_metadata=False,
-            user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        )
+        from utils.session_pool import SessionPool
+        
+        def make_loader():
+            return instaloader.Instaloader(
+                download_videos=True,
+                download_video_thumbnails=False,
+                download_geotags=False,
+                download_comments=False,
+                save_metadata=False,
+                compress_json=False,
+                post_metadata_txt_pattern='',
+                max_connection_attempts=3,
+                # The token bucket is the only throttle; Instaloader's random pre-query sleep would add to it
+                sleep=False,
+                dirname_pattern=str(downloads_dir / 'single'),
+                filename_pattern='{target}',
+                user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+                rate_controller=pacer.rate_controller()
+            )
+        
+        # Every request and job checks a loader out instead of sharing one context
+        session_pool = SessionPool(make_loader, size=app.config['SESSION_POOL_SIZE'], metrics=metrics,
+                                   health=upstream_health)
+        if app.config['SESSION_POOL_PREWARM']:
+            threading.Thread(target=session_pool.warm,
+                             args=(('https://www.instagram.com/', 'https://i.instagram.com/'),),
+                             daemon=True).start()
+        from utils.downloader import InstagramDownloader
+        downloader = InstagramDownloader(downloads_dir, media_cache=media_cache, pacer=pacer,
+                                         workers=app.config['PROFILE_WORKERS'], singleflight=singleflight,
+                                         metadata_cache=metadata_cache, cleaner=cleaner,
+                                         profile_sync=profile_sync, session_pool=session_pool,
+                                         metrics=metrics, blob_store=blob_store)
+        from utils.stream_proxy import StreamProxy
+        stream_proxy = StreamProxy(media_cache, tee=app.config['STREAM_TEE'], pacer=pacer,
+                                   health=upstream_health)
+        from utils.batch import BatchDownloader
+        batch_downloader = BatchDownloader(downloader, downloads_dir, workers=app.config['BATCH_WORKERS'],
+                                           cleaner=cleaner, profile_limits=profile_limits)
         INSTALOADER_AVAILABLE = True
     except:
         INSTALOADER_AVAILABLE = False
-        loader = None
+        session_pool = None
+        downloader = None
+        stream_proxy = None
+        batch_downloader = None
+    
+    # Shared components, for scripts and benchmarks that drive them directly
+    app.extensions['downloader'] = downloader
+    app.extensions['zipper'] = zipper
+    
+    def run_single_job(payload, progress):
+        result = downloader.download_single_post(payload['url'], progress=progress)
+        if result['success']:
+            result.update({
+                'type': 'single',
+                'video_url': '/serve/' + result['filename'],
+                'message': 'Download ready!'
+            })
+        return result
+    
+    def run_profile_job(payload, progress):
+        limits = payload.get('limits', profile_limits)
+        previous = profile_archives.previous(payload['username'], limits) if profile_archives else None
+        if previous is not None:
+            # One profile lookup and its first timeline page decide whether anything changed
+            head = downloader.profile_head(payload['username'])
+            if not head['success']:
+                return head
+            if profile_archives.is_current(previous, head['newest'], limits):
+                cleaner.touch(previous['filepath'])
+                return {
+                    'success': True,
+                    'type': 'profile',
+                    'post_count': previous['post_count'],
+                    'bytes': previous['bytes'],
+                    'reused': previous['post_count'],
+                    'failed': 0,
+                    'stopped': None,
+                    'cached': True,
+                    'timings': {},
+                    'zip_url': '/zip/' + previous['filename'],
+                    'filename': previous['filename'],
+                    'message': 'Profile download complete!'
+                }
+        
+        result = downloader.download_profile(payload['username'], progress=progress, **limits)
+        if not result['success']:
+            return result
+        
+        if app.config['ZIP_MODE'] == 'stream':
+            # The archive is generated while the client downloads it
+            if not Path(result['download_path']).is_dir():
+                return evicted()
+            profile_dir = Path(result['download_path']).name
+            zip_url = '/archive/' + profile_dir
+            filename = profile_dir + '.zip'
+        else:
+            progress(0.95, 'Creating ZIP file')
+            with cleaner.in_use(result['download_path']):
+                if not Path(result['download_path']).is_dir():
+                    return evicted()
+                archive = build_profile_zip(result, limits, previous)
+            if not archive['success']:
+                return archive
+            if not Path(archive['filepath']).exists():
+                return evicted()
+            zip_url = '/zip/' + archive['filename']
+            filename = archive['filename']
+        
+        return {
+            'success': True,
+            'type': 'profile',
+            'post_count': result['post_count'],
+            'bytes': result['bytes'],
+            'reused': result['reused'],
+            'failed': result['failed'],
+            'stopped': result['stopped'],
+            'timings': result['timings'],
+            'zip_url': zip_url,
+            'filename': filename,
+            'message': 'Profile download complete!'
+        }
+    
+    def evicted():
+        """Result of a job whose output was evicted to keep the disk quota before it could be served"""
+        return {'success': False, 'error': 'The download was removed to stay within the disk quota, please retry',
+                'status': 507}
+    
+    def build_profile_zip(result, limits, previous):
+        """
+        Zips a profile result, appending to the profile's previous archive when
+        only a few videos are new, and keeps it for reuse if it is complete
+        """
+        # Partial runs are not reusable: a later request might allow more
+        reusable = (profile_archives is not None and not result['failed']
+                    and result['stopped'] in (None, 'posts'))
+        
+        archive = None
+        if reusable and previous is not None:
+            room = app.config['PROFILE_ARCHIVE_MAX_APPEND']
+            if limits.get('max_posts'):
+                # An append keeps every previous entry; past max_posts the archive is rebuilt instead
+                room = min(room, limits['max_posts'] - previous['post_count'])
+            archive = zipper.append_profile_zip(previous['filepath'], result['download_path'], result['username'],
+                                                room)
+        appended = archive is not None and archive['success']
+        if not appended:
+            archive = zipper.create_profile_zip(result['download_path'], result['username'])
+            if not archive['success']:
+                return archive
+        
+        # Held while tracked, so the quota others went over is not taken out of the new archive
+        with cleaner.in_use(archive['filepath']):
+            if not reusable:
+                cleaner.track(archive['filepath'])
+                return archive
+            # Evicted least recently used first when the downloads directory is over quota
+            cleaner.track(archive['filepath'], app.config['PROFILE_ARCHIVE_TTL_MINUTES'] * 60)
+        post_count = previous['post_count'] + archive['added'] if appended else result['post_count']
+        profile_archives.put(result['username'], limits, result['newest'], archive['filename'], post_count,
+                             appended=appended)
+        return archive
+    
+    def run_batch_job(payload, progress):
+        manifest = batch_downloader.run(payload['items'], payload['rejected'], progress=progress)
+        if manifest['success']:
+            manifest.update({
+                'type': 'batch',
+                'zip_url': '/batch/' + manifest['batch_id'] + '/archive',
+                'filename': 'batch_' + manifest['batch_id'] + '.zip',
+                'message': str(manifest['succeeded']) + ' of ' + str(len(manifest['items'])) + ' items downloaded'
+            })
+        return manifest
+    
+    def profiled(handler):
+        """Wraps a job handler to profile jobs queued by a profiled request"""
+        def run(payload, progress):
+            if not payload.get('profile'):
+                return handler(payload, progress)
+            with profiler.session(payload['profile']) as session:
+                result = handler(payload, progress)
+            result['profile_id'] = session.dump_id
+            return result
+        return run
+    
+    job_queue = None
+    if INSTALOADER_AVAILABLE and app.config['JOB_QUEUE_ENABLED']:
+        handlers = {'single': run_single_job, 'profile': run_profile_job, 'batch': run_batch_job}
+        if profiler is not None:
+            handlers = {kind: profiled(handler) for kind, handler in handlers.items()}
+        job_queue = JobQueue(
+            downloads_dir / 'jobs.db',
+            handlers,
+            workers=app.config['JOB_WORKERS'],
+            max_queue=app.config['JOB_QUEUE_SIZE'],
+            job_timeout=app.config['JOB_TIMEOUT']
+        )
+        job_queue.start()
+    
+    def enqueue(kind, payload):
+        # A job that would only start after the client gave up is turned away now
+        wait = job_queue.estimated_wait()
+        if app.config['ADMISSION_MAX_QUEUE_WAIT'] and wait > app.config['ADMISSION_MAX_QUEUE_WAIT']:
+            metrics.incr('shed_total', kind='job')
+            return overloaded(wait)
+        
+        if profiler is not None and 'profile' in g:
+            # The work happens on a job thread, so the job is profiled instead of this request
+            session = g.pop('profile')
+            profiler.discard(session)
+            payload = dict(payload, profile=session.label)
+        
+        job_id = job_queue.submit(kind, payload)
+        if job_id is None:
+            return overloaded(wait)
+        return jsonify({
+            'success': True,
+            'job_id': job_id,
+            'status_url': '/jobs/' + job_id,
+            'message': 'Download queued'
+        }), 202
+    
+    def resolve_video(shortcode, fresh=False):
+        """Looks up owner, caption and CDN URL, from the metadata cache unless fresh"""
+        meta = None if fresh else metadata_cache.get(shortcode)
+        if meta is None or (meta['status'] == 'ok' and not meta['video_url']):
+            try:
+                with session_pool.session() as loader, metrics.span('post_metadata'):
+                    post = instaloader.Post.from_shortcode(loader.context, shortcode)
+            except (instaloader.exceptions.QueryReturnedNotFoundException,
+                    instaloader.exceptions.BadResponseException) as e:
+                metrics.incr('upstream_errors_total', type=type(e).__name__)
+                metadata_cache.record_missing(shortcode)
+                return {'success': False, 'error': 'Post not found', 'status': 404}
+            except UpstreamUnavailable as e:
+                return {'success': False, 'error': str(e), 'status': 503, 'retry_after': e.retry_after}
+            metadata_cache.record_post(post)
+            meta = {
+                'status': 'ok' if post.is_video else 'not_video',
+                'owner': post.owner_username,
+                'caption': post.caption or '',
+                'video_url': post.video_url if post.is_video else ''
+            }
+        
+        if meta['status'] == 'not_found':
+            return {'success': False, 'error': 'Post not found', 'status': 404}
+        if meta['status'] == 'not_video':
+            return {'success': False, 'error': 'This post does not contain a video', 'status': 400}
+        return {'success': True, 'owner': meta['owner'], 'caption': meta['caption'], 'video_url': meta['video_url']}
+    
+    if app.config['METRICS_ENABLED']:
+        # Time to response headers; bodies are timed by their own spans until the last byte is sent
+        @app.before_request
+        def start_timer():
+            g.started = time.perf_counter()
+        
+        @app.after_request
+        def record_request(response):
+            if 'started' in g:
+                endpoint = request.endpoint or 'unknown'
+                metrics.observe('request_seconds', time.perf_counter() - g.started, endpoint=endpoint)
+                metrics.incr('requests_total', endpoint=endpoint, status=response.status_code)
+            return response
+    
+    if profiler is not None:
+        # Downloads, and ZIPs served or streamed; the latter are profiled until the last byte is sent
+        profiled_endpoints = ('download', 'serve_zip', 'stream_archive', 'stream_batch_archive')
+        
+        @app.before_request
+        def start_profile():
+            if request.endpoint not in profiled_endpoints:
+                return
+            if not profiler.wanted(request.headers.get('X-Profile-Token')):
+                return
+            if request.endpoint == 'download':
+                data = request.get_json(silent=True) or {}
+                g.profile = profiler.start('download ' + str(data.get('url', '')).strip())
+            else:
+                g.profile = profiler.start(request.method + ' ' + request.path)
+        
+        @app.after_request
+        def dump_profile(response):
+            session = g.pop('profile', None)
+            if session is not None:
+                response.headers['X-Profile-Id'] = profiler.finish(session, status=response.status_code)
+            elif 'profile_id' in g:
+                # Handed over to the body, which dumps it once sent
+                response.headers['X-Profile-Id'] = g.profile_id
+            return response
+        
+        @app.teardown_request
+        def dump_profile_on_error(error):
+            session = g.pop('profile', None)
+            if session is not None:
+                profiler.finish(session, error=str(error))
+    
+    def body_span(stage):
+        """
+        Starts a stage span for a body the server sends after the view returns;
+        the request's admission slot is released and its profiling session
+        dumped at the same point. Werkzeug never runs close hooks of
+        direct-passthrough responses, so their bodies must end through this
+        Returns: function ending the span, called once the last byte is sent
+        """
+        started = time.perf_counter()
+        slot = g.pop('admission_slot', None)
+        session = g.pop('profile', None)
+        if session is not None:
+            g.profile_id = profiler.reserve(session)
+        
+        def end():
+            metrics.observe('stage_seconds', time.perf_counter() - started, stage=stage)
+            if slot is not None:
+                admission.leave(slot)
+            if session is not None:
+                profiler.finish(session, stage=stage)
+        return end
     
     @app.route('/')
     def index():
         return render_template('index.html')
     
+    def failed(result, **body):
+        """Turns a failed result into an error response; Retry-After while upstream backs off"""
+        response = jsonify(dict(body, error=result['error']))
+        if result.get('retry_after'):
+            response.headers['Retry-After'] = str(max(1, round(result['retry_after'])))
+        return response, result.get('status', 500)
+    
+    def rate_limited():
+        """Returns a 429 response if the client is over its limit"""
+        if rate_limiter.allow_request(request.remote_addr or 'unknown'):
+            return None
+        metrics.incr('rate_limited_total')
+        response = jsonify({'success': False, 'error': 'Too many requests. Please wait a minute and try again.'})
+        response.headers['Retry-After'] = str(rate_limiter.window_seconds)
+        return response, 429
+    
+    def overloaded(retry_after):
+        """Returns the fast 503 for a request shed under load"""
+        response = jsonify({'success': False, 'error': 'Server is busy, please try again shortly'})
+        response.headers['Retry-After'] = str(max(1, round(retry_after)))
+        return response, 503
+    
+    def admit(kind):
+        """
+        Claims an in-flight slot for a heavy request, released once its
+        response has been sent; returns a 503 response if none is free
+        """
+        if admission is None:
+            return None
+        try:
+            g.admission_slot = admission.enter(kind)
+        except Overloaded as e:
+            metrics.incr('shed_total', kind=kind)
+            return overloaded(e.retry_after)
+        return None
+    
+    if admission is not None:
+        @app.after_request
+        def release_slot(response):
+            slot = g.pop('admission_slot', None)
+            if slot is not None:
+                # Buffered responses; passthrough bodies took their slot along in body_span
+                response.call_on_close(lambda: admission.leave(slot))
+            return response
+        
+        @app.teardown_request
+        def release_slot_on_error(error):
+            slot = g.pop('admission_slot', None)
+            if slot is not None:
+                admission.leave(slot)
+    
     @app.route('/download', methods=['POST'])
     def download():
+        limited = rate_limited()
+        if limited:
+            return limited
+        
         if not INSTALOADER_AVAILABLE:
             return jsonify({
                 'success': False,
@@ -60,76 +568,268 @@ def create_app():
                     break
             
             if not shortcode:
-                return jsonify({'success': False, 'error': 'Invalid Instagram URL'}), 400
+                # Classified as typed; sanitizing first would turn junk into a valid-looking username
+                is_valid, error = validator.validate_input(url)
+                if job_queue and is_valid and validator.detect_input_type(url.lstrip('@')) == 'profile':
+                    return enqueue('profile', {
+                        'username': validator.sanitize_input(url),
+                        'limits': validator.parse_profile_limits(data, profile_limits)
+                    })
+                return jsonify({'success': False, 'error': error or 'Invalid Instagram URL'}), 400
             
-            # Download post
-            post = instaloader.Post.from_shortcode(loader.context, shortcode)
+            # A miss is counted where the post is fetched: the downloader looks again
+            streamed = app.config['SINGLE_MODE'] == 'stream'
+            cached = media_cache.get(shortcode, count_miss=streamed)
+            if cached:
+                metrics.incr('cache_hits_total', cache='media')
+                return jsonify({
+                    'success': True,
+                    'type': 'single',
+                    'caption': cached['caption'],
+                    'video_url': '/serve/' + cached['filename'],
+                    'filename': cached['filename'],
+                    'cached': True,
+                    'message': 'Download ready!'
+                })
             
-            if not post.is_video:
+            # Known-bad shortcodes are rejected without going upstream
+            meta = metadata_cache.get(shortcode, count_miss=False)
+            if meta and meta['status'] == 'not_found':
+                metrics.incr('cache_hits_total', cache='metadata')
+                return jsonify({'success': False, 'error': 'Post not found'}), 404
+            if meta and meta['status'] == 'not_video':
+                metrics.incr('cache_hits_total', cache='metadata')
                 return jsonify({'success': False, 'error': 'This post does not contain a video'}), 400
             
-            uid = uuid.uuid4().hex[:8]
-            username = post.owner_username
-            filename = username + '_' + shortcode + '_' + uid + '.mp4'
-            filepath = downloads_dir / 'single' / filename
-            
-            # Download with timeout
-            loader.download_post(post, target=str(filepath.parent / uid))
-            
-            # Find downloaded video
-            files = list(filepath.parent.glob(uid + '*.mp4'))
-            if files:
-                files[0].rename(filepath)
-                
-                # Cleanup
-                for f in filepath.parent.glob(uid + '*'):
-                    if f != filepath:
-                        try:
-                            f.unlink()
-                        except:
-                            pass
-                
-                caption = ''
-                try:
-                    caption = post.caption if post.caption else ''
-                except:
-                    pass
-                
+            # Going upstream inline takes a slot; cache hits above and queued jobs never do
+            if streamed or not job_queue:
+                shed = admit('download')
+                if shed:
+                    return shed
+            
+            # Stream mode hands out a link that pipes upstream bytes; nothing is downloaded here
+            if streamed:
+                metrics.incr('cache_misses_total', cache='media')
+                video = resolve_video(shortcode)
+                if not video['success']:
+                    return failed(video, success=False)
                 return jsonify({
                     'success': True,
                     'type': 'single',
-                    'caption': caption,
-                    'video_url': '/serve/' + filename,
-                    'filename': filename,
+                    'caption': video['caption'],
+                    'video_url': '/stream/' + shortcode,
+                    'filename': video['owner'] + '_' + shortcode + '.mp4',
                     'message': 'Download ready!'
                 })
             
-            return jsonify({'success': False, 'error': 'Failed to download video'}), 500
+            if job_queue:
+                return enqueue('single', {'url': url})
+            
+            # The same path a queued job takes; concurrent requests for a post share one download
+            result = downloader.download_single_post(url)
+            if not result['success']:
+                return failed(result, success=False)
+            
+            return jsonify({
+                'success': True,
+                'type': 'single',
+                'caption': result['caption'],
+                'video_url': '/serve/' + result['filename'],
+                'filename': result['filename'],
+                'message': 'Download ready!'
+            })
             
         except Exception as e:
             return jsonify({'success': False, 'error': 'Error: ' + str(e)}), 500
     
+    @app.route('/download/batch', methods=['POST'])
+    def download_batch():
+        limited = rate_limited()
+        if limited:
+            return limited
+        
+        # A batch can run for minutes, so it only runs as a background job
+        if not INSTALOADER_AVAILABLE or not job_queue:
+            return jsonify({'success': False, 'error': 'Batch downloads are not available'}), 503
+        
+        data = request.get_json(silent=True) or {}
+        entries = data.get('urls')
+        if isinstance(entries, str):
+            entries = entries.split()
+        if not isinstance(entries, list) or not entries:
+            return jsonify({'success': False, 'error': 'No URLs provided'}), 400
+        
+        parsed = validator.parse_batch(entries, app.config['BATCH_MAX_ITEMS'])
+        if not parsed['items']:
+            return jsonify({'success': False, 'error': 'No valid Instagram URLs or usernames',
+                            'rejected': parsed['rejected']}), 400
+        
+        return enqueue('batch', parsed)
+    
     @app.route('/serve/<filename>')
     def serve_file(filename):
         try:
             safe_filename = Path(filename).name
-            filepath = downloads_dir / 'single' / safe_filename
+            filepath = media_cache.path_for(safe_filename)
+            
+            if filepath.exists() and filepath.is_file():
+                return file_server.send(filepath, safe_filename, on_close=body_span('serve'))
+            
+            return jsonify({'error': 'File not found'}), 404
+        except FileNotFoundError:
+            # Evicted between the check and the open
+            return jsonify({'error': 'File not found'}), 404
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+    
+    @app.route('/stream/<shortcode>')
+    def stream_video(shortcode):
+        import re
+        if not INSTALOADER_AVAILABLE or not re.fullmatch(r'[A-Za-z0-9_-]+', shortcode):
+            return jsonify({'error': 'File not found'}), 404
+        
+        try:
+            cached = media_cache.get(shortcode)
+            if cached:
+                filepath = media_cache.path_for(cached['filename'])
+                return file_server.send(filepath, cached['filename'], on_close=body_span('serve'))
+            
+            shed = admit('stream')
+            if shed:
+                return shed
+            
+            video = resolve_video(shortcode)
+            if not video['success']:
+                return failed(video)
+            
+            byte_range = request.headers.get('Range')
+            opened = stream_proxy.open(shortcode, video['video_url'], video['owner'], video['caption'], byte_range)
+            if not opened['success'] and opened.get('expired'):
+                # Signed CDN URLs expire; look the post up again once
+                video = resolve_video(shortcode, fresh=True)
+                if not video['success']:
+                    return failed(video)
+                opened = stream_proxy.open(shortcode, video['video_url'], video['owner'], video['caption'],
+                                           byte_range)
+            if not opened['success']:
+                return failed(opened)
+            
+            body = ClosingIterator(opened['body'], body_span('stream'))
+            response = Response(body, status=opened['status'], headers=opened['headers'], direct_passthrough=True)
+            response.headers['Content-Disposition'] = (
+                'attachment; filename="' + video['owner'] + '_' + shortcode + '.mp4"'
+            )
+            return response
+        except FileNotFoundError:
+            return jsonify({'error': 'File not found'}), 404
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+    
+    @app.route('/zip/<filename>')
+    def serve_zip(filename):
+        try:
+            safe_filename = Path(filename).name
+            filepath = downloads_dir / 'zips' / safe_filename
             
             if filepath.exists() and filepath.is_file():
-                return send_file(filepath, as_attachment=True, download_name=safe_filename)
+                cleaner.touch(filepath)
+                return file_server.send(filepath, safe_filename, on_close=body_span('serve_zip'))
             
+            return jsonify({'error': 'File not found'}), 404
+        except FileNotFoundError:
+            # Evicted between the check and the open
             return jsonify({'error': 'File not found'}), 404
         except Exception as e:
             return jsonify({'error': str(e)}), 500
     
+    @app.route('/archive/<dirname>')
+    def stream_archive(dirname):
+        safe_dirname = Path(dirname).name
+        source_dir = downloads_dir / 'profiles' / safe_dirname
+        
+        if not safe_dirname or not source_dir.is_dir():
+            return jsonify({'error': 'File not found'}), 404
+        
+        shed = admit('archive')
+        if shed:
+            return shed
+        cleaner.touch(source_dir)
+        body = ClosingIterator(zipper.stream_profile_zip(source_dir), body_span('serve_archive'))
+        response = Response(body, mimetype='application/zip', direct_passthrough=True)
+        response.headers['Content-Disposition'] = 'attachment; filename="' + safe_dirname + '.zip"'
+        return response
+    
+    @app.route('/batch/<batch_id>/archive')
+    def stream_batch_archive(batch_id):
+        safe_batch_id = Path(batch_id).name
+        source_dir = downloads_dir / 'batches' / safe_batch_id
+        
+        if not safe_batch_id or not source_dir.is_dir():
+            return jsonify({'error': 'File not found'}), 404
+        
+        shed = admit('archive')
+        if shed:
+            return shed
+        cleaner.touch(source_dir)
+        body = ClosingIterator(zipper.stream_profile_zip(source_dir), body_span('serve_archive'))
+        response = Response(body, mimetype='application/zip', direct_passthrough=True)
+        response.headers['Content-Disposition'] = 'attachment; filename="batch_' + safe_batch_id + '.zip"'
+        return response
+    
+    @app.route('/jobs/<job_id>')
+    def job_status(job_id):
+        job = job_queue.get(job_id) if job_queue else None
+        if job is None:
+            return jsonify({'success': False, 'error': 'Job not found'}), 404
+        
+        job['success'] = job['state'] != 'failed'
+        return jsonify(job)
+    
+    @app.route('/metrics')
+    def metrics_endpoint():
+        if not app.config['METRICS_ENABLED']:
+            return jsonify({'error': 'Metrics are disabled'}), 404
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+    
     @app.route('/health')
     def health():
+        if request.args.get('ready'):
+            return readiness()
         return jsonify({
             'status': 'healthy',
             'instaloader': INSTALOADER_AVAILABLE,
+            'media_cache': media_cache.stats(),
+            'blob_store': blob_store.stats(),
+            'profile_archives': profile_archives.stats() if profile_archives else None,
+            'singleflight': singleflight.stats(),
+            'metadata_cache': metadata_cache.stats(),
+            'rate_limiter': rate_limiter.stats(),
+            'profile_sync': profile_sync.stats(),
+            'session_pool': session_pool.stats() if session_pool else None,
+            'upstream': upstream_health.stats() if upstream_health else None,
+            'disk': dict(expiry_index.stats(), quota_bytes=cleaner.quota_bytes),
+            'admission': admission.stats() if admission else None,
+            'queue_wait': round(job_queue.estimated_wait(), 1) if job_queue else None,
+            'profiling': profiler.stats() if profiler else None,
             'timestamp': int(time.time())
         })
     
+    def readiness():
+        """
+        Cheap check for load balancers: 503 while heavy requests fill every
+        slot or new jobs would wait past ADMISSION_MAX_QUEUE_WAIT
+        """
+        saturation = admission.saturation() if admission else 0.0
+        queue_wait = job_queue.estimated_wait() if job_queue else 0.0
+        max_queue_wait = app.config['ADMISSION_MAX_QUEUE_WAIT']
+        ready = saturation < 1.0 and not (max_queue_wait and queue_wait > max_queue_wait)
+        return jsonify({
+            'status': 'ready' if ready else 'saturated',
+            'saturation': round(saturation, 3),
+            'queue_wait': round(queue_wait, 1),
+            'timestamp': int(time.time())
+        }), 200 if ready else 503
+    
     return app
 
 app = create_app()
@@ -0,0 +1,168 @@
+"""
+Sync vs gevent worker memory benchmark
+
+Runs the real app under gunicorn with the repo's gunicorn.conf.py
+against the fake Instagram stand-in, and holds --concurrency cold
+POST /download requests in flight at once. Upstream latency is high, so
+every request spends most of its time waiting on the network. "sync"
+needs one worker process per in-flight request. "gevent" uses a single
+worker. Reports the total PSS of all gunicorn processes when idle and at
+peak, and the peak PSS per in-flight request, plus latency and errors.
+
+    python benchmarks/bench_async.py [--concurrency 32] [--latency-ms 1000] [--video-kb 512]
+        [--modes sync,gevent]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.fake_instagram import FakeInstagram, redirect_upstream
+
+PORT = 5078
+
+def make_app():
+    """gunicorn entry point; loaded after the worker has monkey-patched"""
+    redirect_upstream(os.environ['BENCH_UPSTREAM'])
+    from app import app
+    return app
+
+def pss_mb(pid: int) -> float:
+    """Proportional set size, so pages shared between forked workers count once"""
+    try:
+        with open('/proc/%d/smaps_rollup' % pid) as f:
+            for line in f:
+                if line.startswith('Pss:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+def process_tree(pid: int) -> list:
+    pids = [pid]
+    try:
+        with open('/proc/%d/task/%d/children' % (pid, pid)) as f:
+            pids += [int(child) for child in f.read().split()]
+    except OSError:
+        pass
+    return pids
+
+def request(method: str, path: str, body: dict = None):
+    conn = http.client.HTTPConnection('127.0.0.1', PORT, timeout=600)
+    try:
+        conn.request(method, path, body=json.dumps(body) if body else None,
+                     headers={'Content-Type': 'application/json'} if body else {})
+        response = conn.getresponse()
+        return response.status, response.read()
+    finally:
+        conn.close()
+
+def run(mode: str, workers: int, concurrency: int, upstream: str, work_dir: str, tag: str):
+    env = dict(
+        os.environ,
+        PYTHONPATH=ROOT,
+        WORKER_CLASS=mode,
+        WEB_CONCURRENCY=str(workers),
+        BENCH_UPSTREAM=upstream,
+        DOWNLOADS_DIR=work_dir,
+        JOB_QUEUE_ENABLED='0',
+        SESSION_POOL_PREWARM='0',
+        SESSION_POOL_SIZE=str(concurrency if mode == 'gevent' else 1),
+        UPSTREAM_RATE='100000',
+        UPSTREAM_BURST='100000',
+        RATE_LIMIT='1000000000',
+        # Every request is meant to be in flight at once
+        ADMISSION_MAX_IN_FLIGHT='0'
+    )
+    # The repo's config decides the worker model; only the socket and logs are overridden
+    gunicorn = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', os.path.join(ROOT, 'gunicorn.conf.py'),
+         '-b', '127.0.0.1:%d' % PORT, '--access-logfile', '/dev/null', '--log-level', 'warning',
+         'benchmarks.bench_async:make_app()'],
+        cwd=work_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        for _ in range(300):
+            try:
+                if request('GET', '/health')[0] == 200:
+                    break
+            except OSError:
+                time.sleep(0.2)
+        # Let every worker finish importing before measuring
+        time.sleep(2)
+        idle = sum(pss_mb(pid) for pid in process_tree(gunicorn.pid))
+        
+        peak = idle
+        done = threading.Event()
+        
+        def sample():
+            nonlocal peak
+            while not done.is_set():
+                peak = max(peak, sum(pss_mb(pid) for pid in process_tree(gunicorn.pid)))
+                time.sleep(0.05)
+        
+        sampler = threading.Thread(target=sample, daemon=True)
+        sampler.start()
+        latencies = []
+        errors = 0
+        lock = threading.Lock()
+        
+        def download(index):
+            nonlocal errors
+            started = time.perf_counter()
+            url = 'https://www.instagram.com/p/' + tag + '_v%05d/' % index
+            try:
+                status, _ = request('POST', '/download', {'url': url})
+            except OSError:
+                status = 0
+            with lock:
+                latencies.append(time.perf_counter() - started)
+                errors += status != 200
+        
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(download, range(concurrency)))
+        wall = time.perf_counter() - started
+        done.set()
+        sampler.join()
+        
+        latencies.sort()
+        print(f'{mode:<7} {workers:>7} {concurrency:>8} {errors:>6} {idle:>9.1f} {peak:>9.1f} '
+              f'{peak / concurrency:>11.2f} {latencies[len(latencies) // 2]:>8.2f} {latencies[-1]:>8.2f} '
+              f'{wall:>7.2f}')
+    finally:
+        gunicorn.terminate()
+        gunicorn.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--latency-ms', type=float, default=1000.0)
+    parser.add_argument('--video-kb', type=int, default=512)
+    parser.add_argument('--modes', default='sync,gevent')
+    args = parser.parse_args()
+    
+    fake = FakeInstagram(latency_ms=args.latency_ms, video_kb=args.video_kb).start()
+    print(f'{args.concurrency} concurrent cold downloads, upstream latency {args.latency_ms:g} ms, '
+          f'video {args.video_kb} KiB')
+    print(f"{'mode':<7} {'workers':>7} {'in-flight':>8} {'errors':>6} {'idle MB':>9} {'peak MB':>9} "
+          f"{'MB/request':>11} {'p50 s':>8} {'max s':>8} {'wall s':>7}")
+    try:
+        for mode in args.modes.split(','):
+            workers = args.concurrency if mode == 'sync' else 1
+            with tempfile.TemporaryDirectory() as work_dir:
+                run(mode, workers, args.concurrency, fake.base_url, work_dir, mode)
+    finally:
+        fake.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,305 @@
+"""
+Load benchmark for the download, serve, profile and ZIP paths
+
+Starts the fake Instagram stand-in and, for every scenario and
+concurrency level, a fresh process running the real app against it:
+
+  download         POST /download for posts nobody fetched yet
+  download_cached  POST /download for posts already in the media cache
+  serve            GET /serve/<file> for cached videos, full body
+  profile          InstagramDownloader.download_profile for new profiles
+  profile_resync   download_profile again for the same, already synced profiles
+  zip              ZipCreator.create_profile_zip on downloaded profiles
+
+Reports p50/p95/p99 latency, throughput, peak RSS of the app process
+and bytes it wrote to disk, and writes everything to a JSON file.
+Pass --baseline with an earlier result file to print the change.
+
+    python benchmarks/bench_load.py [--concurrency 1,4,16] [--requests 64]
+        [--latency-ms 50] [--video-kb 512] [--rate-429 0] [--profile-posts 60]
+        [--output bench_load.json] [--baseline previous.json]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import threading
+import http.client
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.fake_instagram import FakeInstagram, redirect_upstream
+
+SCENARIOS = ('download', 'download_cached', 'serve', 'profile', 'profile_resync', 'zip')
+SERVE_FILES = 16
+ZIP_PROFILES = 4
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a sorted list"""
+    if not values:
+        return None
+    index = min(len(values) - 1, max(0, int(round(fraction * len(values) + 0.5)) - 1))
+    return values[index]
+
+def disk_written() -> int:
+    """Bytes this process caused to be written to storage, None where unsupported"""
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                if line.startswith('write_bytes:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return round(peak / (1024 * 1024 if platform.system() == 'Darwin' else 1024), 1)
+
+def tree_size(path: Path) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+class AppClient:
+    """Minimal HTTP client for the app under test"""
+    
+    def __init__(self, port: int):
+        self.port = port
+    
+    def request(self, method: str, path: str, body: dict = None):
+        """Returns: (status, parsed JSON or body size)"""
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=300)
+        try:
+            payload = json.dumps(body) if body is not None else None
+            headers = {'Content-Type': 'application/json'} if body is not None else {}
+            conn.request(method, path, body=payload, headers=headers)
+            response = conn.getresponse()
+            if response.getheader('Content-Type', '').startswith('application/json'):
+                return response.status, json.loads(response.read())
+            received = 0
+            while True:
+                data = response.read(1024 * 1024)
+                if not data:
+                    break
+                received += len(data)
+            return response.status, received
+        finally:
+            conn.close()
+
+def start_app(work_dir: str, concurrency: int, base_url: str):
+    """Creates the real app against the stand-in and serves it on a thread"""
+    os.environ.update(
+        DOWNLOADS_DIR=work_dir,
+        JOB_QUEUE_ENABLED='0',
+        SESSION_POOL_PREWARM='0',
+        SESSION_POOL_SIZE=str(max(4, concurrency)),
+        UPSTREAM_RATE='100000',
+        UPSTREAM_BURST='100000',
+        RATE_LIMIT='1000000000',
+        SINGLE_MODE='download'
+    )
+    redirect_upstream(base_url)
+    
+    from werkzeug.serving import make_server
+    # Importing the module builds the app from the environment above
+    from app import app
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return app, server
+
+def run_scenario(name: str, concurrency: int, config: dict, base_url: str) -> dict:
+    """Runs one scenario at one concurrency level; called in a fresh process"""
+    if not config['verbose']:
+        # Instaloader logs every file and retry
+        sys.stdout = sys.stderr = open(os.devnull, 'w')
+    
+    work_dir = tempfile.mkdtemp(prefix='bench_load_', dir=config['work_dir'])
+    try:
+        app, server = start_app(work_dir, concurrency, base_url)
+        client = AppClient(server.server_address[1])
+        downloader = app.extensions['downloader']
+        zipper = app.extensions['zipper']
+        requests = config['requests']
+        tag = '%s%d' % (name.replace('_', ''), concurrency)
+        
+        def download(index):
+            url = 'https://www.instagram.com/p/' + tag + '_v%05d/' % index
+            status, data = client.request('POST', '/download', {'url': url})
+            return status == 200 and data.get('success'), data
+        
+        # Unmeasured setup so each scenario starts from the state it needs
+        operation = None
+        if name == 'download':
+            operation = lambda index: download(index)[0]
+        elif name == 'download_cached':
+            for index in range(requests):
+                download(index)
+            operation = lambda index: download(index)[0]
+        elif name == 'serve':
+            files = [download(index)[1]['filename'] for index in range(SERVE_FILES)]
+            
+            def operation(index):
+                status, received = client.request('GET', '/serve/' + files[index % len(files)])
+                return status == 200 and received > 0
+        elif name.startswith('profile'):
+            requests = config['profile_requests']
+            if name == 'profile_resync':
+                for index in range(requests):
+                    downloader.download_profile(tag + 'user%d' % index)
+            operation = lambda index: downloader.download_profile(tag + 'user%d' % index)['success']
+        elif name == 'zip':
+            paths = [downloader.download_profile(tag + 'user%d' % index) for index in range(ZIP_PROFILES)]
+            paths = [(result['download_path'], result['username']) for result in paths if result['success']]
+            
+            def operation(index):
+                path, username = paths[index % len(paths)]
+                archive = zipper.create_profile_zip(path, username)
+                if archive['success']:
+                    os.unlink(archive['filepath'])
+                return archive['success']
+        
+        latencies = []
+        errors = 0
+        lock = threading.Lock()
+        
+        def timed(index):
+            nonlocal errors
+            started = time.perf_counter()
+            try:
+                ok = operation(index)
+            except Exception:
+                ok = False
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                errors += not ok
+        
+        written_before = disk_written()
+        size_before = tree_size(Path(work_dir))
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(timed, range(requests)))
+        wall = time.perf_counter() - started
+        written_after = disk_written()
+        
+        latencies.sort()
+        server.shutdown()
+        return {
+            'scenario': name,
+            'concurrency': concurrency,
+            'requests': requests,
+            'errors': errors,
+            'wall_seconds': round(wall, 3),
+            'throughput': round(requests / wall, 2) if wall > 0 else None,
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 1),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 1),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+            'peak_rss_mb': peak_rss_mb(),
+            'disk_write_bytes': (written_after - written_before) if written_before is not None else None,
+            'downloads_growth_bytes': tree_size(Path(work_dir)) - size_before
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def compare(runs: list, baseline_path: str):
+    """Prints p95 and throughput changes against an earlier result file"""
+    with open(baseline_path) as f:
+        baseline = {(run['scenario'], run['concurrency']): run for run in json.load(f)['runs']}
+    print(f'\nchange vs {baseline_path}')
+    for run in runs:
+        before = baseline.get((run['scenario'], run['concurrency']))
+        if before is None:
+            continue
+        p95 = (run['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100 if before['p95_ms'] else 0.0
+        rate = (run['throughput'] - before['throughput']) / before['throughput'] * 100 if before['throughput'] else 0.0
+        rss = run['peak_rss_mb'] - before['peak_rss_mb']
+        print(f"{run['scenario']:<16} c={run['concurrency']:<4} p95 {p95:>+7.1f}%  "
+              f"throughput {rate:>+7.1f}%  peak RSS {rss:>+7.1f} MiB")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--concurrency', default='1,4,16')
+    parser.add_argument('--requests', type=int, default=64)
+    parser.add_argument('--profile-requests', type=int, default=8)
+    parser.add_argument('--latency-ms', type=float, default=50.0)
+    parser.add_argument('--video-kb', type=int, default=512)
+    parser.add_argument('--rate-429', type=float, default=0.0)
+    parser.add_argument('--profile-posts', type=int, default=60)
+    parser.add_argument('--work-dir', default=None, help='where the app writes (default: system temp)')
+    parser.add_argument('--output', default='bench_load.json')
+    parser.add_argument('--baseline', default=None)
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+    
+    scenarios = [name for name in args.scenarios.split(',') if name]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error('unknown scenarios: ' + ', '.join(sorted(unknown)))
+    levels = [int(level) for level in args.concurrency.split(',')]
+    if args.work_dir:
+        os.makedirs(args.work_dir, exist_ok=True)
+    
+    fake = FakeInstagram(latency_ms=args.latency_ms, video_kb=args.video_kb, rate_429=args.rate_429,
+                         profile_posts=args.profile_posts).start()
+    config = {
+        'requests': args.requests,
+        'profile_requests': args.profile_requests,
+        'work_dir': args.work_dir,
+        'verbose': args.verbose
+    }
+    print(f'upstream latency {args.latency_ms:g} ms, video {args.video_kb} KiB, 429 rate {args.rate_429:g}, '
+          f'{args.profile_posts} posts per profile')
+    print(f"{'scenario':<16} {'conc':>4} {'reqs':>5} {'err':>4} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+          f"{'ops/s':>8} {'peak RSS':>9} {'disk MiB':>9}")
+    
+    runs = []
+    # A fresh process per run, so peak RSS and disk counters belong to that run alone
+    context = multiprocessing.get_context('spawn')
+    try:
+        for name in scenarios:
+            for level in levels:
+                with context.Pool(1) as pool:
+                    run = pool.apply(run_scenario, (name, level, config, fake.base_url))
+                runs.append(run)
+                written = run['disk_write_bytes']
+                if written is None:
+                    written = run['downloads_growth_bytes']
+                print(f"{name:<16} {level:>4} {run['requests']:>5} {run['errors']:>4} {run['p50_ms']:>9.1f} "
+                      f"{run['p95_ms']:>9.1f} {run['p99_ms']:>9.1f} {run['throughput']:>8.2f} "
+                      f"{run['peak_rss_mb']:>7.1f}MB {written / 1024 / 1024:>9.1f}")
+    finally:
+        fake.stop()
+    
+    result = {
+        'created_at': int(time.time()),
+        'python': platform.python_version(),
+        'config': vars(args),
+        'upstream_requests': fake.stats(),
+        'runs': runs
+    }
+    with open(args.output, 'w') as f:
+        json.dump(result, f, indent=2)
+    print('results written to ' + args.output)
+    
+    if args.baseline:
+        compare(runs, args.baseline)
+
+if __name__ == '__main__':
+    main()
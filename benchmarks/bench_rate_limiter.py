@@ -0,0 +1,106 @@
+"""
+Rate limiter microbenchmark
+
+Drives each limiter with requests from 100k distinct IPs and reports
+throughput and memory held afterwards, then lets three windows pass and
+sends a trickle of new clients to show how many idle clients are still
+tracked. The "list" limiter is the original timestamp-list
+implementation, kept here as the baseline.
+
+    python benchmarks/bench_rate_limiter.py [--clients 100000] [--requests 300000]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+from collections import defaultdict
+from threading import Lock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.rate_limiter import RateLimiter, SharedRateLimiter
+
+class ListRateLimiter:
+    """Original implementation: one list of timestamps per IP"""
+    
+    def __init__(self, max_requests: int = 20, window_seconds: int = 60):
+        self.max_requests = max_requests
+        self.window_seconds = window_seconds
+        self.requests = defaultdict(list)
+        self.lock = Lock()
+    
+    def allow_request(self, client_ip: str) -> bool:
+        with self.lock:
+            current_time = time.time()
+            self.requests[client_ip] = [
+                req_time for req_time in self.requests[client_ip]
+                if current_time - req_time < self.window_seconds
+            ]
+            if len(self.requests[client_ip]) < self.max_requests:
+                self.requests[client_ip].append(current_time)
+                return True
+            return False
+
+class Clock:
+    """Controllable replacement for time.time"""
+    
+    def __init__(self):
+        self.offset = 0.0
+        self.real = time.time
+    
+    def __call__(self):
+        return self.real() + self.offset
+
+def tracked(limiter):
+    if isinstance(limiter, SharedRateLimiter):
+        return limiter.stats()['clients']
+    return len(limiter.requests)
+
+def run(name, limiter, ips, clock):
+    clock.offset = 0.0
+    tracemalloc.start()
+    started = time.perf_counter()
+    allowed = 0
+    for ip in ips:
+        allowed += limiter.allow_request(ip)
+    elapsed = time.perf_counter() - started
+    current, peak = tracemalloc.get_traced_memory()
+    
+    # Everyone goes quiet for three windows, then a few new clients arrive
+    clock.offset = 3 * 60 + 1
+    for i in range(100):
+        limiter.allow_request('192.168.0.%d' % i)
+    idle_current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    
+    print(f'{name:<8} {len(ips) / elapsed:>12,.0f} req/s {current / 1024 / 1024:>9.1f} MiB held '
+          f'{peak / 1024 / 1024:>9.1f} MiB peak {allowed:>9} allowed | after idle: '
+          f'{tracked(limiter):>7} clients {idle_current / 1024 / 1024:>6.1f} MiB')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--clients', type=int, default=100000)
+    parser.add_argument('--requests', type=int, default=300000)
+    parser.add_argument('--max-requests', type=int, default=20)
+    args = parser.parse_args()
+    
+    rng = random.Random(42)
+    pool = ['10.%d.%d.%d' % (i >> 16 & 255, i >> 8 & 255, i & 255) for i in range(args.clients)]
+    # Every client shows up at least once, the rest is skewed towards a hot set
+    ips = pool + [pool[int(rng.paretovariate(1.2)) % args.clients] for _ in range(args.requests - args.clients)]
+    rng.shuffle(ips)
+    
+    clock = Clock()
+    time.time = clock
+    
+    print(f'{len(ips):,} requests from {args.clients:,} distinct IPs, limit {args.max_requests}/60s')
+    run('list', ListRateLimiter(args.max_requests), ips, clock)
+    run('memory', RateLimiter(args.max_requests), ips, clock)
+    with tempfile.TemporaryDirectory() as tmp:
+        run('shared', SharedRateLimiter(os.path.join(tmp, 'rate_limit.db'), args.max_requests), ips, clock)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""
+File serving benchmark
+
+Starts gunicorn with a single sync worker serving one video file and
+reports the worker's CPU time per served GB for whole-file and ranged
+(8 MiB, as sent by seeking players and resumed downloads) requests.
+"send_file" is the previous Flask send_file path, "server" is
+FileServer and "offload" returns X-Accel-Redirect without a body.
+
+    python benchmarks/bench_serve.py [--size-mb 256] [--total-mb 2048]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import subprocess
+import http.client
+from pathlib import Path
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PORT = 5077
+RANGE_SIZE = 8 * 1024 * 1024
+
+def make_app():
+    """gunicorn entry point; the worker reports its own CPU time on /cpu"""
+    from flask import Flask, jsonify, send_file
+    from utils.file_server import FileServer
+    
+    path = Path(os.environ['BENCH_SERVE_FILE'])
+    app = Flask(__name__)
+    server = FileServer(path.parent)
+    offload = FileServer(path.parent, offload='nginx')
+    
+    app.add_url_rule('/send_file', 'send_file', lambda: send_file(path, as_attachment=True))
+    app.add_url_rule('/server', 'server', lambda: server.send(path))
+    app.add_url_rule('/offload', 'offload', lambda: offload.send(path))
+    app.add_url_rule('/cpu', 'cpu', lambda: jsonify(time.process_time()))
+    return app
+
+def fetch(route, headers=None) -> int:
+    conn = http.client.HTTPConnection('127.0.0.1', PORT)
+    conn.request('GET', '/' + route, headers=headers or {})
+    response = conn.getresponse()
+    received = 0
+    while True:
+        data = response.read(1024 * 1024)
+        if not data:
+            break
+        received += len(data)
+    conn.close()
+    return received
+
+def worker_cpu() -> float:
+    conn = http.client.HTTPConnection('127.0.0.1', PORT)
+    conn.request('GET', '/cpu')
+    value = float(conn.getresponse().read())
+    conn.close()
+    return value
+
+def run(name, route, size, total, ranged):
+    requests = 0
+    cpu_before = worker_cpu()
+    started = time.perf_counter()
+    served = 0
+    while served < total:
+        if ranged:
+            start = (requests * RANGE_SIZE) % (size - RANGE_SIZE)
+            headers = {'Range': 'bytes=%d-%d' % (start, start + RANGE_SIZE - 1)}
+            served += fetch(route, headers)
+        else:
+            served += fetch(route)
+        requests += 1
+        if route == 'offload':
+            # Nothing crosses the worker; count what the proxy would send
+            served += RANGE_SIZE if ranged else size
+    elapsed = time.perf_counter() - started
+    cpu = worker_cpu() - cpu_before
+    gb = served / 1024 ** 3
+    print(f'{name:<22} {requests:>6} req {gb:>6.2f} GB {cpu / gb:>8.3f} worker CPU s/GB '
+          f'{elapsed / gb:>8.3f} wall s/GB')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size-mb', type=int, default=256)
+    parser.add_argument('--total-mb', type=int, default=2048)
+    args = parser.parse_args()
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / 'video.mp4'
+        with open(path, 'wb') as f:
+            for _ in range(args.size_mb):
+                f.write(os.urandom(1024 * 1024))
+        
+        env = dict(os.environ, BENCH_SERVE_FILE=str(path), PYTHONPATH=ROOT)
+        # Started outside the repo so the production gunicorn.conf.py is not picked up
+        gunicorn = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-w', '1', '-k', 'sync', '-b', '127.0.0.1:%d' % PORT,
+             '--log-level', 'warning', 'benchmarks.bench_serve:make_app()'],
+            cwd=tmp, env=env
+        )
+        try:
+            for _ in range(50):
+                try:
+                    worker_cpu()
+                    break
+                except OSError:
+                    time.sleep(0.2)
+            
+            size = args.size_mb * 1024 * 1024
+            total = args.total_mb * 1024 * 1024
+            print(f'{args.size_mb} MiB file, {args.total_mb} MiB per run, one sync worker')
+            for route in ('send_file', 'server', 'offload'):
+                run(route + ' full', route, size, total, ranged=False)
+                run(route + ' ranged', route, size, total, ranged=True)
+        finally:
+            gunicorn.terminate()
+            gunicorn.wait()
+
+if __name__ == '__main__':
+    main()
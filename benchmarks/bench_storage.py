@@ -0,0 +1,87 @@
+"""
+Per-request filesystem cost of storing a single download
+
+Fills downloads/single with --files stored videos, then stores --requests
+new downloads one after another and reports the mean and p99 time per
+request. "glob" is the original layout, kept here as the baseline: files
+sit directly in single/, and each request finds its download and cleans
+up with two globs over that directory. "sharded" is the current layout:
+each download gets a private staging directory and is renamed atomically
+into a hash shard through utils.storage, so no shared directory is listed.
+Cache bookkeeping in SQLite is the same for both and left out.
+
+    python benchmarks/bench_storage.py [--files 1000,10000,100000] [--requests 300] [--video-kb 64]
+"""
+import os
+import sys
+import time
+import uuid
+import argparse
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.storage import commit, shard_path, staging
+
+def fill(single_dir: Path, files: int, sharded: bool):
+    """Creates stored videos; empty, since only directory size matters here"""
+    for index in range(files):
+        filename = 'owner_stored%07d.mp4' % index
+        path = shard_path(single_dir, filename) if sharded else single_dir / filename
+        path.parent.mkdir(exist_ok=True)
+        path.touch()
+
+def store_glob(single_dir: Path, shortcode: str, video: bytes):
+    """Original request path: download under a uid, glob for it, rename, glob again to clean up"""
+    uid = uuid.uuid4().hex[:8]
+    (single_dir / (uid + '.mp4')).write_bytes(video)
+    files = list(single_dir.glob(uid + '*.mp4'))
+    os.replace(files[0], single_dir / ('owner_' + shortcode + '.mp4'))
+    for f in single_dir.glob(uid + '*'):
+        f.unlink(missing_ok=True)
+
+def store_sharded(single_dir: Path, shortcode: str, video: bytes):
+    """Current request path: private staging directory, known path, atomic rename into a shard"""
+    with staging(single_dir) as staged:
+        downloaded = staged / (shortcode + '.mp4')
+        downloaded.write_bytes(video)
+        if downloaded.is_file():
+            filename = 'owner_' + shortcode + '.mp4'
+            commit(downloaded, shard_path(single_dir, filename))
+
+def run(layout: str, files: int, requests: int, video: bytes):
+    with tempfile.TemporaryDirectory() as tmp:
+        single_dir = Path(tmp) / 'single'
+        single_dir.mkdir()
+        fill(single_dir, files, layout == 'sharded')
+        store = store_sharded if layout == 'sharded' else store_glob
+        
+        latencies = []
+        for index in range(requests):
+            started = time.perf_counter()
+            store(single_dir, 'new%07d' % index, video)
+            latencies.append(time.perf_counter() - started)
+        
+        latencies.sort()
+        mean = sum(latencies) / len(latencies)
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        print(f'{layout:<8} {files:>9,} {mean * 1e6:>10.0f} {p99 * 1e6:>10.0f}')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--files', default='1000,10000,100000')
+    parser.add_argument('--requests', type=int, default=300)
+    parser.add_argument('--video-kb', type=int, default=64)
+    parser.add_argument('--layouts', default='glob,sharded')
+    args = parser.parse_args()
+    
+    video = os.urandom(args.video_kb * 1024)
+    print(f'{args.requests} stored downloads of {args.video_kb} KiB each')
+    print(f"{'layout':<8} {'stored':>9} {'mean us':>10} {'p99 us':>10}")
+    for files in (int(count) for count in args.files.split(',')):
+        for layout in args.layouts.split(','):
+            run(layout, files, args.requests, video)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,256 @@
+"""
+Local stand-in for the Instagram endpoints Instaloader uses
+
+Answers the post metadata GraphQL query, the profile info API, the
+profile timeline doc_id query and the CDN video URLs it hands out, with
+configurable latency, video size, 429 rate and profile size. Every media
+URL gets its own bytes, so dedup and disk usage behave as with real posts. Shortcodes
+look like <owner>_<id>: ids starting with "missing" do not exist, ids
+starting with "img" are photos and everything else is a video. Profile
+posts are numbered from the oldest, so raising profile_posts adds new
+posts on top; the pinned_posts oldest ones are pinned above them.
+
+redirect_upstream() sends every instagram.com request made through
+requests to the stand-in, so the app and Instaloader run unmodified.
+"""
+import json
+import time
+import zlib
+import random
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+POST_QUERY_HASH = '2b0673e0dc4580674a88d426fe00ea90'
+TIMELINE_DOC_ID = '7898261790222653'
+UPSTREAM_HOSTS = ('www.instagram.com', 'i.instagram.com')
+PAGE_SIZE = 12
+
+class FakeInstagram:
+    """Threaded HTTP server imitating the upstream API and CDN"""
+    
+    def __init__(self, latency_ms: float = 50.0, video_kb: int = 512, rate_429: float = 0.0,
+                 profile_posts: int = 60, video_ratio: float = 0.8, seed: int = 42, pinned_posts: int = 0):
+        self.latency_ms = latency_ms
+        self.video_kb = video_kb
+        self.rate_429 = rate_429
+        self.profile_posts = profile_posts
+        self.pinned_posts = pinned_posts
+        self.video_ratio = video_ratio
+        self.rng = random.Random(seed)
+        self.payload = random.Random(seed).randbytes(video_kb * 1024)
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.server = None
+        self.thread = None
+    
+    @property
+    def base_url(self) -> str:
+        return 'http://127.0.0.1:%d' % self.server.server_address[1]
+    
+    def start(self, port: int = 0):
+        """Starts serving on a background thread"""
+        fake = self
+        
+        class Handler(_Handler):
+            upstream = fake
+        
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+    
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+    
+    def stats(self) -> dict:
+        """Returns request counts per endpoint and status"""
+        with self.lock:
+            return dict(self.counts)
+    
+    def count(self, name: str):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+    
+    def delay(self):
+        """Sleeps the configured latency with +-25% jitter"""
+        if self.latency_ms > 0:
+            with self.lock:
+                jitter = self.rng.uniform(0.75, 1.25)
+            time.sleep(self.latency_ms * jitter / 1000)
+    
+    def throttled(self) -> bool:
+        if self.rate_429 <= 0:
+            return False
+        with self.lock:
+            return self.rng.random() < self.rate_429
+    
+    def media(self, path: str) -> bytes:
+        """Returns the body of a media URL: the shared random payload, prefixed with its path"""
+        tag = path.encode()
+        return tag + self.payload[len(tag):]
+    
+    def video_url(self, shortcode: str) -> str:
+        return self.base_url + '/media/' + shortcode + '.mp4'
+    
+    def image_url(self, shortcode: str) -> str:
+        return self.base_url + '/media/' + shortcode + '.jpg'
+    
+    def shortcode_media(self, shortcode: str) -> dict:
+        """Post metadata as returned by the shortcode GraphQL query"""
+        owner, _, media_id = shortcode.rpartition('_')
+        if media_id.startswith('missing'):
+            return None
+        is_video = not media_id.startswith('img')
+        node = {
+            '__typename': 'GraphVideo' if is_video else 'GraphImage',
+            'id': str(zlib.crc32(shortcode.encode())),
+            'shortcode': shortcode,
+            'is_video': is_video,
+            'display_url': self.image_url(shortcode),
+            'taken_at_timestamp': 1700000000,
+            'owner': {'id': '1000', 'username': owner or 'fakeuser'},
+            'edge_media_to_caption': {'edges': [{'node': {'text': 'Caption for ' + shortcode}}]},
+            'edge_media_preview_like': {'count': 10},
+            'edge_media_to_comment': {'count': 0}
+        }
+        if is_video:
+            node.update(video_url=self.video_url(shortcode), video_view_count=100, video_duration=10.0)
+        return node
+    
+    def profile_user(self, username: str) -> dict:
+        """Profile node as returned by web_profile_info"""
+        if username.startswith('missing'):
+            return None
+        return {
+            'id': str(zlib.crc32(username.encode())),
+            'username': username,
+            'full_name': username.title(),
+            'is_private': username.startswith('private'),
+            'profile_pic_url_hd': self.image_url(username),
+            'edge_owner_to_timeline_media': {'count': self.profile_posts}
+        }
+    
+    def timeline_page(self, username: str, after: str = None) -> dict:
+        """One page of a profile's timeline: pinned posts first, then newest first"""
+        start = int(after) if after else 0
+        end = min(start + PAGE_SIZE, self.profile_posts)
+        pinned = min(self.pinned_posts, self.profile_posts)
+        edges = []
+        for index in range(start, end):
+            # Numbered from the oldest, so a post keeps its shortcode as the profile grows
+            number = index if index < pinned else self.profile_posts - 1 - (index - pinned)
+            is_video = (number * 7919 % 100) < self.video_ratio * 100
+            shortcode = username + '_' + ('v' if is_video else 'img') + '%05d' % number
+            media = {
+                'code': shortcode,
+                'pk': str(number + 1),
+                'media_type': 2 if is_video else 1,
+                'taken_at': 1700000000 + number * 3600,
+                'caption': {'text': 'Caption for ' + shortcode},
+                'has_liked': False,
+                'like_count': 10,
+                'comment_count': 0,
+                'image_versions2': {'candidates': [{'url': self.image_url(shortcode)}]},
+                'user': {
+                    'pk': '1000',
+                    'username': username,
+                    'is_private': False,
+                    'full_name': username.title(),
+                    'profile_pic_url': self.image_url(username)
+                }
+            }
+            if index < pinned:
+                media['timeline_pinned_user_ids'] = ['1000']
+            if is_video:
+                media.update(video_versions=[{'url': self.video_url(shortcode)}], video_duration=10.0,
+                             view_count=100)
+            edges.append({'node': media})
+        return {
+            'edges': edges,
+            'page_info': {'has_next_page': end < self.profile_posts, 'end_cursor': str(end)}
+        }
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    upstream = None
+    
+    def log_message(self, format, *args):
+        pass
+    
+    def do_GET(self):
+        self._dispatch()
+    
+    def do_HEAD(self):
+        self._send(200, b'', 'text/html')
+    
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        self._dispatch(self.rfile.read(length).decode() if length else '')
+    
+    def _dispatch(self, body: str = ''):
+        fake = self.upstream
+        url = urllib.parse.urlsplit(self.path)
+        params = {key: values[0] for key, values in urllib.parse.parse_qs(url.query).items()}
+        params.update({key: values[0] for key, values in urllib.parse.parse_qs(body).items()})
+        path = url.path
+        fake.delay()
+        
+        if path.startswith('/media/'):
+            fake.count('media')
+            if path.endswith('.mp4'):
+                return self._send(200, fake.media(path), 'video/mp4')
+            return self._send(200, fake.media(path)[:16 * 1024], 'image/jpeg')
+        
+        if fake.throttled():
+            fake.count('429')
+            return self._json(429, {'message': 'Please wait a few minutes before you try again.',
+                                    'status': 'fail'})
+        
+        variables = json.loads(params.get('variables', '{}'))
+        if path.endswith('/graphql/query') and params.get('query_hash') == POST_QUERY_HASH:
+            fake.count('post')
+            return self._json(200, {'data': {'shortcode_media': fake.shortcode_media(variables['shortcode'])},
+                                    'status': 'ok'})
+        if path.endswith('/graphql/query') and params.get('doc_id') == TIMELINE_DOC_ID:
+            fake.count('timeline')
+            page = fake.timeline_page(variables['username'], variables.get('after'))
+            return self._json(200, {'data': {'xdt_api__v1__feed__user_timeline_graphql_connection': page},
+                                    'status': 'ok'})
+        if '/api/v1/users/web_profile_info' in path:
+            fake.count('profile')
+            return self._json(200, {'data': {'user': fake.profile_user(params.get('username', ''))},
+                                    'status': 'ok'})
+        
+        fake.count('unknown')
+        return self._json(404, {'message': 'Not found', 'status': 'fail'})
+    
+    def _json(self, status: int, data: dict):
+        self._send(status, json.dumps(data).encode(), 'application/json; charset=utf-8')
+    
+    def _send(self, status: int, body: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+def redirect_upstream(base_url: str):
+    """
+    Rewrites requests to instagram.com hosts onto the stand-in, keeping the
+    original host as the first path segment; patches every HTTPAdapter
+    """
+    from requests.adapters import HTTPAdapter
+    send = HTTPAdapter.send
+    
+    def redirected_send(self, request, **kwargs):
+        url = urllib.parse.urlsplit(request.url)
+        if url.hostname in UPSTREAM_HOSTS:
+            request.url = base_url + '/' + url.hostname + url.path + ('?' + url.query if url.query else '')
+            request.headers.pop('Host', None)
+        return send(self, request, **kwargs)
+    
+    HTTPAdapter.send = redirected_send
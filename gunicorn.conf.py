@@ -1,3 +1,4 @@
+import os
 import multiprocessing
 
 # Server socket
@@ -5,12 +6,31 @@ bind = "0.0.0.0:5000"
 backlog = 2048
 
 # Worker processes
-workers = multiprocessing.cpu_count() * 2 + 1
-worker_class = "sync"
-worker_connections = 1000
+# "sync" handles one request per process. "gevent" (pip install gevent)
+# runs up to worker_connections requests per process cooperatively, so a
+# few processes hold hundreds of in-flight downloads; raise
+# SESSION_POOL_SIZE to match the in-flight upstream calls per process.
+worker_class = os.environ.get("WORKER_CLASS", "sync")
+if worker_class == "gevent":
+    workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+    worker_connections = int(os.environ.get("WORKER_CONNECTIONS", 1000))
+else:
+    workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+    worker_connections = 1000
 timeout = 120
 keepalive = 5
 
+# Admission control: uncached downloads, streams and archives may occupy
+# this many workers (connections under gevent) at once, over all workers.
+# Past that they get a fast 503 + Retry-After instead of waiting in the
+# backlog, and the remaining workers stay free for /, /serve and /health.
+# Exported before the workers fork so the app sees it; 0 disables it.
+if worker_class == "gevent":
+    max_in_flight = workers * worker_connections // 2
+else:
+    max_in_flight = max(1, workers - max(1, workers // 4))
+os.environ.setdefault("ADMISSION_MAX_IN_FLIGHT", str(max_in_flight))
+
 # Logging
 accesslog = "-"
 errorlog = "-"
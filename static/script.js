@@ -29,6 +29,7 @@ const statusMessage = document.getElementById('statusMessage');
 const resultSection = document.getElementById('resultSection');
 const singleResult = document.getElementById('singleResult');
 const profileResult = document.getElementById('profileResult');
+const batchResult = document.getElementById('batchResult');
 
 form.addEventListener('submit', async (e) => {
     e.preventDefault();
@@ -49,27 +50,38 @@ form.addEventListener('submit', async (e) => {
         showStatus('Validating input...', 'info');
     }, 500);
     
+    // Several pasted links (or usernames) go to the batch endpoint in one request
+    const entries = splitEntries(url);
+    const isBatch = entries.length > 1;
+    
     try {
-        const response = await fetch('/download', {
+        const response = await fetch(isBatch ? '/download/batch' : '/download', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
             },
-            body: JSON.stringify({ url }),
+            body: JSON.stringify(isBatch ? { urls: entries } : { url }),
         });
         
-        const data = await response.json();
+        let data = await response.json();
         
         if (!response.ok) {
             throw new Error(data.error || 'Download failed');
         }
         
+        // Queued downloads finish in the background
+        if (data.job_id) {
+            data = await waitForJob(data.status_url);
+        }
+        
         showStatus(data.message, 'success');
         
         if (data.type === 'single') {
             showSingleResult(data);
         } else if (data.type === 'profile') {
             showProfileResult(data);
+        } else if (data.type === 'batch') {
+            showBatchResult(data);
         }
         
         // Scroll to result
@@ -84,6 +96,31 @@ form.addEventListener('submit', async (e) => {
     }
 });
 
+function splitEntries(text) {
+    // Pasting into a single-line input drops line breaks, so also split where a new link starts
+    return text.split(/[\s,]+|(?=https?:\/\/)/).filter(entry => entry.length > 0);
+}
+
+async function waitForJob(statusUrl) {
+    while (true) {
+        await new Promise(resolve => setTimeout(resolve, 1000));
+        
+        const response = await fetch(statusUrl);
+        const job = await response.json();
+        
+        if (!response.ok || job.state === 'failed') {
+            throw new Error(job.error || 'Download failed');
+        }
+        
+        if (job.state === 'done') {
+            return job.result;
+        }
+        
+        const percent = Math.round(job.progress * 100);
+        showStatus(job.message + (percent > 0 ? ` (${percent}%)` : '') + '...', 'info');
+    }
+}
+
 function showSingleResult(data) {
     const captionText = document.getElementById('captionText');
     const downloadVideoBtn = document.getElementById('downloadVideoBtn');
@@ -105,6 +142,7 @@ function showSingleResult(data) {
     
     singleResult.style.display = 'block';
     profileResult.style.display = 'none';
+    batchResult.style.display = 'none';
     resultSection.style.display = 'block';
 }
 
@@ -118,6 +156,25 @@ function showProfileResult(data) {
     
     profileResult.style.display = 'block';
     singleResult.style.display = 'none';
+    batchResult.style.display = 'none';
+    resultSection.style.display = 'block';
+}
+
+function showBatchResult(data) {
+    const batchCount = document.getElementById('batchCount');
+    const batchTotal = document.getElementById('batchTotal');
+    const batchRate = document.getElementById('batchRate');
+    const downloadBatchBtn = document.getElementById('downloadBatchBtn');
+    
+    batchCount.textContent = data.succeeded;
+    batchTotal.textContent = data.items.length + data.rejected.length;
+    batchRate.textContent = data.items_per_second;
+    downloadBatchBtn.href = data.zip_url;
+    downloadBatchBtn.download = data.filename;
+    
+    batchResult.style.display = 'block';
+    singleResult.style.display = 'none';
+    profileResult.style.display = 'none';
     resultSection.style.display = 'block';
 }
 
@@ -125,6 +182,7 @@ function hideResults() {
     resultSection.style.display = 'none';
     singleResult.style.display = 'none';
     profileResult.style.display = 'none';
+    batchResult.style.display = 'none';
 }
 
 function setLoading(isLoading) {
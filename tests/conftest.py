@@ -0,0 +1,61 @@
+import os
+import sys
+import time
+import tempfile
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# app.py builds an app when imported; keep everything it writes out of the tree
+os.environ.setdefault('DOWNLOADS_DIR', tempfile.mkdtemp(prefix='insta-tests-'))
+
+from benchmarks.fake_instagram import FakeInstagram, redirect_upstream
+
+@pytest.fixture(scope='session')
+def upstream():
+    """One fake Instagram for the whole run; requests to instagram.com go to it"""
+    fake = FakeInstagram(latency_ms=0, video_kb=16, profile_posts=24).start()
+    redirect_upstream(fake.base_url)
+    yield fake
+    fake.stop()
+
+@pytest.fixture
+def fake(upstream):
+    """The fake Instagram, with settings a test changed put back afterwards"""
+    settings = dict(vars(upstream))
+    yield upstream
+    for name in ('latency_ms', 'profile_posts', 'pinned_posts', 'rate_429'):
+        setattr(upstream, name, settings[name])
+
+@pytest.fixture
+def make_app(fake, tmp_path, monkeypatch):
+    """Returns a factory for apps on tmp_path against the fake, taking extra settings"""
+    def make(**settings):
+        env = {
+            'DOWNLOADS_DIR': str(tmp_path),
+            'SESSION_POOL_PREWARM': '0',
+            'UPSTREAM_RATE': '100000',
+            'UPSTREAM_BURST': '100000',
+            'RATE_LIMIT': '100000',
+            'ADMISSION_MAX_IN_FLIGHT': '0'
+        }
+        env.update(settings)
+        for name, value in env.items():
+            monkeypatch.setenv(name, value)
+        from app import create_app
+        return create_app()
+    return make
+
+@pytest.fixture
+def wait_for_job():
+    """Returns a function that polls a job until it finishes"""
+    def wait(client, job_id, timeout=60):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            job = client.get('/jobs/' + job_id).get_json()
+            if job['state'] in ('done', 'failed'):
+                return job
+            time.sleep(0.05)
+        raise AssertionError('Job ' + job_id + ' did not finish')
+    return wait
@@ -0,0 +1,16 @@
+def in_flight(client):
+    return client.get('/health').get_json()['admission']['in_flight']
+
+def test_streamed_archives_release_their_slot(make_app, wait_for_job):
+    client = make_app(JOB_QUEUE_ENABLED='1', ZIP_MODE='stream', ADMISSION_MAX_IN_FLIGHT='1').test_client()
+    response = client.post('/download', json={'url': 'ivan'})
+    job = wait_for_job(client, response.get_json()['job_id'])
+    assert job['state'] == 'done', job
+    
+    # Passthrough bodies skip Flask's close hooks; a held slot would turn the second one away
+    for _ in range(3):
+        response = client.get(job['result']['zip_url'], buffered=False)
+        assert response.status_code == 200
+        response.get_data()
+        response.close()
+        assert in_flight(client) == 0
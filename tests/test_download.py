@@ -0,0 +1,44 @@
+import sqlite3
+
+def job_count(tmp_path):
+    return sqlite3.connect(str(tmp_path / 'jobs.db')).execute('SELECT COUNT(*) FROM jobs').fetchone()[0]
+
+def test_junk_input_is_rejected_without_a_job(make_app, tmp_path):
+    # No workers: a job that slipped through would stay queued and be counted
+    client = make_app(JOB_QUEUE_ENABLED='1', JOB_WORKERS='0').test_client()
+    
+    for junk in ('hello world!!', 'https://example.com/some/page', '../etc/passwd'):
+        response = client.post('/download', json={'url': junk})
+        assert response.status_code == 400, junk
+        assert response.get_json()['success'] is False
+    assert job_count(tmp_path) == 0
+
+def test_username_is_queued_as_profile_job(make_app, tmp_path):
+    client = make_app(JOB_QUEUE_ENABLED='1', JOB_WORKERS='0').test_client()
+    
+    response = client.post('/download', json={'url': '@bob.smith'})
+    assert response.status_code == 202
+    assert job_count(tmp_path) == 1
+
+def test_job_and_inline_paths_relink_stored_media_without_upstream(make_app, fake, wait_for_job):
+    for settings in ({'JOB_QUEUE_ENABLED': '1'}, {'JOB_QUEUE_ENABLED': '0'}):
+        app = make_app(**settings)
+        client = app.test_client()
+        downloader = app.extensions['downloader']
+        url = 'https://www.instagram.com/p/dora_v00001/'
+        
+        def download():
+            response = client.post('/download', json={'url': url})
+            body = response.get_json()
+            return wait_for_job(client, body['job_id'])['result'] if response.status_code == 202 else body
+        
+        first = download()
+        assert first['success'], first
+        # Evicted from the media cache, still in the blob store and the metadata cache
+        downloader.media_cache._drop(['dora_v00001'])
+        queries = fake.stats().get('post', 0)
+        
+        again = download()
+        assert again['success'], again
+        assert again['filename'] == first['filename']
+        assert fake.stats().get('post', 0) == queries
@@ -0,0 +1,19 @@
+from utils.media_cache import MediaCache
+
+def test_flat_layout_migration_runs_once_and_only_on_old_files(tmp_path):
+    media_dir = tmp_path / 'single'
+    media_dir.mkdir()
+    for name in ('bob_dora_v00001.mp4', '.dora_v00002_0123abcd.part', '.gitkeep', 'README.txt'):
+        (media_dir / name).write_bytes(b'x')
+    
+    cache = MediaCache(str(media_dir), str(tmp_path / 'media.db'))
+    assert cache.path_for('bob_dora_v00001.mp4').is_file()
+    assert not (media_dir / 'bob_dora_v00001.mp4').exists()
+    assert not (media_dir / '.dora_v00002_0123abcd.part').exists()
+    assert (media_dir / '.gitkeep').is_file()
+    assert (media_dir / 'README.txt').is_file()
+    
+    # Migrated already: a later start leaves even old-looking files alone
+    (media_dir / 'bob_dora_v00003.mp4').write_bytes(b'x')
+    MediaCache(str(media_dir), str(tmp_path / 'media.db'))
+    assert (media_dir / 'bob_dora_v00003.mp4').is_file()
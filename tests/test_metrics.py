@@ -0,0 +1,38 @@
+import re
+import time
+import pytest
+
+def stage_sum(client, stage):
+    text = client.get('/metrics').get_data(as_text=True)
+    match = re.search(r'^insta_stage_seconds_sum\{stage="' + stage + r'"\} (\S+)$', text, re.M)
+    return float(match.group(1)) if match else 0.0
+
+def test_serve_span_lasts_until_the_body_is_sent(make_app):
+    client = make_app(JOB_QUEUE_ENABLED='0').test_client()
+    body = client.post('/download', json={'url': 'https://www.instagram.com/p/gus_v00001/'}).get_json()
+    assert body['success'], body
+    
+    response = client.get('/serve/' + body['filename'], buffered=False)
+    time.sleep(0.3)
+    response.get_data()
+    response.close()
+    assert stage_sum(client, 'serve') >= 0.3
+
+def counter(client, name, **labels):
+    text = client.get('/metrics').get_data(as_text=True)
+    series = name + '{' + ','.join('%s="%s"' % item for item in sorted(labels.items())) + '}'
+    match = re.search(r'^' + re.escape(series) + r' (\S+)$', text, re.M)
+    return float(match.group(1)) if match else 0.0
+
+@pytest.mark.parametrize('queued', ['1', '0'], ids=['job', 'inline'])
+def test_single_download_counts_one_media_miss(make_app, wait_for_job, queued):
+    app = make_app(JOB_QUEUE_ENABLED=queued)
+    client = app.test_client()
+    response = client.post('/download', json={'url': 'https://www.instagram.com/p/ines_v00001/'})
+    body = response.get_json()
+    if response.status_code == 202:
+        body = wait_for_job(client, body['job_id'])['result']
+    assert body['success'], body
+    
+    assert counter(client, 'insta_cache_misses_total', cache='media') == 1
+    assert app.extensions['downloader'].media_cache.stats()['misses'] == 1
@@ -0,0 +1,40 @@
+import zipfile
+import pytest
+
+def download_profile(client, wait_for_job, username):
+    response = client.post('/download', json={'url': username})
+    assert response.status_code == 202, response.get_json()
+    job = wait_for_job(client, response.get_json()['job_id'])
+    assert job['state'] == 'done', job
+    return job['result']
+
+def archived_media(tmp_path, result):
+    with zipfile.ZipFile(tmp_path / 'zips' / result['filename']) as zipf:
+        return {name for name in zipf.namelist() if name.endswith('.mp4')}
+
+@pytest.mark.parametrize('max_append', ['0', '10'], ids=['rebuilt', 'appended'])
+def test_archive_replacing_a_stale_one_has_the_new_post(make_app, fake, tmp_path, wait_for_job, max_append):
+    fake.pinned_posts = 1
+    client = make_app(JOB_QUEUE_ENABLED='1', ZIP_MODE='disk', PROFILE_MAX_POSTS='0',
+                      PROFILE_ARCHIVE_MAX_APPEND=max_append).test_client()
+    first = download_profile(client, wait_for_job, 'gwen')
+    assert download_profile(client, wait_for_job, 'gwen')['cached']
+    
+    fake.profile_posts += 1
+    new = 'gwen_v%05d.mp4' % (fake.profile_posts - 1)
+    second = download_profile(client, wait_for_job, 'gwen')
+    assert not second.get('cached')
+    assert archived_media(tmp_path, second) == archived_media(tmp_path, first) | {new}
+    
+    # The new archive is current again, so the next request reuses it
+    third = download_profile(client, wait_for_job, 'gwen')
+    assert third['cached']
+    assert third['filename'] == second['filename']
+
+def test_appended_archive_stays_within_max_posts(make_app, fake, tmp_path, wait_for_job):
+    client = make_app(JOB_QUEUE_ENABLED='1', ZIP_MODE='disk', PROFILE_MAX_POSTS='5',
+                      PROFILE_ARCHIVE_MAX_APPEND='10').test_client()
+    for _ in range(3):
+        result = download_profile(client, wait_for_job, 'hugo')
+        assert len(archived_media(tmp_path, result)) <= 5
+        fake.profile_posts += 2
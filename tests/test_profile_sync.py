@@ -0,0 +1,37 @@
+import os
+from utils.downloader import InstagramDownloader
+from utils.pacer import TokenBucket
+from utils.profile_sync import ProfileSync
+
+def make_downloader(tmp_path):
+    profile_sync = ProfileSync(tmp_path / 'library', tmp_path / 'profile_sync.db')
+    return InstagramDownloader(tmp_path, pacer=TokenBucket(100000, 100000), workers=2, profile_sync=profile_sync)
+
+def test_resync_pages_past_an_old_pinned_post(fake, tmp_path):
+    fake.pinned_posts = 1
+    downloader = make_downloader(tmp_path)
+    first = downloader.download_profile('erin', max_posts=0)
+    assert first['success'], first
+    assert first['stopped'] is None
+    
+    # A new video goes on top; the oldest post stays pinned above it
+    fake.profile_posts += 1
+    new = 'erin_v%05d' % (fake.profile_posts - 1)
+    second = downloader.download_profile('erin', max_posts=0)
+    assert second['success'], second
+    assert new + '.mp4' in os.listdir(second['download_path'])
+    assert second['newest'] == new
+    assert second['post_count'] == first['post_count'] + 1
+    assert second['reused'] == first['post_count']
+
+def test_resync_stops_at_first_known_post(fake, tmp_path):
+    downloader = make_downloader(tmp_path)
+    first = downloader.download_profile('finn', max_posts=0)
+    assert first['success'], first
+    
+    pages = fake.stats().get('timeline', 0)
+    second = downloader.download_profile('finn', max_posts=0)
+    assert second['success'], second
+    assert second['reused'] == second['post_count'] == first['post_count']
+    # Nothing new: the first page is enough
+    assert fake.stats()['timeline'] - pages == 1
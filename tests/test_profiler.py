@@ -0,0 +1,37 @@
+import json
+import pytest
+
+TOKEN = 'let-me-profile'
+
+def dump(tmp_path, dump_id):
+    return json.loads((tmp_path / 'profiling' / ('profile-' + dump_id + '.json')).read_text())
+
+def stages(report):
+    return {stage['stage'] for stage in report['stages']}
+
+@pytest.mark.parametrize('zip_mode, zip_stage', [('disk', 'zip_create'), ('stream', 'zip_stream')])
+def test_profiled_profile_job_and_its_zip_record_their_stages(make_app, tmp_path, wait_for_job, zip_mode, zip_stage):
+    client = make_app(JOB_QUEUE_ENABLED='1', ZIP_MODE=zip_mode, PROFILING_TOKEN=TOKEN,
+                      PROFILE_ARCHIVE_CACHE='0').test_client()
+    headers = {'X-Profile-Token': TOKEN}
+    
+    response = client.post('/download', json={'url': 'hana'}, headers=headers)
+    assert response.status_code == 202
+    job = wait_for_job(client, response.get_json()['job_id'])
+    assert job['state'] == 'done', job
+    # Post downloads run on the sync's pool threads, outside the job thread
+    job_stages = stages(dump(tmp_path, job['result']['profile_id']))
+    assert 'profile_download_post' in job_stages
+    if zip_mode == 'disk':
+        assert zip_stage in job_stages
+    
+    response = client.get(job['result']['zip_url'], headers=headers, buffered=False)
+    assert response.status_code == 200
+    dump_id = response.headers['X-Profile-Id']
+    response.get_data()
+    response.close()
+    # Dumped once the body was sent, so a streamed archive is in it
+    report = dump(tmp_path, dump_id)
+    assert report['label'] == 'GET ' + job['result']['zip_url']
+    if zip_mode == 'stream':
+        assert zip_stage in stages(report)
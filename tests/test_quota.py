@@ -0,0 +1,40 @@
+import io
+import zipfile
+import pytest
+
+@pytest.mark.parametrize('zip_mode', ['disk', 'stream'])
+def test_profile_over_quota_keeps_its_own_result(make_app, fake, wait_for_job, zip_mode):
+    # The library alone is over the quota, and the ZIP is as large again
+    fake.profile_posts = 90
+    client = make_app(JOB_QUEUE_ENABLED='1', ZIP_MODE=zip_mode, DISK_QUOTA_MB='1',
+                      PROFILE_MAX_POSTS='0').test_client()
+    response = client.post('/download', json={'url': 'dave'})
+    job = wait_for_job(client, response.get_json()['job_id'])
+    assert job['state'] == 'done', job
+    
+    response = client.get(job['result']['zip_url'], buffered=False)
+    assert response.status_code == 200
+    with zipfile.ZipFile(io.BytesIO(response.get_data())) as zipf:
+        assert len([name for name in zipf.namelist() if name.endswith('.mp4')]) == job['result']['post_count']
+    response.close()
+
+def test_quota_skips_pinned_artifacts_until_released(make_app, tmp_path):
+    cleaner = make_app(DISK_QUOTA_MB='1').extensions['downloader'].cleaner
+    zips = tmp_path / 'zips'
+    zips.mkdir(exist_ok=True)
+    
+    def add(name):
+        (zips / name).write_bytes(b'x' * 512 * 1024)
+        cleaner.track(zips / name)
+    
+    with cleaner.in_use(zips / 'busy.zip'):
+        add('busy.zip')
+        add('old.zip')
+        add('new.zip')
+        # The least recently used one is held, so the next one goes
+        assert (zips / 'busy.zip').exists()
+        assert not (zips / 'old.zip').exists()
+    
+    add('newer.zip')
+    assert not (zips / 'busy.zip').exists()
+    assert (zips / 'new.zip').exists()
@@ -0,0 +1,18 @@
+from utils.stream_proxy import StreamProxy
+
+def test_unread_body_releases_upstream(fake, monkeypatch):
+    proxy = StreamProxy()
+    opened_upstream = []
+    get = proxy.session.get
+    
+    def recording_get(*args, **kwargs):
+        opened_upstream.append(get(*args, **kwargs))
+        return opened_upstream[-1]
+    monkeypatch.setattr(proxy.session, 'get', recording_get)
+    
+    # A HEAD or a client gone before the first chunk closes the body without iterating it
+    opened = proxy.open('dora_v00001', fake.video_url('dora_v00001'))
+    assert opened['success'], opened
+    assert not opened_upstream[0].raw.closed
+    opened['body'].close()
+    assert opened_upstream[0].raw.closed
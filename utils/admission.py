@@ -0,0 +1,119 @@
+import os
+import time
+import uuid
+from utils.sqlite_store import SQLiteStore, pid_alive
+
+class Overloaded(Exception):
+    """Raised instead of admitting a heavy request while the server is saturated"""
+    
+    def __init__(self, retry_after: float):
+        super().__init__('Server is busy, retry in %d seconds' % max(1, round(retry_after)))
+        self.retry_after = retry_after
+
+class AdmissionControl(SQLiteStore):
+    """
+    Cross-worker count of in-flight heavy requests (uncached downloads,
+    streams, archives). Past max_in_flight a new one is turned away at once
+    with a Retry-After estimated from recent service times, instead of
+    waiting in gunicorn's backlog. Light routes never take a slot
+    """
+    
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS slots (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            pid INTEGER NOT NULL,
+            started_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS service (
+            kind TEXT PRIMARY KEY,
+            seconds REAL NOT NULL
+        );
+    '''
+    
+    # Weight of the newest request in the moving average of service times
+    SMOOTHING = 0.2
+    
+    def __init__(self, db_path: str, max_in_flight: int, slot_timeout: int = 3600, default_seconds: float = 5.0):
+        self.max_in_flight = max_in_flight
+        # Slots older than this belong to requests that never released them
+        self.slot_timeout = slot_timeout
+        self.default_seconds = default_seconds
+        super().__init__(db_path)
+    
+    def enter(self, kind: str) -> str:
+        """
+        Claims an in-flight slot
+        Returns: slot id; raises Overloaded if all slots are taken
+        """
+        slot_id = uuid.uuid4().hex
+        now = time.time()
+        with self._transaction() as conn:
+            in_flight = conn.execute('SELECT COUNT(*) FROM slots').fetchone()[0]
+            if in_flight >= self.max_in_flight:
+                # Only a full table is worth checking for slots of dead or hung workers
+                in_flight -= self._purge(conn, now)
+            if in_flight >= self.max_in_flight:
+                self._incr('shed', conn=conn)
+                retry_after = self._retry_after(conn, kind, in_flight)
+            else:
+                conn.execute('INSERT INTO slots (id, kind, pid, started_at) VALUES (?, ?, ?, ?)',
+                             (slot_id, kind, os.getpid(), now))
+                self._incr('admitted', conn=conn)
+                retry_after = None
+        
+        # Raised after commit, so the shed counter is kept
+        if retry_after is not None:
+            raise Overloaded(retry_after)
+        return slot_id
+    
+    def leave(self, slot_id: str):
+        """Releases a slot and folds its duration into the service time average"""
+        with self._transaction() as conn:
+            row = conn.execute('SELECT kind, started_at FROM slots WHERE id = ?', (slot_id,)).fetchone()
+            if row is None:
+                return
+            conn.execute('DELETE FROM slots WHERE id = ?', (slot_id,))
+            conn.execute(
+                'INSERT INTO service (kind, seconds) VALUES (?, ?) '
+                'ON CONFLICT(kind) DO UPDATE SET seconds = seconds + ? * (excluded.seconds - seconds)',
+                (row['kind'], time.time() - row['started_at'], self.SMOOTHING)
+            )
+    
+    def saturation(self) -> float:
+        """Returns in-flight heavy requests as a fraction of max_in_flight"""
+        in_flight = self._connect().execute('SELECT COUNT(*) FROM slots').fetchone()[0]
+        return in_flight / self.max_in_flight
+    
+    def stats(self) -> dict:
+        """Returns in-flight count, saturation, service times and counters"""
+        conn = self._connect()
+        in_flight = conn.execute('SELECT COUNT(*) FROM slots').fetchone()[0]
+        service = {row['kind']: round(row['seconds'], 3)
+                   for row in conn.execute('SELECT kind, seconds FROM service')}
+        counters = self.counters()
+        return {
+            'in_flight': in_flight,
+            'max_in_flight': self.max_in_flight,
+            'saturation': round(in_flight / self.max_in_flight, 3),
+            'service_seconds': service,
+            'admitted': counters.get('admitted', 0),
+            'shed': counters.get('shed', 0)
+        }
+    
+    def _purge(self, conn, now: float) -> int:
+        """
+        Drops slots of killed workers and of requests past slot_timeout
+        Returns: number of dropped slots
+        """
+        dead = [(row['pid'],) for row in conn.execute('SELECT DISTINCT pid FROM slots')
+                if not pid_alive(row['pid'])]
+        purged = conn.executemany('DELETE FROM slots WHERE pid = ?', dead).rowcount if dead else 0
+        purged += conn.execute('DELETE FROM slots WHERE started_at < ?', (now - self.slot_timeout,)).rowcount
+        return purged
+    
+    def _retry_after(self, conn, kind: str, in_flight: int) -> float:
+        """Estimates when a slot frees up: one mean service time per request ahead, spread over all slots"""
+        row = conn.execute('SELECT seconds FROM service WHERE kind = ?', (kind,)).fetchone()
+        seconds = row['seconds'] if row else self.default_seconds
+        return seconds * (in_flight - self.max_in_flight + 1) / self.max_in_flight
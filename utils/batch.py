@@ -0,0 +1,105 @@
+import json
+import time
+import uuid
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from utils.downloader import link_file
+from utils.jobs import JobTimeout
+from utils.storage import shard_path
+
+class BatchDownloader:
+    """
+    Fans a batch of posts and profiles out over a bounded pool
+    Results are linked into one directory that is archived as a whole
+    """
+    
+    def __init__(self, downloader, downloads_dir: str, workers: int = 4, cleaner=None, profile_limits=None):
+        self.downloader = downloader
+        self.profile_limits = profile_limits or {}
+        self.batches_dir = Path(downloads_dir) / 'batches'
+        self.workers = workers
+        self.cleaner = cleaner
+    
+    def run(self, items: list, rejected: list = None, progress=None) -> dict:
+        """
+        Downloads every item; failures are recorded per item and never stop the batch
+        Returns: manifest dict with batch_id, per-item results and throughput
+        """
+        batch_id = uuid.uuid4().hex[:12]
+        batch_dir = self.batches_dir / batch_id
+        batch_dir.mkdir(parents=True, exist_ok=True)
+        if self.cleaner:
+            self.cleaner.track(batch_dir)
+        
+        results = [dict(item, status='pending') for item in items]
+        started = time.perf_counter()
+        done = 0
+        
+        pool = ThreadPoolExecutor(max_workers=self.workers)
+        # Each item runs in a copy of this thread's context, so a profiling session sees it
+        futures = {pool.submit(contextvars.copy_context().run, self._fetch, item): index
+                   for index, item in enumerate(items)}
+        try:
+            for future in as_completed(futures):
+                result = results[futures[future]]
+                try:
+                    result.update(self._collect(future.result(), result, batch_dir))
+                except Exception as e:
+                    result.update(status='failed', error=str(e))
+                done += 1
+                if progress:
+                    progress(done / len(items), str(done) + ' of ' + str(len(items)) + ' items done')
+        except JobTimeout:
+            # Keep what finished; the rest is reported instead of losing the batch
+            for result in results:
+                if result['status'] == 'pending':
+                    result.update(status='failed', error='Batch timed out')
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+        
+        elapsed = time.perf_counter() - started
+        succeeded = sum(1 for result in results if result['status'] == 'ok')
+        manifest = {
+            'success': succeeded > 0,
+            'batch_id': batch_id,
+            'items': results,
+            'rejected': rejected or [],
+            'succeeded': succeeded,
+            'failed': len(results) - succeeded,
+            'elapsed': round(elapsed, 3),
+            'items_per_second': round(done / elapsed, 3) if elapsed > 0 else 0.0
+        }
+        if not succeeded:
+            manifest['error'] = 'None of the batch items could be downloaded'
+        
+        with open(batch_dir / 'manifest.json', 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2, ensure_ascii=False)
+        if self.cleaner:
+            self.cleaner.track(batch_dir)
+        return manifest
+    
+    def _fetch(self, item: dict) -> dict:
+        """Runs one item on the pool"""
+        if item['type'] == 'post':
+            return self.downloader.download_single_post('https://www.instagram.com/p/' + item['key'] + '/')
+        return self.downloader.download_profile(item['key'], **self.profile_limits)
+    
+    def _collect(self, outcome: dict, item: dict, batch_dir: Path) -> dict:
+        """
+        Links a finished item into the batch directory
+        Returns: fields to merge into the item's manifest entry
+        """
+        if not outcome['success']:
+            return {'status': 'failed', 'error': outcome['error']}
+        
+        if item['type'] == 'post':
+            source = shard_path(self.downloader.downloads_dir / 'single', outcome['filename'])
+            link_file(source, batch_dir / outcome['filename'])
+            return {'status': 'ok', 'filename': outcome['filename'], 'cached': outcome.get('cached', False)}
+        
+        profile_dir = batch_dir / item['key']
+        profile_dir.mkdir(exist_ok=True)
+        for source in Path(outcome['download_path']).iterdir():
+            link_file(source, profile_dir / source.name)
+        return {'status': 'ok', 'filename': item['key'] + '/', 'post_count': outcome['post_count']}
@@ -0,0 +1,166 @@
+import os
+import time
+import hashlib
+from pathlib import Path
+from utils.sqlite_store import SQLiteStore
+
+class BlobStore(SQLiteStore):
+    """
+    Content-addressed store of downloaded media, keyed by shortcode and SHA-256
+    Files under single/, library/, profiles/ and batches/ are hardlinks to
+    one blob; a blob is garbage once only the store's own link is left
+    """
+    
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS blobs (
+            digest TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            created_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS shortcodes (
+            shortcode TEXT PRIMARY KEY,
+            digest TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS shortcodes_digest ON shortcodes (digest);
+    '''
+    
+    def __init__(self, blob_dir: str, db_path: str, grace_seconds: int = 300):
+        self.blob_dir = Path(blob_dir)
+        self.blob_dir.mkdir(parents=True, exist_ok=True)
+        # Fresh blobs may not be linked anywhere yet
+        self.grace_seconds = grace_seconds
+        super().__init__(db_path)
+    
+    def path_for(self, digest: str) -> Path:
+        """Returns where a blob lives; sharded so no directory grows huge"""
+        return self.blob_dir / digest[:2] / (digest + '.mp4')
+    
+    def lookup(self, shortcode: str) -> Path:
+        """
+        Finds the stored media of a shortcode
+        Returns: blob path or None
+        """
+        row = self._connect().execute('SELECT digest FROM shortcodes WHERE shortcode = ?', (shortcode,)).fetchone()
+        if row is None:
+            return None
+        path = self.path_for(row['digest'])
+        return path if path.is_file() else None
+    
+    def materialize(self, shortcode: str, target) -> bool:
+        """
+        Hardlinks a shortcode's stored media to target instead of downloading it again
+        Returns: False if the shortcode is not stored
+        """
+        blob = self.lookup(shortcode)
+        if blob is None:
+            return False
+        try:
+            os.link(blob, target)
+        except FileExistsError:
+            pass
+        except OSError:
+            # Collected meanwhile, or target is on another filesystem
+            return False
+        self._incr('reused')
+        self._incr('bytes_saved', os.stat(target).st_size)
+        return True
+    
+    def ingest(self, source, shortcode: str) -> Path:
+        """
+        Stores a downloaded file; source stays in place as a link to the blob
+        Identical content already stored replaces source, so it is kept once
+        Returns: blob path, or None if source cannot be linked into the store
+        """
+        source = Path(source)
+        blob = self.lookup(shortcode)
+        if blob is not None and os.path.samestat(os.stat(source), os.stat(blob)):
+            return blob
+        
+        digest, size = _hash_file(source)
+        blob = self.path_for(digest)
+        blob.parent.mkdir(exist_ok=True)
+        
+        for _ in range(3):
+            try:
+                os.link(source, blob)
+                self._incr('ingested')
+                break
+            except FileExistsError:
+                pass
+            except OSError:
+                return None
+            
+            # Same bytes from another post or profile; swap the copy for a link
+            staged = source.with_name(source.name + '.dedup')
+            try:
+                os.link(blob, staged)
+            except FileNotFoundError:
+                # Collected between the two links; store this copy instead
+                continue
+            except OSError:
+                return None
+            os.replace(staged, source)
+            self._incr('deduplicated')
+            self._incr('bytes_saved', size)
+            break
+        
+        with self._transaction() as conn:
+            conn.execute('INSERT OR IGNORE INTO blobs (digest, size, created_at) VALUES (?, ?, ?)',
+                         (digest, size, time.time()))
+            conn.execute('INSERT OR REPLACE INTO shortcodes (shortcode, digest) VALUES (?, ?)',
+                         (shortcode, digest))
+        return blob
+    
+    def collect(self) -> int:
+        """
+        Removes blobs no file links to any more (link count 1)
+        Returns: number of removed blobs
+        """
+        rows = self._connect().execute('SELECT digest FROM blobs WHERE created_at < ?',
+                                       (time.time() - self.grace_seconds,)).fetchall()
+        garbage = []
+        for row in rows:
+            path = self.path_for(row['digest'])
+            try:
+                if os.stat(path).st_nlink > 1:
+                    continue
+            except FileNotFoundError:
+                pass
+            garbage.append(row['digest'])
+        
+        if garbage:
+            with self._transaction() as conn:
+                conn.executemany('DELETE FROM blobs WHERE digest = ?', [(digest,) for digest in garbage])
+                conn.executemany('DELETE FROM shortcodes WHERE digest = ?', [(digest,) for digest in garbage])
+                self._incr('collected', len(garbage), conn=conn)
+            # Unlink after commit so no worker links to a blob it cannot find again
+            for digest in garbage:
+                self.path_for(digest).unlink(missing_ok=True)
+        return len(garbage)
+    
+    def stats(self) -> dict:
+        """Returns blob count, stored bytes and dedup counters"""
+        row = self._connect().execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs').fetchone()
+        counters = self.counters()
+        return {
+            'blobs': row[0],
+            'bytes': row[1],
+            'ingested': counters.get('ingested', 0),
+            'deduplicated': counters.get('deduplicated', 0),
+            'reused': counters.get('reused', 0),
+            'bytes_saved': counters.get('bytes_saved', 0),
+            'collected': counters.get('collected', 0)
+        }
+
+def _hash_file(path: Path, chunk_size: int = 1024 * 1024) -> tuple:
+    """Returns: (SHA-256 hex digest, size) of a file"""
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(chunk_size)
+            if not block:
+                break
+            digest.update(block)
+            size += len(block)
+    return digest.hexdigest(), size
@@ -1,14 +1,26 @@
 import os
 import time
+import uuid
 import threading
+from contextlib import contextmanager
 from pathlib import Path
+from utils.metrics import NULL_METRICS
+from utils.storage import sweep_staging
 
 class FileCleaner:
     """Automatically cleans old downloaded files"""
     
-    def __init__(self, downloads_dir: str, max_age_minutes: int = 30):
+    def __init__(self, downloads_dir: str, max_age_minutes: int = 30, media_cache=None,
+                 expiry_index=None, quota_bytes: int = None, interval_seconds: int = 600, metrics=None,
+                 blob_store=None):
         self.downloads_dir = Path(downloads_dir)
+        self.metrics = metrics or NULL_METRICS
         self.max_age_seconds = max_age_minutes * 60
+        self.media_cache = media_cache
+        self.expiry_index = expiry_index
+        self.blob_store = blob_store
+        self.quota_bytes = quota_bytes
+        self.interval_seconds = interval_seconds
         self.running = False
         self.thread = None
     
@@ -29,22 +41,112 @@ class FileCleaner:
         """Background loop that cleans old files"""
         while self.running:
             try:
-                self.cleanup_old_files()
+                with self.metrics.span('cleanup'):
+                    self.cleanup_old_files()
             except Exception as e:
                 print(f"Cleanup error: {e}")
             
-            # Run cleanup every 10 minutes
-            time.sleep(600)
+            time.sleep(self.interval_seconds)
+    
+    def track(self, path, ttl_seconds: int = None):
+        """
+        Registers a new artifact in the expiry index at creation time
+        Evicts least recently used artifacts right away if over quota
+        """
+        if self.expiry_index is None:
+            return
+        self.expiry_index.register(path, ttl_seconds or self.max_age_seconds)
+        self.enforce_quota()
+    
+    def touch(self, path, ttl_seconds: int = None):
+        """Marks an artifact as recently used; with ttl_seconds, also keeps it at least that long"""
+        if self.expiry_index is not None:
+            self.expiry_index.touch(path, ttl_seconds)
+    
+    @contextmanager
+    def in_use(self, *paths):
+        """
+        Keeps artifacts from expiry and quota eviction while a block writes or reads them
+        Yields: function renewing the hold, for blocks that may outlast its lease
+        """
+        if self.expiry_index is None:
+            yield lambda: None
+            return
+        holder = uuid.uuid4().hex
+        
+        def renew():
+            for path in paths:
+                self.expiry_index.pin(path, holder)
+        
+        renew()
+        try:
+            yield renew
+        finally:
+            self.expiry_index.unpin(holder)
+    
+    def enforce_quota(self) -> int:
+        """Evicts least recently used artifacts while over the disk quota"""
+        if self.expiry_index is None or self.quota_bytes is None:
+            return 0
+        with self.metrics.span('quota'):
+            victims = self.expiry_index.pop_over_quota(self.quota_bytes)
+            for path in victims:
+                self._remove(self.downloads_dir / path)
+        if victims:
+            self.metrics.incr('evictions_total', len(victims), reason='quota')
+        return len(victims)
     
     def cleanup_old_files(self):
         """Removes files older than max_age"""
+        self._sweep_staging()
+        if self.expiry_index is None:
+            self._scan_old_files()
+            return self._collect_blobs()
+        
+        if self.media_cache is not None:
+            self.media_cache.evict()
+        
+        # Only expired entries are touched; nothing is listed or stat()ed
+        while True:
+            expired = self.expiry_index.pop_expired()
+            for path in expired:
+                self._remove(self.downloads_dir / path)
+            if expired:
+                self.metrics.incr('evictions_total', len(expired), reason='expired')
+            if len(expired) < 1000:
+                break
+        
+        self.enforce_quota()
+        self._collect_blobs()
+    
+    def _sweep_staging(self):
+        """Removes staging directories of downloads that never finished"""
+        swept = sweep_staging(self.downloads_dir / 'single', self.max_age_seconds)
+        if swept:
+            self.metrics.incr('evictions_total', swept, reason='abandoned_staging')
+    
+    def _collect_blobs(self):
+        """Drops stored media that no remaining download links to"""
+        if self.blob_store is not None:
+            collected = self.blob_store.collect()
+            if collected:
+                self.metrics.incr('evictions_total', collected, reason='unreferenced_blob')
+    
+    def _scan_old_files(self):
+        """Removes files older than max_age by scanning every directory"""
         current_time = time.time()
         
-        # Clean single downloads
+        # Cached videos follow the cache's own LRU/TTL policy
+        cached = set()
+        if self.media_cache is not None:
+            self.media_cache.evict()
+            cached = self.media_cache.filenames()
+        
+        # Clean single downloads, stored in hash shards
         single_dir = self.downloads_dir / 'single'
         if single_dir.exists():
-            for file in single_dir.glob('*'):
-                if file.is_file():
+            for file in single_dir.glob('*/*'):
+                if file.is_file() and file.name not in cached:
                     age = current_time - file.stat().st_mtime
                     if age > self.max_age_seconds:
                         file.unlink(missing_ok=True)
@@ -67,6 +169,13 @@ class FileCleaner:
                     if age > self.max_age_seconds:
                         zip_file.unlink(missing_ok=True)
     
+    def _remove(self, path: Path):
+        """Removes a file or directory if it still exists"""
+        if path.is_dir():
+            self._remove_directory(path)
+        else:
+            path.unlink(missing_ok=True)
+    
     def _remove_directory(self, directory: Path):
         """Recursively removes directory"""
         try:
@@ -1,134 +1,540 @@
 import os
+import copy
+import json
+import itertools
+import contextvars
+import shutil
 import time
 import uuid
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from contextlib import contextmanager, nullcontext
 from pathlib import Path
 import instaloader
+from utils import storage
+from utils.metrics import NULL_METRICS
+from utils.pacer import TokenBucket
+from utils.upstream_health import UpstreamUnavailable, is_rate_limited
+
+# Posts per timeline page, as requested by instaloader
+PROFILE_PAGE_SIZE = 12
+
+# Instagram lets a profile pin up to this many posts above its newest ones
+MAX_PINNED_POSTS = 3
+
+# How often a running sync renews its pins and its library's expiry and last use
+LIBRARY_KEEPALIVE_SECONDS = 60
 
 class InstagramDownloader:
-    def __init__(self, downloads_dir):
+    def __init__(self, downloads_dir, media_cache=None, pacer=None, workers=3, singleflight=None,
+                 metadata_cache=None, cleaner=None, profile_sync=None, session_pool=None, metrics=None,
+                 blob_store=None):
         self.downloads_dir = Path(downloads_dir)
-        self.loader = instaloader.Instaloader(
-            download_videos=True,
-            download_video_thumbnails=False,
-            download_geotags=False,
-            download_comments=False,
-            save_metadata=False,
-            compress_json=False,
-            post_metadata_txt_pattern='',
-            max_connection_attempts=3
-        )
-        self.loader.context.sleep = True
-        self.loader.context.max_connection_attempts = 3
-    
-    def download_single_post(self, post_input):
+        self.blob_store = blob_store
+        self.metrics = metrics or NULL_METRICS
+        self.session_pool = session_pool
+        self.cleaner = cleaner
+        self.profile_sync = profile_sync
+        self.media_cache = media_cache
+        self.metadata_cache = metadata_cache
+        self.singleflight = singleflight
+        self.pacer = pacer or TokenBucket()
+        self.workers = workers
+        # Standalone use; with a session pool every call checks a loader out
+        self.loader = None
+        if session_pool is None:
+            self.loader = instaloader.Instaloader(
+                download_videos=True,
+                download_video_thumbnails=False,
+                download_geotags=False,
+                download_comments=False,
+                save_metadata=False,
+                compress_json=False,
+                post_metadata_txt_pattern='',
+                max_connection_attempts=3,
+                # Paced by the token bucket alone, not on top of Instaloader's random sleep
+                sleep=False,
+                rate_controller=self.pacer.rate_controller()
+            )
+            self.loader.context.max_connection_attempts = 3
+    
+    def download_single_post(self, post_input, progress=None):
         try:
             shortcode = self._extract_shortcode(post_input)
             if not shortcode:
                 return {'success': False, 'error': 'Invalid post URL'}
             
-            post = instaloader.Post.from_shortcode(self.loader.context, shortcode)
+            if self.media_cache is not None:
+                cached = self.media_cache.get(shortcode)
+                if cached:
+                    self.metrics.incr('cache_hits_total', cache='media')
+                    return {
+                        'success': True,
+                        'filename': cached['filename'],
+                        'caption': cached['caption'],
+                        'cached': True
+                    }
             
-            if not post.is_video:
-                return {'success': False, 'error': 'This post does not contain a video'}
+            if self.metadata_cache is not None:
+                meta = self.metadata_cache.get(shortcode)
+                if meta and meta['status'] == 'not_found':
+                    self.metrics.incr('cache_hits_total', cache='metadata')
+                    return {'success': False, 'error': 'Post not found', 'status': 404}
+                if meta and meta['status'] == 'not_video':
+                    self.metrics.incr('cache_hits_total', cache='metadata')
+                    return {'success': False, 'error': 'This post does not contain a video', 'status': 400}
             
-            unique_id = uuid.uuid4().hex[:8]
-            filename = post.owner_username + '_' + shortcode + '_' + unique_id + '.mp4'
-            filepath = self.downloads_dir / 'single' / filename
+            self.metrics.incr('cache_misses_total', cache='media')
+            if self.singleflight is not None:
+                return self.singleflight.do(shortcode, lambda: self.fetch_single_post(shortcode, progress))
+            return self.fetch_single_post(shortcode, progress)
+        
+        except UpstreamUnavailable as e:
+            return {'success': False, 'error': str(e), 'status': 503, 'retry_after': e.retry_after}
+        except instaloader.exceptions.InstaloaderException as e:
+            return {'success': False, 'error': 'Instagram error: ' + str(e)}
+        except Exception as e:
+            return {'success': False, 'error': 'Download failed: ' + str(e)}
+    
+    def fetch_single_post(self, shortcode, progress=None):
+        """
+        Downloads one post the media cache does not have, for jobs and the
+        inline request path alike
+        Returns: dict with success, filename, caption or error (and status)
+        """
+        try:
+            # Everything is downloaded into a private directory, then renamed into place
+            with storage.staging(self.downloads_dir / 'single') as staged:
+                return self._fetch_single_post(shortcode, staged / (shortcode + '.mp4'), progress)
+        except UpstreamUnavailable as e:
+            return {'success': False, 'error': str(e), 'status': 503, 'retry_after': e.retry_after}
+        except instaloader.exceptions.InstaloaderException as e:
+            return {'success': False, 'error': 'Instagram error: ' + str(e)}
+        except Exception as e:
+            return {'success': False, 'error': 'Download failed: ' + str(e)}
+    
+    def _fetch_single_post(self, shortcode, video, progress=None):
+        """Downloads one post into video, then stores it"""
+        # Stored by a profile or an evicted cache entry: link it, no upstream call
+        meta = self.metadata_cache.get(shortcode) if self.metadata_cache is not None else None
+        if meta and meta['status'] == 'ok' and self.blob_store is not None \
+                and self.blob_store.materialize(shortcode, video):
+            self.metrics.incr('cache_hits_total', cache='blob')
+            with self.metrics.span('finalize'):
+                filename = self._store_single(shortcode, video, meta['owner'], meta['caption'])
+            return {'success': True, 'filename': filename, 'caption': meta['caption']}
+        
+        with self._session() as loader:
+            try:
+                with self.metrics.span('post_metadata'):
+                    post = instaloader.Post.from_shortcode(loader.context, shortcode)
+            except (instaloader.exceptions.QueryReturnedNotFoundException,
+                    instaloader.exceptions.BadResponseException) as e:
+                self.metrics.incr('upstream_errors_total', type=type(e).__name__)
+                if self.metadata_cache is not None:
+                    self.metadata_cache.record_missing(shortcode)
+                return {'success': False, 'error': 'Post not found', 'status': 404}
+            if self.metadata_cache is not None:
+                self.metadata_cache.record_post(post)
             
-            self.loader.download_post(post, target=str(filepath.parent / unique_id))
+            if not post.is_video:
+                return {'success': False, 'error': 'This post does not contain a video', 'status': 400}
             
-            downloaded_files = list((filepath.parent).glob(unique_id + '*.mp4'))
-            if downloaded_files:
-                downloaded_files[0].rename(filepath)
-                
-                for f in (filepath.parent).glob(unique_id + '*'):
-                    if f != filepath:
-                        f.unlink(missing_ok=True)
-                
-                return {
-                    'success': True,
-                    'filename': filename,
-                    'caption': post.caption if post.caption else ''
-                }
+            if progress:
+                progress(0.2, 'Downloading video')
             
+            reused = self.blob_store is not None and self.blob_store.materialize(shortcode, video)
+            if not reused:
+                self.pacer.acquire()
+                with self.metrics.span('download_post'):
+                    self._loader_for(video.parent, loader).download_post(post, target=shortcode)
+        
+        # Instaloader names the file after the target, so its path is known
+        if not video.is_file():
             return {'success': False, 'error': 'Failed to download video'}
-            
+        if not reused:
+            self.metrics.incr('downloaded_bytes_total', video.stat().st_size, kind='single')
+        
+        caption = post.caption if post.caption else ''
+        with self.metrics.span('finalize'):
+            filename = self._store_single(shortcode, video, post.owner_username, caption)
+        return {'success': True, 'filename': filename, 'caption': caption}
+    
+    def _store_single(self, shortcode, video, owner, caption):
+        """
+        Renames a staged video into the media cache, or into its shard without one
+        Returns: stored filename
+        """
+        if self.media_cache is not None:
+            # The cache ingests it into the blob store itself
+            return self.media_cache.put(shortcode, video, owner, caption)['filename']
+        filename = owner + '_' + shortcode + '_' + uuid.uuid4().hex[:8] + '.mp4'
+        if self.blob_store is not None:
+            self.blob_store.ingest(video, shortcode)
+        storage.commit(video, storage.shard_path(self.downloads_dir / 'single', filename))
+        return filename
+    
+    def download_profile(self, username, progress=None, max_posts=50, max_bytes=None, max_seconds=None,
+                         manifest=False):
+        """
+        Downloads the newest videos of a profile until max_posts videos,
+        max_bytes or max_seconds is reached; None or 0 means no limit
+        """
+        try:
+            with self.metrics.span('profile'), self._session() as loader:
+                return self._sync_profile(loader, username, progress, max_posts, max_bytes, max_seconds, manifest)
+        except instaloader.exceptions.ProfileNotExistsException:
+            return {'success': False, 'error': 'Profile not found'}
+        except UpstreamUnavailable as e:
+            return {'success': False, 'error': str(e), 'status': 503, 'retry_after': e.retry_after}
         except instaloader.exceptions.InstaloaderException as e:
             return {'success': False, 'error': 'Instagram error: ' + str(e)}
         except Exception as e:
             return {'success': False, 'error': 'Download failed: ' + str(e)}
     
-    def download_profile(self, username):
+    def profile_head(self, username):
+        """
+        Looks up the newest video of a profile from its first timeline page only
+        Pinned posts come first on that page, so the newest is picked by date
+        Returns: dict with success and newest (shortcode, None without videos)
+        """
         try:
-            profile = instaloader.Profile.from_username(self.loader.context, username)
+            with self.metrics.span('profile_head'), self._session() as loader:
+                profile = instaloader.Profile.from_username(loader.context, username)
+                private = profile.is_private
+                first_page = [] if private else itertools.islice(profile.get_posts(), PROFILE_PAGE_SIZE)
+                videos = [post for post in first_page if post.is_video]
+        except instaloader.exceptions.ProfileNotExistsException:
+            return {'success': False, 'error': 'Profile not found'}
+        except UpstreamUnavailable as e:
+            return {'success': False, 'error': str(e), 'status': 503, 'retry_after': e.retry_after}
+        except instaloader.exceptions.InstaloaderException as e:
+            return {'success': False, 'error': 'Instagram error: ' + str(e)}
+        
+        if private:
+            return {'success': False, 'error': 'This profile is private. Only public profiles are supported.'}
+        newest = max(videos, key=lambda post: post.date_utc).shortcode if videos else None
+        return {'success': True, 'newest': newest}
+    
+    def _sync_profile(self, loader, username, progress=None, max_posts=50, max_bytes=None, max_seconds=None,
+                      manifest=False):
+        """
+        Downloads a profile with a checked out loader; errors propagate so
+        the session pool sees them
+        Each finished post is written out right away, so memory stays flat
+        however many posts the limits allow
+        """
+        with self.metrics.span('profile_metadata'):
+            profile = instaloader.Profile.from_username(loader.context, username)
+        
+        if profile.is_private:
+            return {'success': False, 'error': 'This profile is private. Only public profiles are supported.'}
+        
+        unique_id = uuid.uuid4().hex[:8]
+        download_path = self.downloads_dir / 'profiles' / (username + '_' + unique_id)
+        download_path.mkdir(parents=True, exist_ok=True)
+        
+        # With a sync manifest, media lives in the profile's library and the
+        # result directory only gets links to it
+        stop_at_known = False
+        media_path = download_path
+        if self.profile_sync is not None:
+            stop_at_known = self.profile_sync.begin(username)['complete']
+            media_path = self.profile_sync.library_for(username)
+        
+        # Neither may be evicted while this sync fills them, whatever else goes over the quota
+        with self._in_use(download_path, media_path) as renew:
+            if self.cleaner:
+                # Registered up front so an abandoned download still expires
+                self.cleaner.track(download_path)
+            if media_path != download_path:
+                self._keep_library(media_path)
+            kept_at = time.monotonic()
             
-            if profile.is_private:
-                return {'success': False, 'error': 'This profile is private. Only public profiles are supported.'}
+            timings = {'metadata': 0.0, 'download': 0.0, 'pacer_wait': 0.0, 'write': 0.0}
+            counts = {'failed': 0}
+            started = time.perf_counter()
+            deadline = time.monotonic() + max_seconds if max_seconds else None
+            expected = max_posts or profile.mediacount or 1
+            stopped = None
             
-            unique_id = uuid.uuid4().hex[:8]
-            download_path = self.downloads_dir / 'profiles' / (username + '_' + unique_id)
-            download_path.mkdir(parents=True, exist_ok=True)
+            writer = _ProfileWriter(download_path, media_path, manifest)
+            try:
+                results = self._stream_posts(loader, profile, username, media_path, stop_at_known, timings, counts,
+                                             deadline)
+                try:
+                    for entry, reused in results:
+                        write_started = time.perf_counter()
+                        writer.add(entry, reused)
+                        timings['write'] += time.perf_counter() - write_started
+                        if progress:
+                            progress(min(writer.posts / expected, 1.0), str(writer.posts) + ' videos downloaded')
+                        if time.monotonic() - kept_at > LIBRARY_KEEPALIVE_SECONDS:
+                            renew()
+                            if media_path != download_path:
+                                self._keep_library(media_path)
+                            kept_at = time.monotonic()
+                        stopped = _limit_reached(writer, max_posts, max_bytes, deadline)
+                        if stopped:
+                            break
+                    else:
+                        stopped = 'time' if deadline and time.monotonic() >= deadline else None
+                finally:
+                    results.close()
+                
+                # Paged down to the first known post, so the library holds every
+                # older one; with a limit that stopped paging early it may not
+                covered = stopped is None
+                if stop_at_known and covered:
+                    for entry in self.profile_sync.posts(username, max_posts - writer.posts if max_posts else -1):
+                        if (download_path / entry['filename']).exists():
+                            continue
+                        writer.add(entry, True)
+                        stopped = _limit_reached(writer, max_posts, max_bytes, deadline)
+                        if stopped:
+                            break
+            finally:
+                writer.close()
             
-            post_count = 0
-            captions_data = []
+            if self.profile_sync is not None:
+                if covered:
+                    self.profile_sync.finish(username)
+                if self.cleaner:
+                    # The library outlives single results; new files only refresh its size
+                    self.cleaner.track(media_path, self.profile_sync.ttl_seconds)
             
-            for post in profile.get_posts():
-                if post.is_video:
-                    try:
-                        time.sleep(2)
-                        
-                        shortcode = post.shortcode
-                        target = download_path / shortcode
-                        
-                        self.loader.download_post(post, target=str(target))
-                        
-                        caption = post.caption if post.caption else ''
-                        video_files = list(download_path.glob(shortcode + '*.mp4'))
-                        if video_files:
-                            captions_data.append({
-                                'file': video_files[0].name,
-                                'caption': caption
-                            })
-                        
-                        post_count += 1
-                        
-                        if post_count >= 50:
-                            break
-                            
-                    except Exception:
-                        continue
+            timings['wall'] = time.perf_counter() - started
             
-            if post_count == 0:
+            if writer.posts == 0:
                 return {'success': False, 'error': 'No public videos found on this profile'}
             
-            captions_file = download_path / 'captions.txt'
-            with open(captions_file, 'w', encoding='utf-8') as f:
-                for item in captions_data:
-                    f.write('File: ' + item['file'] + '\n')
-                    f.write('Caption: ' + item['caption'] + '\n')
-                    f.write('-' * 80 + '\n\n')
-            
-            for f in download_path.rglob('*.json*'):
-                f.unlink(missing_ok=True)
-            for f in download_path.rglob('*.txt'):
-                if f.name != 'captions.txt':
-                    f.unlink(missing_ok=True)
-            for f in download_path.rglob('*.jpg'):
-                f.unlink(missing_ok=True)
+            if self.cleaner:
+                self.cleaner.track(download_path)
             
             return {
                 'success': True,
                 'download_path': str(download_path),
                 'username': username,
-                'post_count': post_count
+                'post_count': writer.posts,
+                'bytes': writer.bytes,
+                'reused': writer.reused,
+                'failed': counts['failed'],
+                'stopped': stopped,
+                'newest': writer.newest,
+                'timings': {stage: round(seconds, 3) for stage, seconds in timings.items()}
             }
+    
+    def _stream_posts(self, loader, profile, username, media_path, stop_at_known, timings, counts,
+                      deadline=None):
+        """
+        Yields (entry, reused) for each video of a profile in post order
+        Stage 1 pages metadata ahead, stage 2 downloads on a bounded pool;
+        at most 2 * workers posts are in flight, and nothing else is kept
+        Ends when the profile runs out, at the first known post with
+        stop_at_known, or at the deadline; closing it stops both stages
+        The pager resolves each post's video URL, caption and date, so only
+        it ever queries Instagram through the profile's loader; download
+        threads get plain records and fetch the CDN file through a fresh
+        anonymous session on the loader's keep-alive adapter. Checking out a
+        loader per post starved the pool once several profiles ran at once
+        """
+        window = self.workers * 2
+        posts = queue.Queue(maxsize=window)
+        stop = threading.Event()
+        pager = threading.Thread(target=self._page_posts,
+                                 args=(profile, username, posts, stop, timings, stop_at_known), daemon=True)
+        pager.start()
+        
+        in_flight = deque()
+        exhausted = False
+        pool = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            while deadline is None or time.monotonic() < deadline:
+                while not exhausted and len(in_flight) < window:
+                    try:
+                        item = posts.get(block=not in_flight, timeout=_remaining(deadline))
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        exhausted = True
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    known = self.profile_sync.get(username, item['shortcode']) if self.profile_sync else None
+                    if known:
+                        in_flight.append((self._reuse(known), True))
+                    else:
+                        # In a copy of this thread's context, so a profiling session sees the download
+                        future = pool.submit(contextvars.copy_context().run, self._fetch_profile_post, item,
+                                             media_path, username, loader)
+                        in_flight.append((future, False))
+                
+                if not in_flight:
+                    if exhausted:
+                        return
+                    continue
+                
+                future, reused = in_flight[0]
+                try:
+                    entry, waited, elapsed = future.result(timeout=_remaining(deadline))
+                except FutureTimeout:
+                    return
+                except UpstreamUnavailable:
+                    raise
+                except Exception as e:
+                    # Rate limited: stop now, what is done stays in the library for a retry
+                    if is_rate_limited(e):
+                        raise
+                    # Anything else loses this one post
+                    self.metrics.incr('upstream_errors_total', type=type(e).__name__)
+                    in_flight.popleft()
+                    counts['failed'] += 1
+                    continue
+                in_flight.popleft()
+                timings['pacer_wait'] += waited
+                timings['download'] += elapsed
+                if entry:
+                    yield entry, reused
+        finally:
+            stop.set()
+            for future, _ in in_flight:
+                future.cancel()
+            pool.shutdown(wait=True)
             
-        except instaloader.exceptions.ProfileNotExistsException:
-            return {'success': False, 'error': 'Profile not found'}
-        except instaloader.exceptions.InstaloaderException as e:
-            return {'success': False, 'error': 'Instagram error: ' + str(e)}
+            # Downloads that finished past a limit are not part of the result;
+            # in a library they are kept for the next sync
+            if self.profile_sync is None:
+                for future, _ in in_flight:
+                    if not future.cancelled() and future.exception() is None and future.result()[0]:
+                        (media_path / future.result()[0]['filename']).unlink(missing_ok=True)
+    
+    def _page_posts(self, profile, username, posts, stop, timings, stop_at_known=False):
+        """
+        Pages video posts of a profile into the posts queue, as records
+        with everything a download thread needs already resolved
+        With stop_at_known, paging ends at the first post a finished sync
+        already has, past the pinned posts and no newer than the newest one
+        it has; known pinned posts are passed on like any other
+        """
+        # Read before any post of this run is recorded
+        newest_known = self.profile_sync.newest(username) if stop_at_known else 0.0
+        try:
+            iterator = iter(profile.get_posts())
+            for index in itertools.count():
+                if stop.is_set():
+                    break
+                started = time.perf_counter()
+                post = next(iterator, None)
+                timings['metadata'] += time.perf_counter() - started
+                if post is None:
+                    break
+                # Old pinned posts come first, so a known post there says nothing about what follows
+                if stop_at_known and index >= MAX_PINNED_POSTS and post.date_utc.timestamp() <= newest_known \
+                        and self.profile_sync.get(username, post.shortcode):
+                    break
+                if post.is_video:
+                    started = time.perf_counter()
+                    item = _resolve_post(post)
+                    timings['metadata'] += time.perf_counter() - started
+                    self._put(posts, item, stop)
         except Exception as e:
-            return {'success': False, 'error': 'Download failed: ' + str(e)}
+            self._put(posts, e, stop)
+            return
+        self._put(posts, None, stop)
+    
+    def _put(self, posts, item, stop):
+        """Puts into a bounded queue unless the pipeline is stopping"""
+        while not stop.is_set():
+            try:
+                posts.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+    
+    def _fetch_profile_post(self, item, download_path, username=None, loader=None):
+        """
+        Downloads one profile video, resolved by the pager, on the download pool
+        Returns: (entry dict or None, pacer wait, download seconds)
+        """
+        video = download_path / (item['shortcode'] + '.mp4')
+        entry = {
+            'shortcode': item['shortcode'],
+            'filename': video.name,
+            'caption': item['caption'],
+            'posted_at': item['posted_at']
+        }
+        
+        # Already stored by a single download or another profile's sync
+        if self.blob_store is not None and self.blob_store.materialize(item['shortcode'], video):
+            self.metrics.incr('cache_hits_total', cache='blob')
+            self._record(username, entry)
+            return entry, 0.0, 0.0
+        
+        waited = self.pacer.acquire()
+        started = time.perf_counter()
+        
+        with self.metrics.span('profile_download_post'):
+            # get_raw opens its own anonymous session; nothing else of the shared context is touched
+            context = (loader or self.loader).context
+            with context.get_raw(item['video_url']) as response:
+                context.write_raw(response, str(video))
+        
+        if not video.exists():
+            return None, waited, time.perf_counter() - started
+        self.metrics.incr('downloaded_bytes_total', video.stat().st_size, kind='profile')
+        if self.blob_store is not None:
+            self.blob_store.ingest(video, item['shortcode'])
+        self._record(username, entry)
+        return entry, waited, time.perf_counter() - started
+    
+    def _in_use(self, *paths):
+        """Pins artifacts against eviction for a block; yields a function renewing the pins"""
+        if self.cleaner is None:
+            return nullcontext(lambda: None)
+        return self.cleaner.in_use(*paths)
+    
+    def _keep_library(self, library):
+        """Marks a profile library as in use and renews its expiry"""
+        if self.cleaner:
+            self.cleaner.touch(library, self.profile_sync.ttl_seconds)
+    
+    def _record(self, username, entry):
+        """Records a fetched post right away so an interrupted job can resume from here"""
+        if self.profile_sync is not None:
+            self.profile_sync.record(username, entry['shortcode'], entry['filename'], entry['caption'],
+                                     entry['posted_at'])
+    
+    def _reuse(self, entry):
+        """Returns an already finished future for a post the library has"""
+        self.metrics.incr('cache_hits_total', cache='profile_library')
+        future = Future()
+        future.set_result((entry, 0.0, 0.0))
+        return future
+    
+    @contextmanager
+    def _session(self):
+        """Checks a loader out of the session pool, or lends the shared one"""
+        if self.session_pool is None:
+            yield self.loader
+            return
+        with self.session_pool.session() as loader:
+            yield loader
+    
+    def _loader_for(self, directory, loader=None):
+        """Returns a view of a loader that writes only the video into directory"""
+        loader = copy.copy(loader or self.loader)
+        loader.dirname_pattern = str(directory)
+        loader.filename_pattern = '{target}'
+        # No thumbnails, caption .txt, JSON or geotag sidecars to clean up afterwards
+        loader.download_pictures = False
+        loader.download_video_thumbnails = False
+        loader.download_geotags = False
+        loader.download_comments = False
+        loader.save_metadata = False
+        loader.post_metadata_txt_pattern = ''
+        return loader
     
     def _extract_shortcode(self, url):
         import re
@@ -142,3 +548,85 @@ class InstagramDownloader:
             if match:
                 return match.group(1)
         return None
+
+def link_file(source, target):
+    """Hardlinks a library file into a result directory, copying only across filesystems"""
+    try:
+        os.link(source, target)
+    except FileExistsError:
+        pass
+    except OSError:
+        shutil.copy2(source, target)
+
+def _resolve_post(post) -> dict:
+    """Reads what downloading a profile post needs, querying the post's full metadata if the page lacks it"""
+    return {
+        'shortcode': post.shortcode,
+        'video_url': post.video_url,
+        'caption': post.caption if post.caption else '',
+        'posted_at': post.date_utc.timestamp()
+    }
+
+def _remaining(deadline):
+    """Seconds left until a monotonic deadline, None without one"""
+    return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+def _limit_reached(writer, max_posts, max_bytes, deadline):
+    """Returns which limit a profile download has reached, or None"""
+    if max_posts and writer.posts >= max_posts:
+        return 'posts'
+    if max_bytes and writer.bytes >= max_bytes:
+        return 'bytes'
+    if deadline is not None and time.monotonic() >= deadline:
+        return 'time'
+    return None
+
+class _ProfileWriter:
+    """
+    Links each finished post into a profile result and appends its caption
+    to captions.txt, plus one JSON line to manifest.jsonl if asked for
+    """
+    
+    def __init__(self, download_path: Path, media_path: Path, manifest: bool = False):
+        self.download_path = download_path
+        self.media_path = media_path
+        self.captions = open(download_path / 'captions.txt', 'w', encoding='utf-8')
+        self.manifest = open(download_path / 'manifest.jsonl', 'w', encoding='utf-8') if manifest else None
+        self.posts = 0
+        self.bytes = 0
+        self.reused = 0
+        # Pinned posts come first on the timeline, so the newest is tracked by date
+        self.newest = None
+        self.newest_at = 0.0
+    
+    def add(self, entry: dict, reused: bool = False):
+        target = self.download_path / entry['filename']
+        if self.media_path != self.download_path:
+            link_file(self.media_path / entry['filename'], target)
+        size = target.stat().st_size
+        
+        self.captions.write('File: ' + entry['filename'] + '\n')
+        self.captions.write('Caption: ' + entry['caption'] + '\n')
+        self.captions.write('-' * 80 + '\n\n')
+        self.captions.flush()
+        if self.manifest is not None:
+            self.manifest.write(json.dumps({
+                'file': entry['filename'],
+                'shortcode': entry['shortcode'],
+                'caption': entry['caption'],
+                'posted_at': int(entry['posted_at']),
+                'size': size
+            }, ensure_ascii=False) + '\n')
+            self.manifest.flush()
+        
+        self.posts += 1
+        self.bytes += size
+        self.reused += reused
+        if self.newest is None or entry['posted_at'] > self.newest_at:
+            self.newest = entry['shortcode']
+            self.newest_at = entry['posted_at']
+    
+    def close(self):
+        self.captions.close()
+        if self.manifest is not None:
+            self.manifest.close()
@@ -0,0 +1,189 @@
+import time
+from pathlib import Path
+from utils.sqlite_store import SQLiteStore
+
+# How long a pin holds without being renewed, in case its holder died
+PIN_LEASE_SECONDS = 900
+
+class ExpiryIndex(SQLiteStore):
+    """
+    Index of download artifacts with their expiry time, size and last use
+    Rows are claimed with DELETE ... RETURNING, so concurrent cleaners in
+    different workers never process the same artifact twice
+    A hardlinked file counts once, towards the first tracked artifact that
+    holds it: profile results and batches link media the library owns
+    Pinned artifacts are being written or read and are never claimed
+    """
+    
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS artifacts (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            expires_at REAL NOT NULL,
+            last_access REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS artifacts_expires_at ON artifacts (expires_at);
+        CREATE INDEX IF NOT EXISTS artifacts_last_access ON artifacts (last_access);
+        CREATE TABLE IF NOT EXISTS inodes (
+            dev INTEGER NOT NULL,
+            ino INTEGER NOT NULL,
+            path TEXT NOT NULL,
+            PRIMARY KEY (dev, ino)
+        );
+        CREATE INDEX IF NOT EXISTS inodes_path ON inodes (path);
+        CREATE TABLE IF NOT EXISTS pins (
+            path TEXT NOT NULL,
+            holder TEXT NOT NULL,
+            until REAL NOT NULL,
+            PRIMARY KEY (path, holder)
+        );
+    '''
+    
+    # Artifacts no live pin holds
+    UNPINNED = 'path NOT IN (SELECT path FROM pins WHERE until > :now)'
+    
+    def __init__(self, root_dir: str, db_path: str):
+        self.root_dir = Path(root_dir)
+        super().__init__(db_path)
+    
+    def register(self, path: str, ttl_seconds: int, size: int = None):
+        """
+        Records an artifact (file or directory) at creation time
+        Re-registering refreshes its size but keeps the original expiry
+        """
+        relative = self._relative(path)
+        # Walked before the transaction, so no write lock is held on the filesystem
+        files = self._scan(self.root_dir / relative) if size is None else []
+        
+        now = time.time()
+        with self._transaction() as conn:
+            if size is None:
+                size = self._charge(conn, relative, files)
+            conn.execute(
+                'INSERT INTO artifacts (path, size, created_at, expires_at, last_access) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT(path) DO UPDATE SET size = excluded.size, last_access = excluded.last_access',
+                (relative, size, now, now + ttl_seconds, now)
+            )
+    
+    def touch(self, path: str, ttl_seconds: int = None):
+        """Marks an artifact as recently used; with ttl_seconds, also keeps it at least that long"""
+        now = time.time()
+        self._connect().execute(
+            'UPDATE artifacts SET last_access = ?, expires_at = MAX(expires_at, ?) WHERE path = ?',
+            (now, now + ttl_seconds if ttl_seconds else 0, self._relative(path))
+        )
+    
+    def pin(self, path: str, holder: str, lease_seconds: int = PIN_LEASE_SECONDS):
+        """Keeps an artifact from expiry and eviction until unpinned or lease_seconds pass; pin again to renew"""
+        self._connect().execute(
+            'INSERT INTO pins (path, holder, until) VALUES (?, ?, ?) '
+            'ON CONFLICT(path, holder) DO UPDATE SET until = excluded.until',
+            (self._relative(path), holder, time.time() + lease_seconds)
+        )
+    
+    def unpin(self, holder: str):
+        """Drops every pin of a holder"""
+        self._connect().execute('DELETE FROM pins WHERE holder = ?', (holder,))
+    
+    def pop_expired(self, limit: int = 1000) -> list:
+        """
+        Claims expired artifacts that are not pinned, oldest first
+        Returns: list of paths relative to root_dir
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            # Leases of holders that died
+            conn.execute('DELETE FROM pins WHERE until <= ?', (now,))
+            rows = conn.execute(
+                'DELETE FROM artifacts WHERE path IN '
+                '(SELECT path FROM artifacts WHERE expires_at <= :now AND ' + self.UNPINNED + ' '
+                'ORDER BY expires_at LIMIT :limit) '
+                'RETURNING path',
+                {'now': now, 'limit': limit}
+            ).fetchall()
+            self._release(conn, [row['path'] for row in rows])
+        return [row['path'] for row in rows]
+    
+    def pop_over_quota(self, quota_bytes: int) -> list:
+        """
+        Claims least recently used artifacts until the total fits the quota
+        Pinned ones are skipped, so the total may stay over it until they are released
+        Returns: list of paths relative to root_dir
+        """
+        with self._transaction() as conn:
+            total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM artifacts').fetchone()[0]
+            if total <= quota_bytes:
+                return []
+            
+            victims = []
+            rows = conn.execute(
+                'SELECT path, size FROM artifacts WHERE ' + self.UNPINNED + ' ORDER BY last_access',
+                {'now': time.time()}
+            )
+            for row in rows:
+                if total <= quota_bytes:
+                    break
+                victims.append(row['path'])
+                total -= row['size']
+            
+            conn.executemany('DELETE FROM artifacts WHERE path = ?', [(path,) for path in victims])
+            self._release(conn, victims)
+        return victims
+    
+    def stats(self) -> dict:
+        """Returns tracked artifact count and bytes"""
+        row = self._connect().execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM artifacts').fetchone()
+        return {'artifacts': row[0], 'bytes': row[1]}
+    
+    def _relative(self, path) -> str:
+        """Normalizes a path to the form stored in the index"""
+        path = Path(path)
+        if path.is_absolute():
+            path = path.relative_to(self.root_dir)
+        return path.as_posix()
+    
+    def _scan(self, path: Path) -> list:
+        """Returns os.stat results of a file or of every file in a directory"""
+        try:
+            if not path.is_dir():
+                return [path.stat()]
+        except FileNotFoundError:
+            return []
+        
+        stats = []
+        for entry in path.rglob('*'):
+            try:
+                if entry.is_file():
+                    stats.append(entry.stat())
+            except FileNotFoundError:
+                pass
+        return stats
+    
+    def _charge(self, conn, relative: str, stats: list) -> int:
+        """
+        Sums the bytes an artifact accounts for: its own files, plus linked
+        files no other tracked artifact has claimed yet
+        Returns: size in bytes
+        """
+        size = 0
+        seen = set()
+        for stat in stats:
+            if stat.st_nlink == 1:
+                size += stat.st_size
+                continue
+            if (stat.st_dev, stat.st_ino) in seen:
+                continue
+            seen.add((stat.st_dev, stat.st_ino))
+            owner = conn.execute(
+                'INSERT INTO inodes (dev, ino, path) VALUES (?, ?, ?) '
+                'ON CONFLICT(dev, ino) DO UPDATE SET path = path RETURNING path',
+                (stat.st_dev, stat.st_ino, relative)
+            ).fetchone()['path']
+            if owner == relative:
+                size += stat.st_size
+        return size
+    
+    def _release(self, conn, paths: list):
+        """Forgets the linked files removed artifacts had claimed; the next artifact to register claims them"""
+        conn.executemany('DELETE FROM inodes WHERE path = ?', [(path,) for path in paths])
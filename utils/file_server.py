@@ -0,0 +1,139 @@
+import os
+import mimetypes
+from pathlib import Path
+from flask import Response, request
+
+class FileServer:
+    """
+    Serves finished downloads with conditional and byte-range support
+    Full and partial responses are handed to the WSGI server's file wrapper
+    (os.sendfile under gunicorn), or to a front proxy in offload mode
+    """
+    
+    OFFLOAD_HEADERS = {
+        'nginx': 'X-Accel-Redirect',
+        'apache': 'X-Sendfile',
+        'lighttpd': 'X-Sendfile'
+    }
+    
+    def __init__(self, root_dir: str, offload: str = '', internal_prefix: str = '/protected',
+                 chunk_size: int = 256 * 1024):
+        if offload and offload not in self.OFFLOAD_HEADERS:
+            raise ValueError('Unknown offload mode: ' + offload)
+        self.root_dir = Path(root_dir)
+        self.offload = offload
+        self.internal_prefix = internal_prefix.rstrip('/')
+        self.chunk_size = chunk_size
+    
+    def send(self, filepath, download_name: str = None, on_close=None) -> Response:
+        """
+        Builds the response for a file below root_dir; on_close is called once
+        the server has sent the body, or right away for responses without one
+        Returns: 200, 206, 304 or 416 response
+        """
+        filepath = Path(filepath)
+        stat = os.stat(filepath)
+        size = stat.st_size
+        etag = '%x-%x-%x' % (stat.st_ino, size, stat.st_mtime_ns)
+        mimetype = mimetypes.guess_type(filepath.name)[0] or 'application/octet-stream'
+        
+        response = Response(mimetype=mimetype, direct_passthrough=True)
+        response.set_etag(etag)
+        response.last_modified = stat.st_mtime
+        response.cache_control.no_cache = True
+        response.accept_ranges = 'bytes'
+        response.headers.set('Content-Disposition', 'attachment',
+                             filename=download_name or filepath.name)
+        
+        if request.if_none_match.contains(etag):
+            response.status_code = 304
+            return _closed(response, on_close)
+        
+        if self.offload:
+            # The proxy does ranges and the transfer; the worker is free right away
+            response.headers[self.OFFLOAD_HEADERS[self.offload]] = self._offload_target(filepath)
+            return _closed(response, on_close)
+        
+        start, end = 0, size
+        byte_range = request.range
+        # Multi-range requests get the whole file; If-Range with a stale
+        # validator means the client gets the whole new file
+        if (byte_range and byte_range.units == 'bytes' and len(byte_range.ranges) == 1
+                and self._range_fresh(etag)):
+            span = byte_range.range_for_length(size)
+            if span is None:
+                response.status_code = 416
+                response.headers['Content-Range'] = 'bytes */%d' % size
+                return _closed(response, on_close)
+            start, end = span
+            response.status_code = 206
+            response.headers['Content-Range'] = 'bytes %d-%d/%d' % (start, end - 1, size)
+        
+        f = open(filepath, 'rb')
+        if on_close is not None:
+            f = _NotifyingFile(f, on_close)
+        f.seek(start)
+        response.content_length = end - start
+        response.response = self._body(f, end - start)
+        return response
+    
+    def _range_fresh(self, etag: str) -> bool:
+        """Only a matching strong validator in If-Range allows a partial response"""
+        if_range = request.if_range
+        if if_range.etag is None and if_range.date is None:
+            return True
+        return if_range.etag == etag
+    
+    def _body(self, f, length: int):
+        """
+        Uses the server's file wrapper when it has one; such servers stop at
+        Content-Length and gunicorn sends from the current offset with sendfile
+        """
+        file_wrapper = request.environ.get('wsgi.file_wrapper')
+        if file_wrapper is not None:
+            return file_wrapper(f, self.chunk_size)
+        return _read_range(f, length, self.chunk_size)
+    
+    def _offload_target(self, filepath: Path) -> str:
+        """Internal URI for nginx, absolute path for X-Sendfile servers"""
+        if self.offload == 'nginx':
+            return self.internal_prefix + '/' + filepath.resolve().relative_to(self.root_dir.resolve()).as_posix()
+        return str(filepath.resolve())
+
+def _closed(response: Response, on_close) -> Response:
+    """Calls on_close for a response whose headers are all there is to send"""
+    if on_close is not None:
+        on_close()
+    return response
+
+class _NotifyingFile:
+    """
+    A file that calls on_close after closing. Direct-passthrough responses skip
+    Flask's close callbacks, and the server's file wrapper closes the file
+    when it is done; fileno stays available, so sendfile still applies
+    """
+    
+    def __init__(self, f, on_close):
+        self.f = f
+        self.on_close = on_close
+    
+    def __getattr__(self, name):
+        return getattr(self.f, name)
+    
+    def close(self):
+        if self.f.closed:
+            return
+        self.f.close()
+        self.on_close()
+
+def _read_range(f, length: int, chunk_size: int):
+    """Yields exactly length bytes from the current position, then closes f"""
+    try:
+        while length > 0:
+            data = f.read(min(chunk_size, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+    finally:
+        f.close()
@@ -0,0 +1,168 @@
+import os
+import json
+import time
+import uuid
+import queue
+import threading
+from utils.sqlite_store import SQLiteStore, pid_alive
+
+class JobTimeout(BaseException):
+    """
+    Raised inside a job when it runs past its deadline
+    Not an Exception so per-post error handling cannot swallow it
+    """
+
+class JobQueue(SQLiteStore):
+    """
+    Bounded pool of background download workers
+    Job state lives in SQLite so any gunicorn worker can report on any job
+    """
+    
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            state TEXT NOT NULL,
+            progress REAL NOT NULL DEFAULT 0,
+            message TEXT NOT NULL DEFAULT '',
+            result TEXT,
+            error TEXT,
+            pid INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL
+        );
+        CREATE INDEX IF NOT EXISTS jobs_finished_at ON jobs (finished_at);
+    '''
+    
+    def __init__(self, db_path: str, handlers: dict, workers: int = 2, max_queue: int = 50,
+                 job_timeout: int = 600, result_ttl: int = 3600):
+        super().__init__(db_path)
+        self.handlers = handlers
+        self.workers = workers
+        self.job_timeout = job_timeout
+        self.result_ttl = result_ttl
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.threads = []
+    
+    def start(self):
+        """Starts the worker threads"""
+        while len(self.threads) < self.workers:
+            thread = threading.Thread(target=self._worker_loop, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+    
+    def submit(self, kind: str, payload: dict) -> str:
+        """
+        Enqueues a job
+        Returns: job id, or None if the queue is full
+        """
+        if kind not in self.handlers:
+            raise ValueError('Unknown job type: ' + kind)
+        
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM jobs WHERE finished_at < ?', (now - self.result_ttl,))
+            conn.execute(
+                'INSERT INTO jobs (id, kind, state, message, pid, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (job_id, kind, 'queued', 'Waiting in queue', os.getpid(), now)
+            )
+        
+        try:
+            self.queue.put_nowait((job_id, kind, payload))
+        except queue.Full:
+            self._connect().execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+            return None
+        return job_id
+    
+    def get(self, job_id: str) -> dict:
+        """
+        Returns the public state of a job
+        Returns: dict with state, progress, message, result, error or None
+        """
+        row = self._connect().execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        
+        job = {
+            'job_id': row['id'],
+            'type': row['kind'],
+            'state': row['state'],
+            'progress': row['progress'],
+            'message': row['message'],
+            'queued_for': round((row['started_at'] or time.time()) - row['created_at'], 3)
+        }
+        
+        if row['state'] in ('queued', 'running'):
+            # Jobs never finish if their worker died or hung
+            if not pid_alive(row['pid']):
+                job.update(state='failed', error='Worker restarted, please try again')
+            elif row['started_at'] and time.time() - row['started_at'] > self.job_timeout:
+                job.update(state='failed', error='Job timed out')
+        elif row['state'] == 'done':
+            job['result'] = json.loads(row['result'])
+        else:
+            job['error'] = row['error']
+        return job
+    
+    def queue_depth(self) -> int:
+        """Returns the number of jobs waiting in this process"""
+        return self.queue.qsize()
+    
+    def estimated_wait(self, recent: int = 50) -> float:
+        """
+        Estimates how long a new job waits before it starts, over all workers:
+        the jobs queued ahead of it times the mean run time of recent jobs,
+        spread over the jobs running now
+        Returns: seconds
+        """
+        conn = self._connect()
+        # Jobs of dead workers stay queued or running forever; only recent ones count
+        row = conn.execute(
+            "SELECT COALESCE(SUM(state = 'queued'), 0) AS queued, COALESCE(SUM(state = 'running'), 0) AS running "
+            "FROM jobs WHERE state IN ('queued', 'running') AND created_at > ?",
+            (time.time() - self.job_timeout,)
+        ).fetchone()
+        if not row['queued']:
+            return 0.0
+        mean = conn.execute(
+            'SELECT AVG(finished_at - started_at) FROM (SELECT finished_at, started_at FROM jobs '
+            'WHERE finished_at IS NOT NULL AND started_at IS NOT NULL ORDER BY finished_at DESC LIMIT ?)',
+            (recent,)
+        ).fetchone()[0]
+        return row['queued'] * (mean or 0.0) / max(row['running'], self.workers)
+    
+    def _worker_loop(self):
+        """Runs queued jobs until the process exits"""
+        while True:
+            job_id, kind, payload = self.queue.get()
+            started = time.time()
+            deadline = started + self.job_timeout
+            self._update(job_id, state='running', started_at=started, message='Starting download')
+            
+            def progress(fraction: float, message: str = ''):
+                if time.time() > deadline:
+                    raise JobTimeout()
+                self._update(job_id, progress=round(min(fraction, 1.0), 3), message=message)
+            
+            try:
+                result = self.handlers[kind](payload, progress)
+                if result.get('success'):
+                    self._update(job_id, state='done', progress=1.0, message=result.get('message', 'Done'),
+                                 result=json.dumps(result), finished_at=time.time())
+                else:
+                    self._update(job_id, state='failed', error=result.get('error', 'Download failed'),
+                                 finished_at=time.time())
+            except JobTimeout:
+                self._update(job_id, state='failed', error='Job timed out', finished_at=time.time())
+            except Exception as e:
+                self._update(job_id, state='failed', error='Error: ' + str(e), finished_at=time.time())
+            finally:
+                self.queue.task_done()
+    
+    def _update(self, job_id: str, **fields):
+        """Writes job fields"""
+        columns = ', '.join(name + ' = ?' for name in fields)
+        self._connect().execute('UPDATE jobs SET ' + columns + ' WHERE id = ?',
+                                list(fields.values()) + [job_id])
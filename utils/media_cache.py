@@ -0,0 +1,194 @@
+import os
+import re
+import time
+from pathlib import Path
+from utils.sqlite_store import SQLiteStore
+from utils.storage import commit, shard_path
+
+class MediaCache(SQLiteStore):
+    """
+    Shortcode-keyed cache of downloaded videos with LRU/TTL eviction
+    Files live in hash shards of media_dir, so no lookup lists a directory
+    """
+    
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS media (
+            shortcode TEXT PRIMARY KEY,
+            filename TEXT NOT NULL UNIQUE,
+            owner TEXT NOT NULL,
+            caption TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            last_access REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS media_last_access ON media (last_access);
+    '''
+    
+    # What older versions left directly in media_dir: owner_shortcode.mp4 and .shortcode_xxxxxxxx.part
+    FLAT_VIDEO = re.compile(r'[A-Za-z0-9_][A-Za-z0-9._]*_[A-Za-z0-9_-]+\.mp4')
+    FLAT_PARTIAL = re.compile(r'\.[A-Za-z0-9_-]+_[0-9a-f]{8}\.part')
+    # Left in media_dir once the flat layout was migrated
+    MIGRATED_MARKER = '.sharded'
+    
+    def __init__(self, media_dir: str, db_path: str, max_bytes: int = 2 * 1024 ** 3,
+                 ttl_seconds: int = 24 * 3600, blob_store=None):
+        self.media_dir = Path(media_dir)
+        self.blob_store = blob_store
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        super().__init__(db_path)
+        self._migrate_flat_layout()
+    
+    def path_for(self, filename: str) -> Path:
+        """Returns where a cached file lives"""
+        return shard_path(self.media_dir, filename)
+    
+    def get(self, shortcode: str, count_miss: bool = True) -> dict:
+        """
+        Looks up a cached video and marks it as recently used
+        A caller whose miss is looked up again, and counted, downstream passes count_miss=False
+        Returns: dict with filename, owner, caption, size or None on a miss
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(
+                'SELECT filename, owner, caption, size, created_at FROM media WHERE shortcode = ?',
+                (shortcode,)
+            ).fetchone()
+            
+            if row and now - row['created_at'] <= self.ttl_seconds \
+                    and self.path_for(row['filename']).is_file():
+                conn.execute('UPDATE media SET last_access = ? WHERE shortcode = ?', (now, shortcode))
+                self._incr('hits', conn=conn)
+                return {
+                    'filename': row['filename'],
+                    'owner': row['owner'],
+                    'caption': row['caption'],
+                    'size': row['size']
+                }
+            
+            if count_miss:
+                self._incr('misses', conn=conn)
+        
+        if row:
+            # Expired or deleted behind our back
+            self._drop([shortcode])
+        return None
+    
+    def put(self, shortcode: str, source_path: str, owner: str, caption: str) -> dict:
+        """
+        Moves a freshly downloaded video from its staging directory into the cache
+        Returns: dict with filename, owner, caption, size
+        """
+        filename = owner + '_' + shortcode + '.mp4'
+        if self.blob_store is not None:
+            # The cached file becomes one more link to the stored blob
+            self.blob_store.ingest(source_path, shortcode)
+        target = commit(source_path, self.path_for(filename))
+        # Instaloader stamps files with the post date; age counts from download time
+        os.utime(target)
+        
+        now = time.time()
+        size = target.stat().st_size
+        with self._transaction() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO media '
+                '(shortcode, filename, owner, caption, size, created_at, last_access) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (shortcode, filename, owner, caption, size, now, now)
+            )
+        
+        self.evict()
+        return {'filename': filename, 'owner': owner, 'caption': caption, 'size': size}
+    
+    def owns(self, filename: str) -> bool:
+        """Checks whether a file in media_dir belongs to the cache"""
+        row = self._connect().execute('SELECT 1 FROM media WHERE filename = ?', (filename,)).fetchone()
+        return row is not None
+    
+    def filenames(self) -> set:
+        """Returns the names of all cached files"""
+        rows = self._connect().execute('SELECT filename FROM media').fetchall()
+        return {row['filename'] for row in rows}
+    
+    def evict(self) -> int:
+        """
+        Removes expired entries, then least recently used ones until the
+        cache fits into max_bytes
+        Returns: number of evicted entries
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            victims = conn.execute(
+                'SELECT shortcode, filename FROM media WHERE created_at < ?',
+                (now - self.ttl_seconds,)
+            ).fetchall()
+            
+            total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM media WHERE created_at >= ?',
+                                 (now - self.ttl_seconds,)).fetchone()[0]
+            if total > self.max_bytes:
+                for row in conn.execute(
+                    'SELECT shortcode, filename, size FROM media WHERE created_at >= ? '
+                    'ORDER BY last_access',
+                    (now - self.ttl_seconds,)
+                ):
+                    if total <= self.max_bytes:
+                        break
+                    victims.append(row)
+                    total -= row['size']
+            
+            conn.executemany('DELETE FROM media WHERE shortcode = ?',
+                             [(row['shortcode'],) for row in victims])
+            if victims:
+                self._incr('evictions', len(victims), conn=conn)
+        
+        # Unlink after commit so other workers never see a row without its file
+        for row in victims:
+            self.path_for(row['filename']).unlink(missing_ok=True)
+        return len(victims)
+    
+    def stats(self) -> dict:
+        """Returns cache size and hit/miss counters"""
+        row = self._connect().execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM media').fetchone()
+        counters = self.counters()
+        return {
+            'entries': row[0],
+            'bytes': row[1],
+            'max_bytes': self.max_bytes,
+            'hits': counters.get('hits', 0),
+            'misses': counters.get('misses', 0),
+            'evictions': counters.get('evictions', 0)
+        }
+    
+    def _drop(self, shortcodes: list):
+        """Forgets entries and removes their files"""
+        with self._transaction() as conn:
+            rows = conn.execute(
+                'SELECT filename FROM media WHERE shortcode IN (%s)' % ','.join('?' * len(shortcodes)),
+                shortcodes
+            ).fetchall()
+            conn.executemany('DELETE FROM media WHERE shortcode = ?', [(s,) for s in shortcodes])
+        for row in rows:
+            self.path_for(row['filename']).unlink(missing_ok=True)
+    
+    def _migrate_flat_layout(self):
+        """
+        Moves videos stored directly in media_dir by older versions into their
+        shards and drops their stray partial files; runs once per media_dir
+        Anything else in media_dir is left alone
+        """
+        marker = self.media_dir / self.MIGRATED_MARKER
+        if not self.media_dir.is_dir() or marker.exists():
+            return
+        for entry in os.scandir(self.media_dir):
+            if not entry.is_file():
+                continue
+            try:
+                if self.FLAT_VIDEO.fullmatch(entry.name):
+                    commit(entry.path, self.path_for(entry.name))
+                elif self.FLAT_PARTIAL.fullmatch(entry.name):
+                    os.unlink(entry.path)
+            except FileNotFoundError:
+                # Another worker migrated it first
+                pass
+        marker.touch()
@@ -0,0 +1,141 @@
+import time
+from utils.sqlite_store import SQLiteStore
+
+class MetadataCache(SQLiteStore):
+    """
+    Post metadata shared by all workers, including negative results
+    Lets /download answer or reject a shortcode without going upstream
+    """
+    
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS posts (
+            shortcode TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            is_video INTEGER NOT NULL DEFAULT 0,
+            owner TEXT NOT NULL DEFAULT '',
+            caption TEXT NOT NULL DEFAULT '',
+            video_url TEXT NOT NULL DEFAULT '',
+            expires_at REAL NOT NULL,
+            last_access REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS posts_last_access ON posts (last_access);
+        CREATE INDEX IF NOT EXISTS posts_expires_at ON posts (expires_at);
+    '''
+    
+    def __init__(self, db_path: str, max_entries: int = 100000, ttl_seconds: int = 3600,
+                 not_found_ttl: int = 600, not_video_ttl: int = 24 * 3600):
+        self.max_entries = max_entries
+        self.ttls = {
+            'ok': ttl_seconds,
+            'not_found': not_found_ttl,
+            'not_video': not_video_ttl
+        }
+        super().__init__(db_path)
+    
+    def get(self, shortcode: str, count_miss: bool = True) -> dict:
+        """
+        Returns cached metadata or None
+        status is 'ok', 'not_found' or 'not_video'
+        A caller whose miss is looked up again, and counted, downstream passes count_miss=False
+        """
+        now = time.time()
+        conn = self._connect()
+        row = conn.execute(
+            'SELECT status, is_video, owner, caption, video_url FROM posts '
+            'WHERE shortcode = ? AND expires_at > ?',
+            (shortcode, now)
+        ).fetchone()
+        
+        if row is None:
+            if count_miss:
+                self._incr('misses')
+            return None
+        
+        conn.execute('UPDATE posts SET last_access = ? WHERE shortcode = ?', (now, shortcode))
+        self._incr('hits' if row['status'] == 'ok' else 'negative_hits')
+        return {
+            'shortcode': shortcode,
+            'status': row['status'],
+            'is_video': bool(row['is_video']),
+            'owner': row['owner'],
+            'caption': row['caption'],
+            'video_url': row['video_url']
+        }
+    
+    def record_post(self, post):
+        """Stores what we learned from an instaloader Post"""
+        caption = ''
+        video_url = ''
+        try:
+            caption = post.caption if post.caption else ''
+            if post.is_video:
+                video_url = post.video_url or ''
+        except Exception:
+            pass
+        
+        self.import_entries([{
+            'shortcode': post.shortcode,
+            'status': 'ok' if post.is_video else 'not_video',
+            'is_video': post.is_video,
+            'owner': post.owner_username,
+            'caption': caption,
+            'video_url': video_url
+        }])
+    
+    def record_missing(self, shortcode: str):
+        """Remembers that a shortcode does not resolve"""
+        self.import_entries([{'shortcode': shortcode, 'status': 'not_found'}])
+    
+    def import_entries(self, entries) -> int:
+        """
+        Bulk insert or refresh of metadata, e.g. to warm the cache
+        Each entry needs shortcode and status; other fields are optional
+        Returns: number of stored entries
+        """
+        now = time.time()
+        rows = [
+            (
+                entry['shortcode'],
+                entry['status'],
+                int(bool(entry.get('is_video', entry['status'] == 'ok'))),
+                entry.get('owner') or '',
+                entry.get('caption') or '',
+                entry.get('video_url') or '',
+                now + self.ttls[entry['status']],
+                now
+            )
+            for entry in entries
+        ]
+        
+        with self._transaction() as conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO posts '
+                '(shortcode, status, is_video, owner, caption, video_url, expires_at, last_access) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                rows
+            )
+            self._trim(conn, now)
+        return len(rows)
+    
+    def stats(self) -> dict:
+        """Returns entry counts per status and hit/miss counters"""
+        rows = self._connect().execute('SELECT status, COUNT(*) FROM posts GROUP BY status').fetchall()
+        counters = self.counters()
+        return {
+            'entries': {row[0]: row[1] for row in rows},
+            'max_entries': self.max_entries,
+            'hits': counters.get('hits', 0),
+            'negative_hits': counters.get('negative_hits', 0),
+            'misses': counters.get('misses', 0)
+        }
+    
+    def _trim(self, conn, now: float):
+        """Drops expired entries, then least recently used ones over max_entries"""
+        conn.execute('DELETE FROM posts WHERE expires_at <= ?', (now,))
+        excess = conn.execute('SELECT COUNT(*) FROM posts').fetchone()[0] - self.max_entries
+        if excess > 0:
+            conn.execute(
+                'DELETE FROM posts WHERE shortcode IN '
+                '(SELECT shortcode FROM posts ORDER BY last_access LIMIT ?)',
+                (excess,)
+            )
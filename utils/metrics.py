@@ -0,0 +1,168 @@
+import os
+import time
+import threading
+from contextlib import contextmanager, nullcontext
+from bisect import bisect_left
+from utils.sqlite_store import SQLiteStore
+
+# Upper bounds in seconds; covers cache hits up to slow profile syncs
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+class Metrics(SQLiteStore):
+    """
+    Counters and latency histograms aggregated across gunicorn workers
+    Each process records in memory and adds its deltas to SQLite at most
+    every flush_seconds, so recording never waits on the database
+    """
+    
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS metrics (
+            name TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            labels TEXT NOT NULL,
+            le TEXT NOT NULL DEFAULT '',
+            value REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (name, labels, le)
+        );
+    '''
+    
+    def __init__(self, db_path: str, prefix: str = 'insta', buckets: tuple = DEFAULT_BUCKETS,
+                 flush_seconds: float = 10.0):
+        super().__init__(db_path)
+        self.prefix = prefix
+        self.buckets = tuple(buckets)
+        self.flush_seconds = flush_seconds
+        self.lock = threading.Lock()
+        self._reset()
+    
+    def incr(self, name: str, amount: float = 1, **labels):
+        """Adds to a counter"""
+        key = (self.prefix + '_' + name, _format_labels(labels))
+        with self.lock:
+            self._check_fork()
+            self.counters_pending[key] = self.counters_pending.get(key, 0) + amount
+        self._maybe_flush()
+    
+    def observe(self, name: str, seconds: float, **labels):
+        """Records one duration in a histogram"""
+        key = (self.prefix + '_' + name, _format_labels(labels))
+        with self.lock:
+            self._check_fork()
+            histogram = self.histograms_pending.get(key)
+            if histogram is None:
+                histogram = self.histograms_pending[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            histogram[0][bisect_left(self.buckets, seconds)] += 1
+            histogram[1] += seconds
+        self._maybe_flush()
+    
+    @contextmanager
+    def span(self, stage: str, **labels):
+        """Times a block into stage_seconds{stage=...}, whether or not it raises"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('stage_seconds', time.perf_counter() - started, stage=stage, **labels)
+    
+    def flush(self):
+        """Adds this process's pending deltas to the shared totals"""
+        with self.lock:
+            self._check_fork()
+            counters, histograms = self.counters_pending, self.histograms_pending
+            self.counters_pending, self.histograms_pending = {}, {}
+            self.flushed_at = time.monotonic()
+        if not counters and not histograms:
+            return
+        
+        rows = [(name, 'counter', labels, '', value) for (name, labels), value in counters.items()]
+        for (name, labels), (counts, total) in histograms.items():
+            bounds = [repr(bound) for bound in self.buckets] + ['+Inf']
+            rows.extend((name, 'histogram', labels, bound, count) for bound, count in zip(bounds, counts) if count)
+            rows.append((name, 'histogram', labels, 'sum', total))
+            rows.append((name, 'histogram', labels, 'count', sum(counts)))
+        
+        with self._transaction() as conn:
+            conn.executemany(
+                'INSERT INTO metrics (name, kind, labels, le, value) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT(name, labels, le) DO UPDATE SET value = value + excluded.value',
+                rows
+            )
+    
+    def render(self) -> str:
+        """Returns all workers' metrics in the Prometheus text format"""
+        self.flush()
+        rows = self._connect().execute(
+            'SELECT name, kind, labels, le, value FROM metrics ORDER BY name, labels'
+        ).fetchall()
+        
+        lines = []
+        histograms = {}
+        current = None
+        for row in rows:
+            if row['kind'] == 'counter':
+                if row['name'] != current:
+                    current = row['name']
+                    lines.append('# TYPE ' + current + ' counter')
+                lines.append(row['name'] + _braces(row['labels']) + ' ' + _number(row['value']))
+            else:
+                histograms.setdefault(row['name'], {}).setdefault(row['labels'], {})[row['le']] = row['value']
+        
+        for name, series in histograms.items():
+            lines.append('# TYPE ' + name + ' histogram')
+            for labels, values in series.items():
+                cumulative = 0
+                for bound in [repr(bound) for bound in self.buckets] + ['+Inf']:
+                    cumulative += values.get(bound, 0)
+                    le = 'le="' + bound + '"'
+                    lines.append(name + '_bucket{' + (labels + ',' if labels else '') + le + '} '
+                                 + _number(cumulative))
+                lines.append(name + '_sum' + _braces(labels) + ' ' + _number(values.get('sum', 0)))
+                lines.append(name + '_count' + _braces(labels) + ' ' + _number(values.get('count', 0)))
+        return '\n'.join(lines) + '\n'
+    
+    def _maybe_flush(self):
+        if time.monotonic() - self.flushed_at >= self.flush_seconds:
+            self.flush()
+    
+    def _check_fork(self):
+        """Deltas recorded before a fork belong to the parent"""
+        if self.pid != os.getpid():
+            self._reset()
+    
+    def _reset(self):
+        self.pid = os.getpid()
+        self.counters_pending = {}
+        self.histograms_pending = {}
+        self.flushed_at = time.monotonic()
+
+class NullMetrics:
+    """Stand-in used when metrics are disabled; every call is a no-op"""
+    
+    _span = nullcontext()
+    
+    def incr(self, name: str, amount: float = 1, **labels):
+        pass
+    
+    def observe(self, name: str, seconds: float, **labels):
+        pass
+    
+    def span(self, stage: str, **labels):
+        return self._span
+    
+    def flush(self):
+        pass
+
+NULL_METRICS = NullMetrics()
+
+def _format_labels(labels: dict) -> str:
+    """Renders labels once at record time, sorted so equal sets share a series"""
+    return ','.join(
+        key + '="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        for key, value in sorted(labels.items())
+    )
+
+def _braces(labels: str) -> str:
+    return '{' + labels + '}' if labels else ''
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
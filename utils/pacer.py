@@ -0,0 +1,59 @@
+import time
+import threading
+
+class TokenBucket:
+    """Token-bucket pacer shared by every upstream call in a process"""
+    
+    def __init__(self, rate: float = 0.5, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        self.acquired = 0
+        self.waited = 0.0
+    
+    def acquire(self) -> float:
+        """
+        Blocks until a token is available
+        Returns: seconds spent waiting
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            
+            # Reserve the token now and sleep off the debt outside the lock
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            self.acquired += 1
+            self.waited += wait
+        
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+    
+    def rate_controller(self):
+        """Returns an Instaloader rate_controller factory that draws from this bucket"""
+        import instaloader
+        bucket = self
+        
+        class PacedRateController(instaloader.RateController):
+            def wait_before_query(self, query_type):
+                bucket.acquire()
+            
+            def handle_429(self, query_type):
+                # Fail now instead of sleeping for minutes in this worker;
+                # the shared circuit breaker backs off for all of them
+                raise instaloader.exceptions.TooManyRequestsException('429 Too Many Requests: ' + query_type)
+        
+        return PacedRateController
+    
+    def stats(self) -> dict:
+        """Returns pacing counters"""
+        return {
+            'rate': self.rate,
+            'burst': self.burst,
+            'acquired': self.acquired,
+            'waited_seconds': round(self.waited, 3)
+        }
@@ -0,0 +1,81 @@
+import time
+from pathlib import Path
+from utils.sqlite_store import SQLiteStore
+
+class ProfileArchives(SQLiteStore):
+    """
+    Finished profile ZIPs keyed by username, the limits they were built with
+    and the shortcode of the newest video they contain
+    A profile whose newest video is unchanged is served without downloading;
+    the files themselves expire through the cleaner's index and disk quota
+    """
+    
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS archives (
+            username TEXT NOT NULL,
+            variant TEXT NOT NULL,
+            newest TEXT NOT NULL,
+            filename TEXT NOT NULL,
+            post_count INTEGER NOT NULL,
+            bytes INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            PRIMARY KEY (username, variant)
+        );
+    '''
+    
+    def __init__(self, zips_dir: str, db_path: str):
+        self.zips_dir = Path(zips_dir)
+        super().__init__(db_path)
+    
+    def is_current(self, archive: dict, newest: str, limits: dict) -> bool:
+        """Checks whether an archive still ends at the profile's newest video and fits max_bytes"""
+        max_bytes = limits.get('max_bytes')
+        if newest is None or archive['newest'] != newest or (max_bytes and archive['bytes'] > max_bytes):
+            self._incr('stale')
+            return False
+        self._incr('hits')
+        return True
+    
+    def previous(self, username: str, limits: dict) -> dict:
+        """
+        Finds the last archive built for these limits, current or not
+        Returns: dict with newest, filename, filepath, post_count, bytes; None if cleaned up
+        """
+        variant = self._variant(limits)
+        row = self._connect().execute('SELECT newest, filename, post_count, bytes FROM archives '
+                                      'WHERE username = ? AND variant = ?', (username, variant)).fetchone()
+        if row is None:
+            return None
+        
+        filepath = self.zips_dir / row['filename']
+        if not filepath.is_file():
+            self._connect().execute('DELETE FROM archives WHERE username = ? AND variant = ? AND filename = ?',
+                                    (username, variant, row['filename']))
+            return None
+        return dict(row, filepath=str(filepath))
+    
+    def put(self, username: str, limits: dict, newest: str, filename: str, post_count: int, appended: bool = False):
+        """Records the archive now current for a profile and these limits"""
+        size = (self.zips_dir / filename).stat().st_size
+        with self._transaction() as conn:
+            conn.execute('INSERT OR REPLACE INTO archives (username, variant, newest, filename, post_count, bytes, '
+                         'created_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                         (username, self._variant(limits), newest, filename, post_count, size, time.time()))
+            self._incr('appended' if appended else 'rebuilt', conn=conn)
+    
+    def stats(self) -> dict:
+        """Returns archive count, their bytes and hit counters"""
+        row = self._connect().execute('SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM archives').fetchone()
+        counters = self.counters()
+        return {
+            'archives': row[0],
+            'bytes': row[1],
+            'hits': counters.get('hits', 0),
+            'stale': counters.get('stale', 0),
+            'appended': counters.get('appended', 0),
+            'rebuilt': counters.get('rebuilt', 0)
+        }
+    
+    def _variant(self, limits: dict) -> str:
+        """Archives built with a different post limit or without a manifest hold different files"""
+        return str(limits.get('max_posts') or 0) + ('+manifest' if limits.get('manifest') else '')
@@ -0,0 +1,110 @@
+import time
+from pathlib import Path
+from utils.sqlite_store import SQLiteStore
+
+class ProfileSync(SQLiteStore):
+    """
+    Per-profile manifest of fetched posts and where their media lives
+    Repeat requests only fetch new posts; interrupted runs resume
+    """
+    
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS profiles (
+            username TEXT PRIMARY KEY,
+            complete INTEGER NOT NULL DEFAULT 0,
+            synced_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS profile_posts (
+            username TEXT NOT NULL,
+            shortcode TEXT NOT NULL,
+            filename TEXT NOT NULL,
+            caption TEXT NOT NULL,
+            posted_at REAL NOT NULL,
+            fetched_at REAL NOT NULL,
+            PRIMARY KEY (username, shortcode)
+        );
+        CREATE INDEX IF NOT EXISTS profile_posts_posted_at ON profile_posts (username, posted_at);
+    '''
+    
+    def __init__(self, library_dir: str, db_path: str, ttl_seconds: int = 24 * 3600):
+        self.library_dir = Path(library_dir)
+        self.ttl_seconds = ttl_seconds
+        super().__init__(db_path)
+    
+    def library_for(self, username: str) -> Path:
+        """Returns the directory holding a profile's fetched media"""
+        return self.library_dir / username
+    
+    def begin(self, username: str) -> dict:
+        """
+        Marks a sync as running and forgets entries whose file was cleaned up
+        Returns: dict with complete (previous run covered the whole profile)
+        """
+        library = self.library_for(username)
+        library.mkdir(parents=True, exist_ok=True)
+        
+        with self._transaction() as conn:
+            # Streamed, so a large library is never held in memory
+            rows = conn.execute('SELECT shortcode, filename FROM profile_posts WHERE username = ?', (username,))
+            missing = [(username, row['shortcode']) for row in rows if not (library / row['filename']).exists()]
+            conn.executemany('DELETE FROM profile_posts WHERE username = ? AND shortcode = ?', missing)
+            
+            state = conn.execute('SELECT complete FROM profiles WHERE username = ?', (username,)).fetchone()
+            conn.execute('INSERT OR REPLACE INTO profiles (username, complete, synced_at) VALUES (?, 0, ?)',
+                         (username, time.time()))
+        
+        # A run that lost files cannot vouch for the posts below its newest one
+        return {'complete': bool(state and state['complete']) and not missing}
+    
+    def get(self, username: str, shortcode: str) -> dict:
+        """
+        Looks up one fetched post of a profile
+        Returns: dict with shortcode, filename, caption, posted_at or None
+        """
+        row = self._connect().execute(
+            'SELECT shortcode, filename, caption, posted_at FROM profile_posts WHERE username = ? AND shortcode = ?',
+            (username, shortcode)
+        ).fetchone()
+        if row is None or not (self.library_for(username) / row['filename']).exists():
+            return None
+        return dict(row)
+    
+    def record(self, username: str, shortcode: str, filename: str, caption: str, posted_at: float):
+        """Records a fetched post as soon as its file is in place"""
+        self._connect().execute(
+            'INSERT OR REPLACE INTO profile_posts '
+            '(username, shortcode, filename, caption, posted_at, fetched_at) VALUES (?, ?, ?, ?, ?, ?)',
+            (username, shortcode, filename, caption, posted_at, time.time())
+        )
+    
+    def finish(self, username: str):
+        """
+        Marks the library as covering the whole profile, so the next sync can
+        stop at the first known post
+        """
+        self._connect().execute('UPDATE profiles SET complete = 1, synced_at = ? WHERE username = ?',
+                                (time.time(), username))
+    
+    def newest(self, username: str) -> float:
+        """Returns the post date of the newest fetched post of a profile, 0 without any"""
+        row = self._connect().execute('SELECT MAX(posted_at) FROM profile_posts WHERE username = ?',
+                                      (username,)).fetchone()
+        return row[0] or 0.0
+    
+    def posts(self, username: str, limit: int = -1):
+        """Yields the newest known entries of a profile, all of them by default"""
+        rows = self._connect().execute(
+            'SELECT shortcode, filename, caption, posted_at FROM profile_posts '
+            'WHERE username = ? ORDER BY posted_at DESC LIMIT ?',
+            (username, limit)
+        )
+        for row in rows:
+            yield dict(row)
+    
+    def stats(self) -> dict:
+        """Returns profile and post counts"""
+        conn = self._connect()
+        return {
+            'profiles': conn.execute('SELECT COUNT(*) FROM profiles').fetchone()[0],
+            'posts': conn.execute('SELECT COUNT(*) FROM profile_posts').fetchone()[0]
+        }
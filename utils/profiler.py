@@ -0,0 +1,280 @@
+import os
+import sys
+import hmac
+import json
+import time
+import random
+import threading
+import contextvars
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from utils.sqlite_store import SQLiteStore
+
+# Spans whose allocations are captured: post downloads, their rename/cleanup and ZIP creation
+PROFILED_STAGES = frozenset(('download_post', 'profile_download_post', 'finalize', 'zip_create', 'zip_append',
+                             'zip_stream'))
+
+class RequestProfiler(SQLiteStore):
+    """
+    Opt-in profiler for a sample of download requests, or any request
+    carrying the profiling token. A profiled request gets wall-clock stacks
+    of its thread, written in collapsed format for flamegraph.pl or
+    speedscope, and tracemalloc peaks of PROFILED_STAGES, including those
+    run by download threads it starts. Dumps go to a ring
+    of ring_size slots shared by all workers, overwriting the oldest
+    Only created when enabled; otherwise nothing here is ever called
+    """
+    
+    def __init__(self, dump_dir: str, db_path: str, sample_rate: float = 0.0, token: str = '',
+                 ring_size: int = 50, interval: float = 0.005, top_allocations: int = 10):
+        self.dump_dir = Path(dump_dir)
+        self.dump_dir.mkdir(parents=True, exist_ok=True)
+        self.sample_rate = sample_rate
+        self.token = token
+        self.ring_size = ring_size
+        self.interval = interval
+        self.top_allocations = top_allocations
+        # Greenlet-local under gevent, so each request only sees its own session;
+        # pools that submit through contextvars.copy_context() see it too
+        self.active = contextvars.ContextVar('profile_session', default=None)
+        self.lock = threading.Lock()
+        self.sessions = 0
+        self.owns_tracing = False
+        super().__init__(db_path)
+    
+    def wanted(self, token: str = None) -> bool:
+        """Decides whether a request is profiled: a valid token always, otherwise by sample_rate"""
+        if token and self.token and hmac.compare_digest(token, self.token):
+            self._incr('triggered')
+            return True
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            self._incr('sampled')
+            return True
+        return False
+    
+    def start(self, label: str) -> 'ProfileSession':
+        """Starts profiling the calling thread"""
+        with self.lock:
+            # Other code may trace memory too; only tracing started here is stopped again
+            if self.sessions == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.owns_tracing = True
+            self.sessions += 1
+        session = ProfileSession(label, self.interval, self.top_allocations)
+        self.active.set(session)
+        return session
+    
+    def current(self) -> 'ProfileSession':
+        """Returns the session of the calling thread or the thread that submitted its work, or None"""
+        return self.active.get()
+    
+    def reserve(self, session: 'ProfileSession') -> str:
+        """
+        Picks the ring slot of a session that is dumped after its id is needed,
+        such as a request profiled until its body is sent
+        Returns: dump id
+        """
+        if session.dump_id is None:
+            with self._transaction() as conn:
+                self._incr('dumps', conn=conn)
+                dumps = conn.execute("SELECT value FROM counters WHERE name = 'dumps'").fetchone()[0]
+            session.dump_id = '%03d' % ((dumps - 1) % self.ring_size)
+        return session.dump_id
+    
+    def finish(self, session: 'ProfileSession', **info) -> str:
+        """
+        Stops a session and writes its dump into its reserved or the next ring slot
+        Returns: dump id
+        """
+        self._stop(session)
+        dump_id = self.reserve(session)
+        
+        report = dict(session.report(), id=dump_id, pid=os.getpid(), **info)
+        _write_atomic(self.dump_dir / ('profile-' + dump_id + '.folded'), session.collapsed())
+        _write_atomic(self.dump_dir / ('profile-' + dump_id + '.json'), json.dumps(report, indent=2))
+        return dump_id
+    
+    def discard(self, session: 'ProfileSession'):
+        """Stops a session without writing a dump"""
+        self._stop(session)
+    
+    @contextmanager
+    def session(self, label: str):
+        """Profiles a block in the calling thread and dumps it, whether or not it raises"""
+        session = self.start(label)
+        try:
+            yield session
+        finally:
+            session.dump_id = self.finish(session)
+    
+    def instrument(self, metrics):
+        """Returns metrics whose spans also capture PROFILED_STAGES of profiled requests"""
+        return ProfiledMetrics(metrics, self)
+    
+    def stats(self) -> dict:
+        """Returns settings and counters"""
+        counters = self.counters()
+        return {
+            'sample_rate': self.sample_rate,
+            'token': bool(self.token),
+            'ring_size': self.ring_size,
+            'sampled': counters.get('sampled', 0),
+            'triggered': counters.get('triggered', 0),
+            'dumps': counters.get('dumps', 0)
+        }
+    
+    def _stop(self, session: 'ProfileSession'):
+        """Ends sampling, unbinds the session and stops tracing once no session needs it"""
+        if session.seconds is not None:
+            return
+        session.stop()
+        if self.current() is session:
+            self.active.set(None)
+        with self.lock:
+            self.sessions -= 1
+            if self.sessions == 0 and self.owns_tracing:
+                tracemalloc.stop()
+                self.owns_tracing = False
+
+class ProfileSession:
+    """
+    Stacks and stage allocations of one profiled request
+    A sampler thread reads the request thread's stack every interval,
+    wherever it is, so time spent waiting on Instagram shows up too
+    """
+    
+    def __init__(self, label: str, interval: float, top_allocations: int):
+        self.label = label
+        self.interval = interval
+        self.top_allocations = top_allocations
+        self.stacks = Counter()
+        self.stages = []
+        self.samples = 0
+        self.dump_id = None
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.seconds = None
+        self.traced_peak = 0
+        self.target = _current_target()
+        self.stopped = threading.Event()
+        self.sampler = threading.Thread(target=self._sample_loop, daemon=True)
+        self.sampler.start()
+    
+    @contextmanager
+    def stage(self, name: str):
+        """Records wall time, traced memory peak and the top allocating lines of a block"""
+        before = _snapshot()
+        start_bytes, peak = tracemalloc.get_traced_memory()
+        self.traced_peak = max(self.traced_peak, peak)
+        # The peak is process-wide: concurrent requests and profile download threads add to it
+        tracemalloc.reset_peak()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - started
+            current, peak = tracemalloc.get_traced_memory()
+            self.traced_peak = max(self.traced_peak, peak)
+            top = _snapshot().compare_to(before, 'lineno')[:self.top_allocations]
+            self.stages.append({
+                'stage': name,
+                'seconds': round(seconds, 6),
+                'peak_bytes': max(0, peak - start_bytes),
+                'net_bytes': current - start_bytes,
+                'top': [{'where': str(stat.traceback[0]), 'size_diff': stat.size_diff, 'count_diff': stat.count_diff}
+                        for stat in top if stat.size_diff > 0]
+            })
+    
+    def stop(self):
+        """Stops the sampler"""
+        self.seconds = time.perf_counter() - self.started
+        self.traced_peak = max(self.traced_peak, tracemalloc.get_traced_memory()[1])
+        self.stopped.set()
+        self.sampler.join()
+    
+    def collapsed(self) -> str:
+        """Returns stacks in collapsed format: one 'root;...;leaf count' line per distinct stack"""
+        return ''.join('%s %d\n' % (stack, count) for stack, count in self.stacks.most_common())
+    
+    def report(self) -> dict:
+        """Returns the JSON side of the dump"""
+        return {
+            'label': self.label,
+            'started_at': self.started_at,
+            'seconds': round(self.seconds or 0.0, 6),
+            'interval': self.interval,
+            'samples': self.samples,
+            'traced_peak_bytes': self.traced_peak,
+            'stages': self.stages
+        }
+    
+    def _sample_loop(self):
+        """Counts the target's current stack every interval until stopped"""
+        while not self.stopped.wait(self.interval):
+            frame = _frame_of(self.target)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                # A frame caught between instructions has no line number
+                lineno = frame.f_lineno or 0
+                names.append('%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename), lineno))
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(names))] += 1
+            self.samples += 1
+
+class ProfiledMetrics:
+    """Wraps a Metrics object so PROFILED_STAGES spans of profiled requests are also captured"""
+    
+    def __init__(self, metrics, profiler: RequestProfiler):
+        self.metrics = metrics
+        self.profiler = profiler
+    
+    def __getattr__(self, name):
+        return getattr(self.metrics, name)
+    
+    def span(self, stage: str, **labels):
+        session = self.profiler.current() if stage in PROFILED_STAGES else None
+        # A pool thread may still be busy after its request's session was dumped
+        if session is None or session.seconds is not None:
+            return self.metrics.span(stage, **labels)
+        return _both(self.metrics.span(stage, **labels), session.stage(stage))
+
+@contextmanager
+def _both(outer, inner):
+    with outer, inner:
+        yield
+
+def _current_target():
+    """Returns what the sampler reads stacks from: the current greenlet under gevent, else the thread id"""
+    try:
+        from gevent import monkey
+    except ImportError:
+        return threading.get_ident()
+    if monkey.is_module_patched('threading'):
+        import greenlet
+        return greenlet.getcurrent()
+    return threading.get_ident()
+
+def _frame_of(target):
+    """Returns the innermost frame of a thread id or greenlet"""
+    if isinstance(target, int):
+        return sys._current_frames().get(target)
+    # A greenlet that is not running exposes where it is suspended
+    return target.gr_frame
+
+def _snapshot() -> tracemalloc.Snapshot:
+    """Takes a tracemalloc snapshot without tracemalloc's own allocations"""
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__)
+    ))
+
+def _write_atomic(path: Path, text: str):
+    """Replaces a dump file in one rename, so readers never see a half-written one"""
+    temp = path.with_name('.%s.%d.%d' % (path.name, os.getpid(), threading.get_ident()))
+    temp.write_text(text, encoding='utf-8')
+    os.replace(temp, path)
@@ -1,14 +1,20 @@
 import time
-from collections import defaultdict
+from collections import OrderedDict
 from threading import Lock
+from utils.sqlite_store import SQLiteStore
 
 class RateLimiter:
-    """IP-based rate limiting"""
+    """
+    IP-based rate limiting with a sliding-window counter
+    Each client costs O(1) memory and time; idle clients are evicted
+    """
     
-    def __init__(self, max_requests: int = 20, window_seconds: int = 60):
+    def __init__(self, max_requests: int = 20, window_seconds: int = 60, max_clients: int = 100000):
         self.max_requests = max_requests
         self.window_seconds = window_seconds
-        self.requests = defaultdict(list)
+        self.max_clients = max_clients
+        # client_ip -> (window_start, current_count, previous_count), oldest access first
+        self.requests = OrderedDict()
         self.lock = Lock()
     
     def allow_request(self, client_ip: str) -> bool:
@@ -18,22 +24,108 @@ class RateLimiter:
         """
         with self.lock:
             current_time = time.time()
+            window_start = current_time - current_time % self.window_seconds
             
-            # Clean old requests
-            self.requests[client_ip] = [
-                req_time for req_time in self.requests[client_ip]
-                if current_time - req_time < self.window_seconds
-            ]
+            state = self.requests.pop(client_ip, None)
+            state = _roll(state or (window_start, 0, 0), window_start, self.window_seconds)
             
-            # Check if under limit
-            if len(self.requests[client_ip]) < self.max_requests:
-                self.requests[client_ip].append(current_time)
-                return True
+            allowed = _estimate(state, current_time, self.window_seconds) < self.max_requests
+            if allowed:
+                state = (state[0], state[1] + 1, state[2])
+            self.requests[client_ip] = state
             
-            return False
+            self._evict_idle(window_start)
+            return allowed
     
     def reset(self, client_ip: str):
         """Reset rate limit for IP"""
         with self.lock:
-            if client_ip in self.requests:
-                del self.requests[client_ip]
+            self.requests.pop(client_ip, None)
+    
+    def _evict_idle(self, window_start: float):
+        """Drops clients that no longer count against any window"""
+        while self.requests:
+            oldest_ip, oldest = next(iter(self.requests.items()))
+            if oldest[0] >= window_start - self.window_seconds and len(self.requests) <= self.max_clients:
+                break
+            del self.requests[oldest_ip]
+
+class SharedRateLimiter(SQLiteStore):
+    """Sliding-window rate limiting shared by all gunicorn workers"""
+    
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS clients (
+            ip TEXT PRIMARY KEY,
+            window_start REAL NOT NULL,
+            current INTEGER NOT NULL,
+            previous INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS clients_window_start ON clients (window_start);
+    '''
+    
+    def __init__(self, db_path: str, max_requests: int = 20, window_seconds: int = 60):
+        self.max_requests = max_requests
+        self.window_seconds = window_seconds
+        # Newest window this process has seen swept, so the shared marker is read once per window
+        self.purged_window = 0
+        super().__init__(db_path)
+    
+    def allow_request(self, client_ip: str) -> bool:
+        """
+        Checks if request is allowed based on rate limit
+        Returns: True if allowed, False if rate limit exceeded
+        """
+        current_time = time.time()
+        window_start = current_time - current_time % self.window_seconds
+        
+        with self._transaction() as conn:
+            row = conn.execute('SELECT window_start, current, previous FROM clients WHERE ip = ?',
+                               (client_ip,)).fetchone()
+            state = _roll(tuple(row) if row else (window_start, 0, 0), window_start, self.window_seconds)
+            
+            allowed = _estimate(state, current_time, self.window_seconds) < self.max_requests
+            if allowed:
+                conn.execute('INSERT OR REPLACE INTO clients (ip, window_start, current, previous) '
+                             'VALUES (?, ?, ?, ?)', (client_ip, state[0], state[1] + 1, state[2]))
+            else:
+                self._incr('rejected', conn=conn)
+            
+            # Idle clients are swept once per window by whichever worker gets there first;
+            # the swept window is kept in the shared counters table
+            window = int(window_start // self.window_seconds)
+            if window > self.purged_window:
+                self.purged_window = window
+                row = conn.execute("SELECT value FROM counters WHERE name = 'purged_window'").fetchone()
+                if row is None or row['value'] < window:
+                    conn.execute("INSERT OR REPLACE INTO counters (name, value) VALUES ('purged_window', ?)",
+                                 (window,))
+                    conn.execute('DELETE FROM clients WHERE window_start < ?',
+                                 (window_start - self.window_seconds,))
+        return allowed
+    
+    def reset(self, client_ip: str):
+        """Reset rate limit for IP"""
+        self._connect().execute('DELETE FROM clients WHERE ip = ?', (client_ip,))
+    
+    def stats(self) -> dict:
+        """Returns tracked client count and rejections"""
+        clients = self._connect().execute('SELECT COUNT(*) FROM clients').fetchone()[0]
+        return {
+            'clients': clients,
+            'max_requests': self.max_requests,
+            'window_seconds': self.window_seconds,
+            'rejected': self.counters().get('rejected', 0)
+        }
+
+def _roll(state: tuple, window_start: float, window_seconds: int) -> tuple:
+    """Moves a (window_start, current, previous) state into the current window"""
+    if state[0] == window_start:
+        return state
+    if state[0] == window_start - window_seconds:
+        return (window_start, 0, state[1])
+    return (window_start, 0, 0)
+
+def _estimate(state: tuple, current_time: float, window_seconds: int) -> float:
+    """Weights the previous window by how much of it still overlaps the sliding window"""
+    overlap = 1 - (current_time - state[0]) / window_seconds
+    return state[2] * overlap + state[1]
@@ -0,0 +1,237 @@
+import time
+import queue
+import threading
+from contextlib import contextmanager
+import requests
+from requests.adapters import HTTPAdapter
+import instaloader
+from instaloader import instaloadercontext
+from utils.metrics import NULL_METRICS
+from utils.upstream_health import UpstreamUnavailable, is_rate_limited
+
+_copy_session_hooked = False
+
+class _KeepAliveAdapter(HTTPAdapter):
+    """
+    Connection pool that survives the throwaway Sessions instaloader creates
+    Those Sessions close their adapters on exit; only shutdown() really closes
+    Every request passes the shared upstream circuit breaker, if there is one
+    """
+    
+    def __init__(self, health=None, **kwargs):
+        self.health = health
+        super().__init__(**kwargs)
+    
+    def send(self, request, **kwargs):
+        if self.health is None:
+            return super().send(request, **kwargs)
+        self.health.acquire()
+        try:
+            response = super().send(request, **kwargs)
+        except requests.RequestException:
+            self.health.record()
+            raise
+        retry_after = self.health.record(response.status_code, response.headers.get('Location', ''))
+        if retry_after is not None:
+            # Rate limited or login wall: no retries, every worker backs off
+            response.close()
+            raise UpstreamUnavailable(retry_after)
+        return response
+    
+    def close(self):
+        pass
+    
+    def shutdown(self):
+        super().close()
+
+class SessionPool:
+    """
+    Per-process pool of Instaloader instances with keep-alive connections
+    A loader is only ever used by one caller at a time; loaders that hit
+    429s or keep failing are retired and replaced on demand
+    """
+    
+    # Errors about the requested content, not about the session
+    CONTENT_ERRORS = (
+        instaloader.exceptions.QueryReturnedNotFoundException,
+        instaloader.exceptions.QueryReturnedBadRequestException,
+        instaloader.exceptions.ProfileNotExistsException,
+        instaloader.exceptions.BadResponseException
+    )
+    
+    def __init__(self, factory, size: int = 3, max_failures: int = 3, max_age: int = 3600,
+                 wait_timeout: float = 10.0, metrics=None, health=None):
+        self.factory = factory
+        self.health = health
+        self.metrics = metrics or NULL_METRICS
+        self.size = size
+        self.max_failures = max_failures
+        self.max_age = max_age
+        self.wait_timeout = wait_timeout
+        self.idle = queue.LifoQueue()
+        self.lock = threading.Lock()
+        self.created = 0
+        self.counts = {
+            'checkouts': 0,
+            'waits': 0,
+            'overflow': 0,
+            'retired_rate_limited': 0,
+            'retired_failing': 0,
+            'retired_expired': 0
+        }
+        _hook_copy_session()
+    
+    @contextmanager
+    def session(self):
+        """Checks a loader out for the duration of a with block"""
+        loader = self.checkout()
+        try:
+            yield loader
+        except BaseException as e:
+            self.checkin(loader, e)
+            raise
+        self.checkin(loader)
+    
+    def checkout(self):
+        """
+        Returns an idle loader, a new one while below size, or waits for one
+        If the wait times out a temporary overflow loader is handed out
+        instead, so nested checkouts can never deadlock
+        """
+        with self.lock:
+            self.counts['checkouts'] += 1
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        
+        with self.lock:
+            if self.created < self.size:
+                self.created += 1
+                return self._create()
+            self.counts['waits'] += 1
+        
+        try:
+            return self.idle.get(timeout=self.wait_timeout)
+        except queue.Empty:
+            with self.lock:
+                self.counts['overflow'] += 1
+            loader = self._create()
+            loader.pool_overflow = True
+            return loader
+    
+    def checkin(self, loader, error: BaseException = None):
+        """Returns a loader to the pool, retiring it if it went bad"""
+        # Job timeouts, non-Exception errors and an open circuit say nothing about the session
+        if isinstance(error, UpstreamUnavailable):
+            error = None
+        elif isinstance(error, Exception) and not isinstance(error, self.CONTENT_ERRORS):
+            loader.pool_failures += 1
+        elif error is None:
+            loader.pool_failures = 0
+        
+        if isinstance(error, Exception):
+            self.metrics.incr('upstream_errors_total', type=type(error).__name__)
+        
+        reason = None
+        if error is not None and is_rate_limited(error):
+            self.metrics.incr('upstream_rate_limited_total')
+            reason = 'retired_rate_limited'
+        elif loader.pool_failures >= self.max_failures:
+            reason = 'retired_failing'
+        elif time.time() - loader.pool_created > self.max_age:
+            reason = 'retired_expired'
+        
+        if getattr(loader, 'pool_overflow', False):
+            self._close(loader)
+            return
+        if reason is None:
+            self.idle.put(loader)
+            return
+        
+        with self.lock:
+            self.counts[reason] += 1
+            self.created -= 1
+        self._close(loader)
+    
+    def warm(self, urls: tuple = ()):
+        """
+        Creates all loaders up front and optionally opens a connection to
+        each url, so the first requests skip DNS and TLS setup
+        """
+        loaders = []
+        with self.lock:
+            while self.created < self.size:
+                self.created += 1
+                loaders.append(self._create())
+        
+        for loader in loaders:
+            for url in urls:
+                try:
+                    with loader.context.get_anonymous_session() as session:
+                        session.head(url, timeout=5).close()
+                except Exception:
+                    pass
+            self.idle.put(loader)
+    
+    def stats(self) -> dict:
+        """Returns pool size, usage and retirement counters for this process"""
+        with self.lock:
+            stats = dict(self.counts)
+            stats.update(size=self.size, created=self.created, idle=self.idle.qsize())
+        stats['in_use'] = stats['created'] - stats['idle']
+        return stats
+    
+    def _create(self):
+        """Builds a loader whose sessions all share one keep-alive adapter"""
+        loader = self.factory()
+        context = loader.context
+        adapter = _KeepAliveAdapter(health=self.health, pool_connections=4, pool_maxsize=8)
+        make_session = context.get_anonymous_session
+        
+        def get_anonymous_session():
+            session = make_session()
+            _mount(session, adapter)
+            return session
+        
+        context.get_anonymous_session = get_anonymous_session
+        _mount(context._session, adapter)
+        
+        loader.pool_adapter = adapter
+        loader.pool_created = time.time()
+        loader.pool_failures = 0
+        return loader
+    
+    def _close(self, loader):
+        """Drops a loader and its connections"""
+        try:
+            loader.close()
+        finally:
+            loader.pool_adapter.shutdown()
+
+def _mount(session, adapter):
+    """Routes a session through a shared keep-alive adapter"""
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.keepalive_adapter = adapter
+
+def _hook_copy_session():
+    """
+    Instaloader copies its session into a fresh requests.Session for every
+    GraphQL and API query; mount the source's keep-alive adapter on the copy
+    Sessions that did not come from a pool are left alone
+    """
+    global _copy_session_hooked
+    if _copy_session_hooked:
+        return
+    copy_session = instaloadercontext.copy_session
+    
+    def pooled_copy_session(session, request_timeout=None):
+        new = copy_session(session, request_timeout)
+        adapter = getattr(session, 'keepalive_adapter', None)
+        if adapter is not None:
+            _mount(new, adapter)
+        return new
+    
+    instaloadercontext.copy_session = pooled_copy_session
+    _copy_session_hooked = True
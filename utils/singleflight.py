@@ -0,0 +1,106 @@
+import os
+import json
+import time
+from pathlib import Path
+from utils.sqlite_store import SQLiteStore
+
+try:
+    import fcntl
+except ImportError:
+    # No flock on Windows; every request fetches on its own there
+    fcntl = None
+
+class SingleFlight(SQLiteStore):
+    """
+    Coalesces identical in-flight downloads across worker processes
+    The first request for a key holds a lock file and fetches; duplicates
+    wait on the lock and reuse the result record it leaves behind
+    """
+    
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS flights (
+            key TEXT PRIMARY KEY,
+            result TEXT NOT NULL,
+            finished_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS flights_finished_at ON flights (finished_at);
+    '''
+    
+    def __init__(self, lock_dir: str, wait_timeout: int = 120, poll_interval: float = 0.1,
+                 record_ttl: int = 600):
+        self.lock_dir = Path(lock_dir)
+        self.lock_dir.mkdir(parents=True, exist_ok=True)
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self.record_ttl = record_ttl
+        super().__init__(self.lock_dir / 'singleflight.db')
+    
+    def do(self, key: str, fn) -> dict:
+        """
+        Runs fn() once for all concurrent callers with the same key
+        fn must return a JSON-serializable dict
+        """
+        if fcntl is None:
+            self._incr('leader')
+            return fn()
+        
+        started = time.time()
+        lock_path = self.lock_dir / (key + '.lock')
+        
+        while True:
+            fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if not self._lock(fd, started):
+                    # Leader is stuck; don't wait forever
+                    self._incr('wait_timeouts')
+                    return fn()
+                
+                record = self._connect().execute(
+                    'SELECT result FROM flights WHERE key = ? AND finished_at >= ?', (key, started)
+                ).fetchone()
+                if record:
+                    self._incr('coalesced')
+                    return json.loads(record['result'])
+                
+                # The leader unlinks the lock file when done; if we locked a stale
+                # inode, start over. If it is still there the leader died.
+                try:
+                    if os.stat(lock_path).st_ino != os.fstat(fd).st_ino:
+                        continue
+                except FileNotFoundError:
+                    continue
+                
+                self._incr('leader')
+                result = fn()
+                now = time.time()
+                with self._transaction() as conn:
+                    conn.execute('DELETE FROM flights WHERE finished_at < ?', (now - self.record_ttl,))
+                    conn.execute('INSERT OR REPLACE INTO flights (key, result, finished_at) VALUES (?, ?, ?)',
+                                 (key, json.dumps(result), now))
+                lock_path.unlink(missing_ok=True)
+                return result
+            finally:
+                os.close(fd)
+    
+    def stats(self) -> dict:
+        """Returns leader/coalesced counters"""
+        counters = self.counters()
+        return {
+            'leader': counters.get('leader', 0),
+            'coalesced': counters.get('coalesced', 0),
+            'wait_timeouts': counters.get('wait_timeouts', 0)
+        }
+    
+    def _lock(self, fd: int, started: float) -> bool:
+        """
+        Takes the exclusive lock, polling so cooperative workers are not blocked
+        Returns: False if the wait timed out
+        """
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except BlockingIOError:
+                if time.time() - started > self.wait_timeout:
+                    return False
+                time.sleep(self.poll_interval)
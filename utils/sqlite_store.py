@@ -0,0 +1,90 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+class SQLiteStore:
+    """Base class for small SQLite databases shared by all gunicorn workers"""
+    
+    SCHEMA = ''
+    
+    def __init__(self, db_path: str):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = _os_thread_local()
+        
+        conn = self._connect()
+        conn.executescript(
+            'CREATE TABLE IF NOT EXISTS counters ('
+            ' name TEXT PRIMARY KEY,'
+            ' value INTEGER NOT NULL DEFAULT 0);'
+            + self.SCHEMA
+        )
+    
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Returns the connection for the current thread
+        Connections are never shared across threads or forked processes;
+        greenlets of one thread share it, as no statement or transaction
+        body here ever yields to another greenlet
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(str(self.db_path), timeout=30, isolation_level=None,
+                                   check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+    
+    @contextmanager
+    def _transaction(self):
+        """Runs a block inside a write transaction (BEGIN IMMEDIATE)"""
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+    
+    def _incr(self, name: str, amount: int = 1, conn: sqlite3.Connection = None):
+        """Increments a shared counter"""
+        (conn or self._connect()).execute(
+            'INSERT INTO counters (name, value) VALUES (?, ?) '
+            'ON CONFLICT(name) DO UPDATE SET value = value + excluded.value',
+            (name, amount)
+        )
+    
+    def counters(self) -> dict:
+        """Returns all shared counters as a dict"""
+        rows = self._connect().execute('SELECT name, value FROM counters').fetchall()
+        return {row['name']: row['value'] for row in rows}
+
+def pid_alive(pid: int) -> bool:
+    """Checks whether the worker process that wrote a row still exists"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Exists, owned by another user
+        pass
+    return True
+
+def _os_thread_local():
+    """
+    threading.local keyed by OS thread even under gevent monkey-patching,
+    where the patched one would open a connection per request greenlet
+    """
+    try:
+        from gevent import monkey
+    except ImportError:
+        return threading.local()
+    if monkey.is_module_patched('threading'):
+        return monkey.get_original('threading', 'local')()
+    return threading.local()
@@ -0,0 +1,59 @@
+import os
+import time
+import uuid
+import shutil
+import hashlib
+from contextlib import contextmanager
+from pathlib import Path
+
+# Private per-download directories live here, next to the shards they are renamed into
+STAGING_DIR = 'tmp'
+
+def shard_path(directory, name: str) -> Path:
+    """
+    Returns where a file lives below directory, sharded by a hash of its
+    name so no directory grows huge and the path follows from the name alone
+    """
+    return Path(directory) / hashlib.sha1(name.encode('utf-8')).hexdigest()[:2] / name
+
+@contextmanager
+def staging(directory):
+    """
+    Yields a fresh directory only the caller writes to, on the same
+    filesystem as directory so finished files can be renamed into place
+    Removed with anything left in it when the block ends
+    """
+    path = Path(directory) / STAGING_DIR / uuid.uuid4().hex
+    path.mkdir(parents=True)
+    try:
+        yield path
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+def commit(source, target) -> Path:
+    """Atomically renames a staged file into its final path, replacing an older one"""
+    target = Path(target)
+    target.parent.mkdir(exist_ok=True)
+    os.replace(source, target)
+    return target
+
+def sweep_staging(directory, max_age_seconds: int) -> int:
+    """
+    Removes staging directories left behind by killed workers
+    Only the background cleaner lists this directory
+    Returns: number of removed directories
+    """
+    staging_root = Path(directory) / STAGING_DIR
+    if not staging_root.is_dir():
+        return 0
+    
+    removed = 0
+    cutoff = time.time() - max_age_seconds
+    for entry in os.scandir(staging_root):
+        try:
+            if entry.is_dir() and entry.stat().st_mtime < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
@@ -0,0 +1,116 @@
+import requests
+from contextlib import ExitStack
+from werkzeug.wsgi import ClosingIterator
+from utils import storage
+from utils.upstream_health import UpstreamUnavailable
+
+class StreamProxy:
+    """
+    Pipes upstream video bytes straight to the client
+    Optionally tees them into the media cache; at most one chunk is held
+    in memory and partial files are discarded when the client goes away
+    """
+    
+    # Upstream statuses that mean the signed CDN URL is no longer valid
+    EXPIRED_STATUSES = (403, 404, 410)
+    
+    def __init__(self, media_cache=None, tee: bool = True, chunk_size: int = 64 * 1024,
+                 timeout: int = 30, pacer=None, health=None):
+        self.media_cache = media_cache
+        self.tee = tee and media_cache is not None
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.pacer = pacer
+        self.health = health
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+    
+    def open(self, shortcode: str, video_url: str, owner: str = '', caption: str = '',
+             byte_range: str = None) -> dict:
+        """
+        Starts the upstream request and returns before any body bytes are read
+        Returns: dict with success, status, headers, body (iterable to close) or error
+        """
+        headers = {'Accept-Encoding': 'identity'}
+        if byte_range:
+            headers['Range'] = byte_range
+        
+        if self.health is not None:
+            try:
+                self.health.acquire()
+            except UpstreamUnavailable as e:
+                return {'success': False, 'error': str(e), 'status': 503, 'retry_after': e.retry_after}
+        if self.pacer is not None:
+            self.pacer.acquire()
+        try:
+            upstream = self.session.get(video_url, headers=headers, stream=True, timeout=self.timeout)
+        except requests.RequestException as e:
+            if self.health is not None:
+                self.health.record()
+            return {'success': False, 'error': 'Upstream error: ' + str(e), 'status': 502}
+        retry_after = self.health.record(upstream.status_code) if self.health is not None else None
+        if retry_after is not None:
+            upstream.close()
+            return {'success': False, 'error': str(UpstreamUnavailable(retry_after)), 'status': 503,
+                    'retry_after': retry_after}
+        
+        if upstream.status_code not in (200, 206):
+            upstream.close()
+            return {
+                'success': False,
+                'error': 'Upstream returned ' + str(upstream.status_code),
+                'status': 502,
+                'expired': upstream.status_code in self.EXPIRED_STATUSES
+            }
+        
+        response_headers = {
+            'Content-Type': upstream.headers.get('Content-Type', 'video/mp4'),
+            'Accept-Ranges': 'bytes'
+        }
+        for name in ('Content-Length', 'Content-Range'):
+            if name in upstream.headers:
+                response_headers[name] = upstream.headers[name]
+        
+        # Only a complete, unranged body can become a cache entry
+        tee = self.tee and upstream.status_code == 200 and 'Content-Length' in upstream.headers
+        
+        # Closing the body releases the connection even if it was never iterated
+        return {
+            'success': True,
+            'status': upstream.status_code,
+            'headers': response_headers,
+            'body': ClosingIterator(self._relay(upstream, shortcode, owner, caption, tee), upstream.close)
+        }
+    
+    def _relay(self, upstream, shortcode: str, owner: str, caption: str, tee: bool):
+        """
+        Yields upstream chunks; the WSGI server closes this generator when the
+        client disconnects, which lands in the finally block below
+        """
+        part = None
+        f = None
+        complete = False
+        # The staging directory and any partial file in it go away with the generator
+        cleanup = ExitStack()
+        try:
+            if tee:
+                part = cleanup.enter_context(storage.staging(self.media_cache.media_dir)) / (shortcode + '.mp4')
+                f = open(part, 'wb')
+            
+            expected = int(upstream.headers.get('Content-Length', -1))
+            received = 0
+            for chunk in upstream.iter_content(self.chunk_size):
+                if f is not None:
+                    f.write(chunk)
+                received += len(chunk)
+                yield chunk
+            complete = expected < 0 or received == expected
+            
+            if f is not None and complete:
+                f.close()
+                f = None
+                self.media_cache.put(shortcode, part, owner, caption)
+        finally:
+            if f is not None:
+                f.close()
+            cleanup.close()
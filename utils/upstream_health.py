@@ -0,0 +1,205 @@
+import time
+import random
+from utils.sqlite_store import SQLiteStore
+
+class UpstreamUnavailable(Exception):
+    """Raised instead of calling Instagram while the circuit is open"""
+    
+    def __init__(self, retry_after: float):
+        super().__init__('Instagram is temporarily unavailable, retry in %d seconds' % max(1, round(retry_after)))
+        self.retry_after = retry_after
+
+class UpstreamHealth(SQLiteStore):
+    """
+    Circuit breaker over every upstream HTTP request, shared by all workers
+    A 429 or login wall, or too many failures within the window, opens the
+    circuit for an exponentially growing, jittered backoff. After that one
+    probe request is let through; it closes the circuit or reopens it
+    """
+    
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS circuit (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            state TEXT NOT NULL,
+            level INTEGER NOT NULL,
+            retry_at REAL NOT NULL,
+            probe_until REAL NOT NULL,
+            changed_at REAL NOT NULL,
+            reason TEXT NOT NULL
+        );
+        INSERT OR IGNORE INTO circuit VALUES (1, 'closed', 0, 0, 0, 0, '');
+        CREATE TABLE IF NOT EXISTS outcomes (
+            bucket INTEGER PRIMARY KEY,
+            ok INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0
+        );
+    '''
+    
+    BUCKET_SECONDS = 10
+    
+    def __init__(self, db_path: str, window_seconds: int = 60, failure_ratio: float = 0.5,
+                 min_requests: int = 10, base_backoff: float = 5.0, max_backoff: float = 600.0,
+                 probe_timeout: float = 30.0, max_wait: float = 0.0):
+        self.window_seconds = window_seconds
+        self.failure_ratio = failure_ratio
+        self.min_requests = min_requests
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.probe_timeout = probe_timeout
+        # Callers wait this long for the circuit to close before failing
+        self.max_wait = max_wait
+        super().__init__(db_path)
+    
+    def acquire(self):
+        """
+        Returns once a request may go upstream
+        Raises UpstreamUnavailable if that is more than max_wait away
+        """
+        deadline = time.time() + self.max_wait
+        while True:
+            wait = self._admit()
+            if wait <= 0:
+                return
+            if time.time() + wait > deadline:
+                self._incr('rejected')
+                raise UpstreamUnavailable(wait)
+            time.sleep(wait)
+    
+    def record(self, status: int = None, location: str = ''):
+        """
+        Records the outcome of one upstream request
+        status is None when the request failed without a response
+        Returns: seconds until retry if this response opened the circuit, else None
+        """
+        if status == 429:
+            return self._trip('rate_limited')
+        if '/accounts/login' in location:
+            return self._trip('login_wall')
+        
+        failed = status is None or status >= 500
+        now = time.time()
+        bucket = int(now // self.BUCKET_SECONDS)
+        with self._transaction() as conn:
+            conn.execute(
+                'INSERT INTO outcomes (bucket, ok, failed) VALUES (?, ?, ?) '
+                'ON CONFLICT(bucket) DO UPDATE SET ok = ok + excluded.ok, failed = failed + excluded.failed',
+                (bucket, int(not failed), int(failed))
+            )
+            state = conn.execute('SELECT state FROM circuit WHERE id = 1').fetchone()['state']
+            
+            if not failed:
+                if state == 'half_open':
+                    # Probe succeeded; the backoff level is kept until traffic stays healthy
+                    conn.execute("UPDATE circuit SET state = 'closed', changed_at = ?, reason = '' WHERE id = 1",
+                                 (now,))
+                    self._incr('closed', conn=conn)
+                return
+            
+            if state == 'half_open':
+                self._open(conn, now, 'probe_failed')
+                return
+            if state != 'closed':
+                return
+            
+            first = bucket - self.window_seconds // self.BUCKET_SECONDS
+            conn.execute('DELETE FROM outcomes WHERE bucket < ?', (first,))
+            row = conn.execute('SELECT COALESCE(SUM(ok), 0) AS ok, COALESCE(SUM(failed), 0) AS failed '
+                               'FROM outcomes WHERE bucket >= ?', (first,)).fetchone()
+            total = row['ok'] + row['failed']
+            if total >= self.min_requests and row['failed'] >= total * self.failure_ratio:
+                self._open(conn, now, 'error_rate')
+    
+    def stats(self) -> dict:
+        """Returns circuit state, backoff, recent error rate and counters"""
+        conn = self._connect()
+        now = time.time()
+        circuit = conn.execute('SELECT * FROM circuit WHERE id = 1').fetchone()
+        row = conn.execute('SELECT COALESCE(SUM(ok), 0) AS ok, COALESCE(SUM(failed), 0) AS failed '
+                           'FROM outcomes WHERE bucket >= ?',
+                           (int((now - self.window_seconds) // self.BUCKET_SECONDS),)).fetchone()
+        total = row['ok'] + row['failed']
+        counters = self.counters()
+        return {
+            'state': circuit['state'],
+            'reason': circuit['reason'],
+            'level': circuit['level'],
+            'retry_in': round(max(0.0, circuit['retry_at'] - now), 1) if circuit['state'] == 'open' else 0.0,
+            'requests': total,
+            'error_rate': round(row['failed'] / total, 3) if total else 0.0,
+            'opened': counters.get('opened', 0),
+            'closed': counters.get('closed', 0),
+            'probes': counters.get('probes', 0),
+            'rejected': counters.get('rejected', 0)
+        }
+    
+    def _admit(self) -> float:
+        """
+        Lets a request through, taking the probe slot once the backoff is over
+        Returns: 0 if admitted, else seconds until the next attempt makes sense
+        """
+        now = time.time()
+        circuit = self._connect().execute('SELECT state, retry_at, probe_until FROM circuit WHERE id = 1').fetchone()
+        if circuit['state'] == 'closed':
+            return 0.0
+        if circuit['state'] == 'open' and now < circuit['retry_at']:
+            return circuit['retry_at'] - now
+        if circuit['state'] == 'half_open' and now < circuit['probe_until']:
+            return circuit['probe_until'] - now
+        
+        # Backoff over, or the last probe never reported back: one caller probes
+        with self._transaction() as conn:
+            taken = conn.execute(
+                "UPDATE circuit SET state = 'half_open', probe_until = ?, changed_at = ? "
+                "WHERE id = 1 AND state = ? AND retry_at = ? AND probe_until = ?",
+                (now + self.probe_timeout, now, circuit['state'], circuit['retry_at'], circuit['probe_until'])
+            ).rowcount
+            if taken:
+                self._incr('probes', conn=conn)
+        return 0.0 if taken else self.probe_timeout
+    
+    def _trip(self, reason: str) -> float:
+        """
+        Opens the circuit right away, e.g. on a 429 from any worker
+        Returns: seconds until retry
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            circuit = conn.execute('SELECT state, retry_at FROM circuit WHERE id = 1').fetchone()
+            # Requests still in flight when it opened say nothing new
+            if circuit['state'] == 'open':
+                return max(0.0, circuit['retry_at'] - now)
+            return self._open(conn, now, reason) - now
+    
+    def _open(self, conn, now: float, reason: str) -> float:
+        """
+        Opens the circuit for base_backoff * 2^level seconds with equal jitter
+        Returns: time of the next probe
+        """
+        circuit = conn.execute('SELECT state, level, changed_at FROM circuit WHERE id = 1').fetchone()
+        level = min(circuit['level'] + 1, 32)
+        if circuit['state'] == 'closed' and now - circuit['changed_at'] > self.max_backoff:
+            # Healthy for a long stretch; start over at the base backoff
+            level = 1
+        backoff = min(self.max_backoff, self.base_backoff * 2 ** (level - 1))
+        retry_at = now + backoff / 2 + random.uniform(0, backoff / 2)
+        conn.execute(
+            "UPDATE circuit SET state = 'open', level = ?, retry_at = ?, probe_until = 0, changed_at = ?, "
+            "reason = ? WHERE id = 1",
+            (level, retry_at, now, reason)
+        )
+        self._incr('opened', conn=conn)
+        return retry_at
+
+def is_rate_limited(error: BaseException) -> bool:
+    """
+    Instaloader wraps a final 429 in ConnectionException, and errors raised
+    while handling one only carry it as context; walk both chains
+    """
+    import instaloader
+    seen = set()
+    while error is not None and id(error) not in seen:
+        if isinstance(error, instaloader.exceptions.TooManyRequestsException) or '429' in str(error):
+            return True
+        seen.add(id(error))
+        error = error.__cause__ or error.__context__
+    return False
@@ -96,3 +96,55 @@ class InputValidator:
             if match:
                 return match.group(1)
         return None
+    
+    def parse_profile_limits(self, data: dict, caps: dict) -> dict:
+        """
+        Reads optional per-request profile limits (max_posts, max_mb, max_seconds,
+        manifest); each is capped by the server's limit in caps, 0 meaning none
+        Returns: dict with max_posts, max_bytes, max_seconds, manifest
+        """
+        limits = {'manifest': bool(data.get('manifest', caps.get('manifest', False)))}
+        for name, field, scale in (('max_posts', 'max_posts', 1), ('max_bytes', 'max_mb', 1024 * 1024),
+                                   ('max_seconds', 'max_seconds', 1)):
+            cap = caps.get(name) or 0
+            try:
+                requested = max(0, int(data.get(field) or 0)) * scale
+            except (TypeError, ValueError):
+                requested = 0
+            limits[name] = min(requested, cap) if requested and cap else requested or cap
+        return limits
+    
+    def parse_batch(self, entries: list, max_items: int = 200) -> dict:
+        """
+        Validates, classifies and deduplicates a list of inputs in one pass
+        Returns: dict with items (type, key, input) and rejected (input, error)
+        """
+        items = []
+        rejected = []
+        seen = set()
+        
+        for entry in entries:
+            entry = str(entry).strip()
+            if not entry:
+                continue
+            
+            is_valid, error = self.validate_input(entry)
+            input_type = self.detect_input_type(entry.lstrip('@')) if is_valid else 'unknown'
+            if input_type == 'post':
+                key = self.extract_shortcode(entry)
+            elif input_type == 'profile':
+                key = self.sanitize_input(entry)
+            else:
+                rejected.append({'input': entry, 'error': error or 'Invalid Instagram URL'})
+                continue
+            
+            if (input_type, key) in seen:
+                continue
+            if len(items) >= max_items:
+                rejected.append({'input': entry, 'error': 'Batch limit of ' + str(max_items) + ' items reached'})
+                continue
+            
+            seen.add((input_type, key))
+            items.append({'type': input_type, 'key': key, 'input': entry})
+        
+        return {'items': items, 'rejected': rejected}
@@ -1,11 +1,46 @@
 import os
+import json
+import shutil
 import zipfile
 import uuid
 from pathlib import Path
+from utils.metrics import NULL_METRICS
+
+# Already-compressed media gains nothing from DEFLATE
+STORED_EXTENSIONS = {'.mp4', '.mov', '.jpg', '.jpeg', '.png', '.webp', '.zip'}
+
+# Separates the per-file blocks of a profile's captions.txt
+CAPTION_SEPARATOR = '-' * 80 + '\n\n'
+
+class _StreamSink:
+    """Unseekable file-like object that collects ZIP output for streaming"""
+    
+    def __init__(self):
+        self.chunks = []
+        self.offset = 0
+    
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.offset += len(data)
+        return len(data)
+    
+    def tell(self):
+        return self.offset
+    
+    def flush(self):
+        pass
+    
+    def drain(self) -> bytes:
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
 
 class ZipCreator:
     """Creates ZIP files for bulk downloads"""
     
+    def __init__(self, metrics=None):
+        self.metrics = metrics or NULL_METRICS
+    
     def create_profile_zip(self, source_dir: str, username: str) -> dict:
         """
         Creates a ZIP file from profile download directory
@@ -28,12 +63,11 @@ class ZipCreator:
             zip_filepath = zips_dir / zip_filename
             
             # Create ZIP file
-            with zipfile.ZipFile(zip_filepath, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                for root, dirs, files in os.walk(source_path):
-                    for file in files:
-                        file_path = Path(root) / file
-                        arcname = file_path.relative_to(source_path)
-                        zipf.write(file_path, arcname)
+            with self.metrics.span('zip_create'):
+                with zipfile.ZipFile(zip_filepath, 'w', zipfile.ZIP_DEFLATED) as zipf:
+                    for file_path, arcname in self._walk(source_path):
+                        zipf.write(file_path, arcname, compress_type=self._compression_for(file_path))
+            self.metrics.incr('zip_bytes_total', zip_filepath.stat().st_size, mode='disk')
             
             return {
                 'success': True,
@@ -46,3 +80,115 @@ class ZipCreator:
                 'success': False,
                 'error': f'Failed to create ZIP: {str(e)}'
             }
+    
+    def append_profile_zip(self, previous_path: str, source_dir: str, username: str, max_added: int) -> dict:
+        """
+        Creates a profile ZIP from a copy of a previous one, adding only the
+        media it lacks and rewriting the text files; readers of the previous
+        archive are not affected
+        Returns: dict with success, filename, filepath, added, error;
+        None if more than max_added media files are missing
+        """
+        try:
+            source_path = Path(source_dir)
+            previous = Path(previous_path)
+            with zipfile.ZipFile(previous) as zipf:
+                existing = set(zipf.namelist())
+            files = [(file_path, arcname.as_posix()) for file_path, arcname in self._walk(source_path)]
+            added = sum(1 for file_path, arcname in files
+                        if arcname not in existing and self._compression_for(file_path) == zipfile.ZIP_STORED)
+            if added > max_added:
+                return None
+            
+            unique_id = uuid.uuid4().hex[:8]
+            zip_filename = f"{username}_{unique_id}.zip"
+            zip_filepath = previous.parent / zip_filename
+            
+            with self.metrics.span('zip_append'):
+                shutil.copyfile(previous, zip_filepath)
+                copied = zip_filepath.stat().st_size
+                media = {arcname for file_path, arcname in files
+                         if self._compression_for(file_path) == zipfile.ZIP_STORED}
+                with zipfile.ZipFile(zip_filepath, 'a', allowZip64=True) as zipf:
+                    for file_path, arcname in files:
+                        compress_type = self._compression_for(file_path)
+                        if arcname not in existing:
+                            zipf.write(file_path, arcname, compress_type=compress_type)
+                            continue
+                        if compress_type == zipfile.ZIP_STORED:
+                            continue
+                        # Dropped from the central directory; its old bytes stay behind unreferenced
+                        old_text = zipf.read(arcname).decode('utf-8')
+                        zipf.filelist.remove(zipf.NameToInfo.pop(arcname))
+                        text = file_path.read_text(encoding='utf-8') + _older_entries(arcname, old_text, media)
+                        zipf.writestr(arcname, text, compress_type=compress_type)
+            self.metrics.incr('zip_bytes_total', zip_filepath.stat().st_size - copied, mode='append')
+            
+            return {
+                'success': True,
+                'filename': zip_filename,
+                'filepath': str(zip_filepath),
+                'added': added
+            }
+            
+        except Exception as e:
+            return {
+                'success': False,
+                'error': f'Failed to append to ZIP: {str(e)}'
+            }
+    
+    def stream_profile_zip(self, source_dir: str, chunk_size: int = 1024 * 1024):
+        """
+        Generates a ZIP archive of a profile directory chunk by chunk
+        Media is STORED, text is DEFLATED and ZIP64 is used when needed,
+        so the archive is never materialized in memory or on disk
+        """
+        sink = _StreamSink()
+        # Includes the time the client takes to read; a dropped client ends the span early
+        with self.metrics.span('zip_stream'), zipfile.ZipFile(sink, 'w', allowZip64=True) as zipf:
+            for file_path, arcname in self._walk(Path(source_dir)):
+                zinfo = zipfile.ZipInfo.from_file(file_path, arcname)
+                zinfo.compress_type = self._compression_for(file_path)
+                
+                with open(file_path, 'rb') as src, zipf.open(zinfo, 'w') as dest:
+                    while True:
+                        block = src.read(chunk_size)
+                        if not block:
+                            break
+                        dest.write(block)
+                        data = sink.drain()
+                        if data:
+                            yield data
+        
+        # Data descriptor of the last entry and the central directory
+        data = sink.drain()
+        self.metrics.incr('zip_bytes_total', sink.tell(), mode='stream')
+        if data:
+            yield data
+    
+    def _walk(self, source_path: Path):
+        """Yields (file_path, arcname) for every file below source_path"""
+        for root, dirs, files in os.walk(source_path):
+            for file in files:
+                file_path = Path(root) / file
+                yield file_path, file_path.relative_to(source_path)
+    
+    def _compression_for(self, file_path: Path) -> int:
+        """Picks STORED for media and DEFLATED for everything else"""
+        if file_path.suffix.lower() in STORED_EXTENSIONS:
+            return zipfile.ZIP_STORED
+        return zipfile.ZIP_DEFLATED
+
+def _older_entries(arcname: str, old_text: str, current: set) -> str:
+    """
+    Keeps the captions.txt blocks or manifest.jsonl lines of media an
+    appended archive still holds but the new result no longer lists
+    """
+    if arcname == 'manifest.jsonl':
+        lines = old_text.splitlines(keepends=True)
+        return ''.join(line for line in lines if json.loads(line)['file'] not in current)
+    if arcname == 'captions.txt':
+        blocks = old_text.split(CAPTION_SEPARATOR)
+        return ''.join(block + CAPTION_SEPARATOR for block in blocks
+                       if block.startswith('File: ') and block.split('\n', 1)[0][6:] not in current)
+    return ''